@@ -0,0 +1,407 @@
+# Modello della temperatura dell'acqua e archivio su disco del suo stato termico
+
+import mmap
+import os
+import pickle
+import threading
+import time
+import warnings
+import zlib
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import numpy as np
+
+from database_pesca import get_water
+
+try:
+    import fcntl
+except ImportError:  # Windows: resta solo il lock tra thread
+    fcntl = None
+
+WATER_TEMP_STORE_FILE = "water_temp_history.bin"
+# Vecchio formato pickle, importato una sola volta se presente
+LEGACY_HISTORY_FILE = "water_temp_history.pkl"
+
+# Un record per zona e giorno: zona (crc32 del nome), giorno (ordinale), stato termico
+WATER_TEMP_RECORD = np.dtype([
+    ('zone', '<u4'),
+    ('day', '<i4'),
+    ('temp', '<f8'),
+    ('heat_accumulation', '<f8'),
+    ('air_temp', '<f8'),
+    ('seasonal_base', '<f8')
+])
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+HISTORY_DAYS = 30
+# La compattazione gira in background al massimo una volta ogni ora
+COMPACTION_INTERVAL = 3600
+
+
+class WaterStateWarning(UserWarning):
+    """Lo stato termico salvato non si può far avanzare fino a oggi: si riparte dalla media stagionale"""
+
+
+def zone_id(location_name):
+    """Identificativo numerico stabile della zona"""
+    return zlib.crc32(location_name.encode('utf-8'))
+
+
+class WaterTempStore:
+    """Storico temperature acqua: letture via mmap, scritture in append con file lock.
+
+    last_state legge da un indice in memoria zona -> giorno -> ultimo record, che a
+    ogni chiamata legge solo i record aggiunti in coda (anche da altre sessioni) e
+    si ricostruisce se il file è stato sostituito dalla compattazione.
+    """
+
+    def __init__(self, path=WATER_TEMP_STORE_FILE, legacy_path=LEGACY_HISTORY_FILE):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._thread_lock = threading.Lock()
+        self._compacting = False
+        self._last_compaction = 0.0
+        self._index_lock = threading.Lock()
+        self._index = {}
+        self._indexed_size = 0
+        self._indexed_file = None
+        if not os.path.exists(self.path) and legacy_path and os.path.exists(legacy_path):
+            self._import_legacy(legacy_path)
+
+    @contextmanager
+    def _locked(self):
+        """Lock esclusivo tra thread e processi (file .lock separato, sopravvive alla compattazione)"""
+        with self._thread_lock:
+            with open(self.lock_path, 'a') as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _scan(self, select):
+        """Applica select() ai record mappati in memoria e restituisce il suo risultato"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return select(np.empty(0, dtype=WATER_TEMP_RECORD))
+        # Un eventuale record scritto a metà da un'altra sessione viene ignorato
+        count = size // WATER_TEMP_RECORD.itemsize
+        if count == 0:
+            return select(np.empty(0, dtype=WATER_TEMP_RECORD))
+
+        with open(self.path, 'rb') as f:
+            with mmap.mmap(f.fileno(), count * WATER_TEMP_RECORD.itemsize, access=mmap.ACCESS_READ) as mm:
+                records = np.frombuffer(mm, dtype=WATER_TEMP_RECORD, count=count)
+                result = select(records)
+                del records
+        return result
+
+    def _refresh_index(self):
+        """Aggiunge all'indice i record scritti dopo l'ultima lettura (da chiamare con _index_lock)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self._index, self._indexed_size, self._indexed_file = {}, 0, None
+            return
+        file_id = (stat.st_dev, stat.st_ino)
+        if file_id != self._indexed_file or stat.st_size < self._indexed_size:
+            # File nuovo o compattato: si riparte dall'inizio
+            self._index, self._indexed_size, self._indexed_file = {}, 0, file_id
+        # Un eventuale record scritto a metà da un'altra sessione viene letto alla prossima chiamata
+        size = stat.st_size - stat.st_size % WATER_TEMP_RECORD.itemsize
+        if size <= self._indexed_size:
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._indexed_size)
+                data = f.read(size - self._indexed_size)
+        except OSError:
+            return
+        count = len(data) // WATER_TEMP_RECORD.itemsize
+        records = np.frombuffer(data, dtype=WATER_TEMP_RECORD, count=count)
+        # In ordine di scrittura: a parità di (zona, giorno) resta l'ultimo record
+        for zone, day, record in zip(records['zone'].tolist(), records['day'].tolist(), records):
+            self._index.setdefault(zone, {})[day] = record
+        self._indexed_size += count * WATER_TEMP_RECORD.itemsize
+
+    def last_state(self, location_name, before_date, max_age_days=HISTORY_DAYS):
+        """Ultimo stato termico salvato per la zona prima del giorno indicato (None se assente)"""
+        before = before_date.toordinal()
+        with self._index_lock:
+            self._refresh_index()
+            days = self._index.get(zone_id(location_name), {})
+            candidates = [day for day in days if day < before and before - day <= max_age_days]
+            if not candidates:
+                return None
+            record = days[max(candidates)]
+        return {
+            'temp': float(record['temp']),
+            'date': date.fromordinal(int(record['day'])),
+            'heat_accumulation': float(record['heat_accumulation']),
+            'air_temp': float(record['air_temp']),
+            'seasonal_base': float(record['seasonal_base'])
+        }
+
+    def append(self, location_name, days, temps, heat_accumulations, air_temps, seasonal_bases):
+        """Aggiunge in coda gli stati termici della zona, un record per ogni giorno indicato"""
+        records = np.zeros(len(days), dtype=WATER_TEMP_RECORD)
+        records['zone'] = zone_id(location_name)
+        records['day'] = [day.toordinal() for day in days]
+        records['temp'] = temps
+        records['heat_accumulation'] = heat_accumulations
+        records['air_temp'] = air_temps
+        records['seasonal_base'] = seasonal_bases
+        try:
+            with self._locked():
+                with open(self.path, 'ab') as f:
+                    f.write(records.tobytes())
+        except OSError:
+            return
+        self.maybe_compact()
+
+    def maybe_compact(self):
+        """Avvia la compattazione in background se è passato abbastanza tempo dall'ultima"""
+        if self._compacting or time.time() - self._last_compaction < COMPACTION_INTERVAL:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, name='water-temp-compaction', daemon=True).start()
+
+    def compact(self, current_date=None, max_age_days=HISTORY_DAYS):
+        """Elimina i record vecchi e i duplicati (zona, giorno), riscrivendo il file in modo atomico"""
+        today = (current_date or date.today()).toordinal()
+        try:
+            with self._locked():
+                records = self._scan(lambda r: r.copy())
+                records = records[today - records['day'] <= max_age_days]
+                # Tiene l'ultimo record scritto per ogni coppia (zona, giorno)
+                reversed_records = records[::-1]
+                keys = (reversed_records['zone'].astype(np.int64) << 32) | reversed_records['day'].astype(np.int64)
+                _, first = np.unique(keys, return_index=True)
+                records = reversed_records[np.sort(first)][::-1]
+
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(records.tobytes())
+                os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+        finally:
+            self._last_compaction = time.time()
+            self._compacting = False
+
+    def _import_legacy(self, legacy_path):
+        """Converte lo storico pickle nel formato a record fissi"""
+        try:
+            with open(legacy_path, 'rb') as f:
+                history = pickle.load(f)
+        except Exception:
+            return
+        rows = []
+        for key, data in history.items():
+            location_name = key.rsplit('_', 1)[0]
+            rows.append((
+                zone_id(location_name), data['date'].toordinal(), data['temp'],
+                data.get('heat_accumulation', 0), data.get('air_temp', data['temp']),
+                data.get('seasonal_base', data['temp'])
+            ))
+        rows.sort(key=lambda row: row[1])
+        try:
+            with self._locked():
+                with open(self.path, 'ab') as f:
+                    f.write(np.array(rows, dtype=WATER_TEMP_RECORD).tobytes())
+        except OSError:
+            pass
+
+
+water_temp_store = WaterTempStore()
+
+
+ABSORPTION_RATE = 0.08  # Solo l'8% del gap termico viene assorbito giornalmente
+HEAT_DISSIPATION = 0.05  # 5% di dissipazione giornaliera
+MAX_HEAT_ACCUMULATION = 8.0
+SEASONAL_ATTRACTION = 0.1
+CLEAR_CODES = [0, 1]
+RAIN_CODES = [61, 63, 65, 80, 81, 82]
+DAYTIME_HOURS = (8, 18)
+
+
+def seasonal_base(location_name, months):
+    """Temperatura base stagionale della zona per uno o più mesi (medie ARPA da dati_pesca.json)"""
+    table = np.array(get_water(location_name)['monthly'])
+    return table[np.asarray(months) - 1]
+
+
+def water_temperature_step(previous_temp, heat_accumulation, air_temp, gain_factor, rain, windy,
+                           base, zone_factor, min_temp, max_temp):
+    """Un passo del modello termico; accetta scalari o array (es. una colonna per zona).
+
+    gain_factor moltiplica l'assorbimento (ore diurne, cielo sereno), rain e windy sono
+    la frazione del passo con pioggia e con vento forte. Restituisce (temperatura, accumulo).
+    """
+    # 1. ASSORBIMENTO TERMICO - l'acqua perde calore più lentamente di quanto ne assorba
+    temp_gap = air_temp - previous_temp
+    heat_gain = np.where(temp_gap > 0, temp_gap * ABSORPTION_RATE * gain_factor, temp_gap * (ABSORPTION_RATE * 0.6))
+
+    # 2. ACCUMULO TERMICO con dissipazione e limiti
+    heat_accumulation = heat_accumulation + heat_gain
+    heat_accumulation = heat_accumulation - heat_accumulation * HEAT_DISSIPATION
+    heat_accumulation = np.clip(heat_accumulation, -MAX_HEAT_ACCUMULATION, MAX_HEAT_ACCUMULATION)
+
+    # 3. CALCOLO TEMPERATURA CON ASSORBIMENTO
+    water_temp = previous_temp + heat_accumulation
+
+    # 4. EFFETTI IMMEDIATI: pioggia e vento forte sullo strato superficiale
+    immediate_effects = -0.3 * rain + windy * np.where(air_temp < water_temp, -0.4, 0.2)
+
+    # 5-6. CARATTERISTICHE DELLA ZONA
+    water_temp = water_temp + immediate_effects + heat_accumulation * zone_factor
+
+    # 7. BASE STAGIONALE e 8. LIMITI REALISTICI
+    water_temp = water_temp + (base - water_temp) * SEASONAL_ATTRACTION
+    water_temp = np.clip(water_temp, min_temp, max_temp)
+    return water_temp, heat_accumulation
+
+
+def simulate_water_temperature(previous_temp, heat_accumulation, daily, base, zone_factor, min_temp, max_temp):
+    """Fa avanzare il modello di un passo per ogni riga di `daily` (giorni × zone).
+
+    La ricorrenza è sequenziale nel tempo ma vettoriale sulle zone. Restituisce gli
+    array (giorni, zone) di temperatura e accumulo alla fine di ogni giorno.
+    """
+    steps = len(daily['air_temp'])
+    temps = np.empty(np.shape(daily['air_temp']))
+    heats = np.empty(np.shape(daily['air_temp']))
+    temp, heat = previous_temp, heat_accumulation
+    for i in range(steps):
+        temp, heat = water_temperature_step(
+            temp, heat, daily['air_temp'][i], daily['gain_factor'][i], daily['rain'][i], daily['windy'][i],
+            base[i], zone_factor, min_temp, max_temp
+        )
+        temps[i], heats[i] = temp, heat
+    return temps, heats
+
+
+def daily_weather(hourly):
+    """Condizioni giornaliere dal blocco orario di Open-Meteo, per i passi giornalieri del modello.
+
+    Le regole orarie del modello (ore diurne, sereno, pioggia, vento) vengono mediate sul giorno.
+    Le variabili possono essere matrici (celle, ore) sullo stesso asse orario: i campi
+    giornalieri hanno allora forma (celle, giorni).
+    """
+    times = np.array(hourly['time'], dtype='datetime64[h]')
+    air = np.array(hourly['temperature_2m'], dtype=np.float64)
+    codes = np.array(hourly['weather_code'], dtype=np.float64)
+    wind = np.array(hourly['wind_speed_10m'], dtype=np.float64) * 3.6
+
+    days = times.astype('datetime64[D]')
+    hours = (times - days).astype(np.int64)
+    daytime = (hours >= DAYTIME_HOURS[0]) & (hours <= DAYTIME_HOURS[1])
+    gain_factor = np.where(daytime, 1.3, 1.0) * np.where(np.isin(codes, CLEAR_CODES), 1.5, 1.0)
+    valid = ~np.isnan(air)
+
+    # Orari in ordine: ogni giorno è un tratto contiguo dell'asse, sommato con reduceat
+    if len(days) == 0:
+        empty = np.zeros(air.shape[:-1] + (0,))
+        return {'day': days, 'air_temp': empty, 'gain_factor': empty, 'rain': empty, 'windy': empty,
+                'hours': empty, 'complete': empty.astype(bool)}
+    starts = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+    unique_days = days[starts]
+    counts = np.add.reduceat(valid.astype(np.float64), starts, axis=-1)
+
+    def mean(values):
+        return np.add.reduceat(np.where(valid, values, 0.0), starts, axis=-1) / np.maximum(counts, 1)
+
+    return {
+        'day': unique_days,
+        'air_temp': mean(air),
+        'gain_factor': mean(gain_factor),
+        'rain': mean(np.isin(codes, RAIN_CODES)),
+        'windy': mean(wind > 25),
+        'hours': counts,
+        'complete': counts == 24
+    }
+
+
+def advance_water_temperature(location_name, hourly, current_date):
+    """Porta lo stato salvato della zona fino a ieri rigiocando i giorni mancanti.
+
+    Ogni giorno completo viene simulato e salvato una sola volta (idempotente): il numero
+    di visualizzazioni della pagina non cambia il risultato. Restituisce lo stato di ieri.
+    Se tra lo stato salvato e il primo giorno del blocco orario mancano dei giorni (app
+    ferma più a lungo dei past_days scaricati) non si salta il buco: si riparte dalla
+    media stagionale, con un WaterStateWarning.
+    """
+    state = water_temp_store.last_state(location_name, current_date)
+    daily = daily_weather(hourly) if hourly else None
+
+    if daily is not None:
+        missing = daily['complete'] & (daily['day'] < np.datetime64(current_date, 'D'))
+        if state is not None:
+            missing &= daily['day'] > np.datetime64(state['date'], 'D')
+            if missing.any() and daily['day'][missing][0] - np.datetime64(state['date'], 'D') > 1:
+                warnings.warn(
+                    f"{location_name}: stato dell'acqua fermo al {state['date']}, storico meteo dal "
+                    f"{daily['day'][missing][0]}; si riparte dalla media stagionale",
+                    WaterStateWarning, stacklevel=2
+                )
+                state = None
+        if state is None and missing.any():
+            # Nessuno stato utilizzabile: si parte dalla media stagionale del giorno prima del primo disponibile
+            first_day = (daily['day'][missing][0] - 1).astype(date)
+            state = {'temp': float(seasonal_base(location_name, first_day.month)), 'date': first_day,
+                     'heat_accumulation': 0.0}
+
+        if missing.any():
+            days = daily['day'][missing]
+            months = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+            base = seasonal_base(location_name, months)
+            water = get_water(location_name)
+            min_temp, max_temp = water['limits']
+            replay = {field: daily[field][missing] for field in ('air_temp', 'gain_factor', 'rain', 'windy')}
+            temps, heats = simulate_water_temperature(
+                state['temp'], state['heat_accumulation'], replay, base,
+                water['heat_factor'], min_temp, max_temp
+            )
+            day_dates = [day.astype(date) for day in days]
+            water_temp_store.append(location_name, day_dates, temps, heats, replay['air_temp'], base)
+            state = {'temp': float(temps[-1]), 'date': day_dates[-1], 'heat_accumulation': float(heats[-1])}
+
+    return state
+
+
+def calculate_water_temperature(air_temp, current_data, location_name, hourly=None):
+    """Calcola temperatura acqua considerando l'assorbimento termico dell'acqua.
+
+    Lo stato fino a ieri arriva dalla simulazione giornaliera (advance_water_temperature,
+    alimentata dalle ore passate del blocco orario); oggi si applica un passo provvisorio
+    con le condizioni attuali, che non viene salvato.
+    """
+    now = datetime.now()
+    state = advance_water_temperature(location_name, hourly, now.date())
+    base = float(seasonal_base(location_name, now.month))
+    if state is None:
+        state = {'temp': base, 'heat_accumulation': 0.0}
+
+    # Passo provvisorio di oggi con le regole orarie del modello
+    gain_factor = 1.0
+    if DAYTIME_HOURS[0] <= now.hour <= DAYTIME_HOURS[1]:  # Ore diurne
+        gain_factor *= 1.3
+    if current_data['weather_code'] in CLEAR_CODES:  # Cielo sereno
+        gain_factor *= 1.5
+    rain = 1.0 if current_data['weather_code'] in RAIN_CODES else 0.0
+    windy = 1.0 if current_data.get('wind_speed_10m', 0) * 3.6 > 25 else 0.0
+
+    water = get_water(location_name)
+    min_temp, max_temp = water['limits']
+    water_temp, _ = water_temperature_step(
+        state['temp'], state['heat_accumulation'], air_temp, gain_factor, rain, windy,
+        base, water['heat_factor'], min_temp, max_temp
+    )
+
+    # ARROTONDAMENTO FINALE
+    return round(float(water_temp), 1)
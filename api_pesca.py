@@ -0,0 +1,446 @@
+# API HTTP JSON con le previsioni precalcolate, per client mobili e altri consumatori
+#
+# Esempi:
+#   python api_pesca.py                                   # http://127.0.0.1:8502
+#   python api_pesca.py --host 0.0.0.0 --port 8080 --refresh-interval 600
+#
+# Endpoint (GET o HEAD):
+#   /health                        stato, istante dell'ultimo calcolo e richieste servite
+#   /zones                         zone con coordinate e condizioni sintetiche
+#   /zones/<zona>/conditions       condizioni attuali (<zona> è l'id di /zones, es. lago-di-varese)
+#   /zones/<zona>/hourly           previsioni delle prossime ore
+#   /zones/<zona>/species          classifica delle specie con le finestre migliori
+#   /forecasts                     tutte le zone in un documento (come cli_pesca.py)
+#   /nearby?lat=45.8&lon=8.7       zone migliori entro un raggio (&radius=20&limit=10&species=Luccio)
+#   /images/<specie>?w=320         immagine della specie (WebP se il client lo accetta, altrimenti JPEG)
+#   /events?zone=<zona>            flusso Server-Sent Events: condizioni e ore successive, poi solo i valori cambiati
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from database_pesca import get_zones
+from core_pesca import NEARBY_LIMIT, NEARBY_RADIUS_KM, build_zone_forecasts
+from diretta_pesca import conditions_diff, live_values
+from immagini_pesca import DETAIL_IMAGE_WIDTH, MIME_TYPES, image_catalog, image_slug
+from spaziale_pesca import SpatialIndex
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8502
+# Le previsioni cambiano ogni ora; il ricalcolo più frequente tiene aggiornate età dei dati e prossime ore
+REFRESH_INTERVAL = 300
+# Limite all'intestazione di una richiesta e attesa massima di una connessione inattiva
+MAX_REQUEST_HEAD = 8192
+KEEPALIVE_TIMEOUT = 15
+# Corpo più lungo che si legge e si scarta per tenere viva la connessione; oltre (o chunked) si chiude
+MAX_REQUEST_BODY = 65536
+# Raggio massimo accettato da /nearby
+MAX_NEARBY_RADIUS_KM = 200
+JSON_CACHE_CONTROL = "no-cache"
+IMAGE_CACHE_CONTROL = "public, max-age=86400"
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 503: 'Service Unavailable'}
+
+
+def zone_slug(location_name):
+    """Id della zona negli URL: 'Lago Maggiore - Lombardia' -> 'lago-maggiore-lombardia'"""
+    words = ''.join(c if c.isalnum() else ' ' for c in location_name.lower()).split()
+    return '-'.join(words)
+
+
+def _head(status, content_type, length, etag=None, cache_control=JSON_CACHE_CONTROL, extra=()):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}", f"Content-Type: {content_type}"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    lines.append(f"Cache-Control: {cache_control}")
+    if etag:
+        lines.append(f'ETag: "{etag}"')
+    lines.extend(extra)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def request_body_length(headers):
+    """Byte del corpo da scartare prima della richiesta successiva (None: lunghezza ignota o eccessiva)"""
+    if 'transfer-encoding' in headers:
+        return None
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        return None
+    return length if 0 <= length <= MAX_REQUEST_BODY else None
+
+
+def closing(response):
+    """La stessa risposta con Connection: close, per l'ultima richiesta della connessione"""
+    return response.replace(b'\r\n\r\n', b'\r\nConnection: close\r\n\r\n', 1)
+
+
+def prepared(body, content_type, etag, cache_control=JSON_CACHE_CONTROL, extra=(), status=200):
+    """Risposta pronta da scrivere sul socket: intestazioni, corpo e (con un'ETag) la variante 304"""
+    head = _head(status, content_type, len(body), etag, cache_control, extra)
+    return {
+        'etag': f'"{etag}"' if etag else None,
+        'head': head,
+        'full': head + body,
+        'not_modified': _head(304, content_type, None, etag, cache_control, extra) if etag else None
+    }
+
+
+def json_response(payload, status=200, extra=()):
+    """Risposta JSON già serializzata; l'ETag (solo per le risposte 200) è l'hash del contenuto"""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest() if status == 200 else None
+    return prepared(body, 'application/json; charset=utf-8', etag, extra=extra, status=status)
+
+
+def event_message(event, payload):
+    """Un evento Server-Sent Events con il payload JSON su una riga"""
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {event}\ndata: {data}\n\n".encode('utf-8')
+
+
+def build_table(forecasts, zones, generated_at):
+    """Tutte le risposte JSON per percorso, calcolate una volta per aggiornamento"""
+    stamp = datetime.fromtimestamp(generated_at).isoformat(timespec='seconds')
+    table = {}
+    summary = []
+    for location_name, forecast in forecasts.items():
+        slug = zone_slug(location_name)
+        conditions = forecast['conditions']
+        coords = zones.get(location_name, {})
+        header = {'id': slug, 'name': location_name, 'generated_at': stamp}
+        table[f'/zones/{slug}/conditions'] = json_response({
+            **header,
+            'conditions': {key: value for key, value in conditions.items() if key != 'hourly_forecast'},
+            'moon_phase': forecast['moon_phase'],
+            'season': forecast['season']
+        })
+        table[f'/zones/{slug}/hourly'] = json_response({**header, 'hourly': conditions['hourly_forecast']})
+        table[f'/zones/{slug}/species'] = json_response({**header, 'species': forecast['species']})
+
+        best = forecast['species'][0] if forecast['species'] else None
+        summary.append({
+            'id': slug,
+            'name': location_name,
+            'lat': coords.get('lat'),
+            'lon': coords.get('lon'),
+            'water_temperature': conditions['water_temperature'],
+            'weather_condition': conditions['weather_condition'],
+            'best_species': best['species'] if best else None,
+            'best_score': best['score'] if best else None,
+            'success': conditions['success'],
+            'data_age': conditions['data_age'],
+            'stale': conditions.get('stale', False)
+        })
+
+    table['/zones'] = json_response({'generated_at': stamp, 'zones': summary})
+    table['/forecasts'] = json_response({'generated_at': stamp, 'zones': forecasts})
+    return table
+
+
+def build_nearby(forecasts, zones):
+    """Indice spaziale delle zone con dati reali e punteggi per specie di ciascuna"""
+    spots = []
+    for location_name, forecast in forecasts.items():
+        coords = zones.get(location_name)
+        if coords is None or not forecast['conditions']['success']:
+            continue
+        spots.append({
+            'id': zone_slug(location_name),
+            'name': location_name,
+            'lat': coords['lat'],
+            'lon': coords['lon'],
+            'success': True,
+            'data_age': forecast['conditions']['data_age'],
+            'stale': forecast['conditions'].get('stale', False),
+            'scores': {entry['species']: entry['score'] for entry in forecast['species']}
+        })
+    index = SpatialIndex([spot['name'] for spot in spots],
+                         [spot['lat'] for spot in spots], [spot['lon'] for spot in spots])
+    return index, {spot['name']: spot for spot in spots}
+
+
+def build_image_responses(catalog=image_catalog):
+    """Risposte delle varianti delle immagini per ETag (i byte sono già in memoria nel catalogo)"""
+    responses = {}
+    for variant in catalog.variants():
+        responses[variant['etag']] = prepared(
+            variant['data'], variant['mime'], variant['etag'], IMAGE_CACHE_CONTROL, extra=('Vary: Accept',)
+        )
+    return responses
+
+
+class ForecastService:
+    """Tabella delle risposte ricalcolata in un thread a intervalli fissi e servita dal loop asyncio.
+
+    Le richieste non calcolano nulla: leggono la tabella corrente (sostituita in blocco
+    a ogni aggiornamento) e scrivono byte già pronti, con 304 se l'ETag coincide.
+    Fa eccezione /nearby, che dipende dalla posizione: legge l'indice spaziale e i
+    punteggi preparati all'aggiornamento, senza rifare previsioni o classifiche.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.table = {}
+        self.nearby_index, self.nearby_spots = SpatialIndex([], [], []), {}
+        # Condizioni per id di zona (per /events) e code dei flussi aperti
+        self.live = {}
+        self.streams = set()
+        self.images = build_image_responses()
+        self.generated_at = None
+        self.refresh_seconds = None
+        self.refreshes = 0
+        self.requests = 0
+        self.last_error = None
+
+    def refresh(self, force_refresh=False):
+        """Ricalcola tutte le risposte (bloccante: da eseguire fuori dal loop); restituisce le condizioni cambiate"""
+        start = time.perf_counter()
+        zones = get_zones()
+        forecasts = build_zone_forecasts(zones, force_refresh=force_refresh)
+        generated_at = time.time()
+        self.table = build_table(forecasts, zones, generated_at)
+        self.nearby_index, self.nearby_spots = build_nearby(forecasts, zones)
+        live = {zone_slug(name): live_values(forecast['conditions']) for name, forecast in forecasts.items()}
+        changes = conditions_diff(self.live, live)
+        self.live = live
+        self.generated_at = generated_at
+        self.refresh_seconds = time.perf_counter() - start
+        self.refreshes += 1
+        return changes
+
+    async def refresh_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                changes = await loop.run_in_executor(None, self.refresh)
+                self.last_error = None
+                self.publish(changes)
+            except Exception as e:
+                # Si continua a servire la tabella precedente
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def health(self):
+        return json_response({
+            'status': 'ok' if self.table else 'starting',
+            'generated_at': None if self.generated_at is None else
+            datetime.fromtimestamp(self.generated_at).isoformat(timespec='seconds'),
+            'age_seconds': None if self.generated_at is None else round(time.time() - self.generated_at),
+            'refresh_seconds': None if self.refresh_seconds is None else round(self.refresh_seconds, 3),
+            'refreshes': self.refreshes,
+            'requests': self.requests,
+            'streams': len(self.streams),
+            'last_error': self.last_error
+        })
+
+    def publish(self, changes):
+        """Consegna i valori cambiati a tutti i flussi aperti (dal loop, una volta per ricalcolo)"""
+        if not changes:
+            return
+        for queue in self.streams:
+            queue.put_nowait((self.generated_at, changes))
+
+    async def stream(self, writer, query):
+        """Flusso /events: l'istantanea delle condizioni, poi a ogni ricalcolo solo i valori cambiati"""
+        zone = parse_qs(query).get('zone', [None])[0]
+        if zone is not None and zone not in self.live:
+            writer.write(json_response({'error': f'zona sconosciuta: {zone}'}, 404)['full'])
+            return
+
+        def selected(values):
+            return values if zone is None else {key: value for key, value in values.items() if key == zone}
+
+        def stamp(generated_at):
+            return datetime.fromtimestamp(generated_at).isoformat(timespec='seconds')
+
+        queue = asyncio.Queue()
+        self.streams.add(queue)
+        try:
+            writer.write(_head(200, 'text/event-stream; charset=utf-8', None))
+            writer.write(event_message('snapshot', {'generated_at': stamp(self.generated_at),
+                                                    'zones': selected(self.live)}))
+            await writer.drain()
+            while True:
+                try:
+                    generated_at, changes = await asyncio.wait_for(queue.get(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # Commento SSE: tiene aperta la connessione e fa notare subito un client sparito
+                    writer.write(b': ping\n\n')
+                else:
+                    changes = selected(changes)
+                    if not changes:
+                        continue
+                    writer.write(event_message('update', {'generated_at': stamp(generated_at), 'zones': changes}))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.streams.discard(queue)
+
+    def image(self, species, query, accept):
+        try:
+            width = int(parse_qs(query).get('w', [DETAIL_IMAGE_WIDTH])[0])
+        except ValueError:
+            return None
+        image_format = 'webp' if MIME_TYPES['webp'] in accept else 'jpeg'
+        variant = image_catalog.variant(species, width, image_format)
+        return None if variant is None else self.images.get(variant['etag'])
+
+    def nearby(self, query):
+        """Zone entro il raggio ordinate per punteggio (della specie indicata o della migliore); None se i parametri non sono validi"""
+        params = {key: values[0] for key, values in parse_qs(query).items()}
+        try:
+            lat, lon = float(params['lat']), float(params['lon'])
+            radius = min(float(params.get('radius', NEARBY_RADIUS_KM)), MAX_NEARBY_RADIUS_KM)
+            limit = int(params.get('limit', NEARBY_LIMIT))
+        except (KeyError, ValueError):
+            return None
+        species = params.get('species')
+
+        # Lettura unica: un aggiornamento concorrente sostituisce entrambi insieme
+        index, spots = self.nearby_index, self.nearby_spots
+        results = []
+        for name, distance in index.within(lat, lon, radius):
+            spot = spots[name]
+            if species is not None:
+                best, score = species, spot['scores'].get(species)
+            else:
+                best, score = max(spot['scores'].items(), key=lambda item: item[1], default=(None, None))
+            if score is None:
+                continue
+            results.append({'id': spot['id'], 'name': name, 'lat': spot['lat'], 'lon': spot['lon'],
+                            'distance_km': round(distance, 1), 'species': best, 'score': score,
+                            'success': spot['success'], 'data_age': spot['data_age'], 'stale': spot['stale']})
+        results.sort(key=lambda spot: (-spot['score'], spot['distance_km']))
+        return json_response({
+            'generated_at': datetime.fromtimestamp(self.generated_at).isoformat(timespec='seconds'),
+            'lat': lat, 'lon': lon, 'radius_km': radius,
+            'spots': results[:max(limit, 0)]
+        })
+
+    def route(self, method, target, headers):
+        """Risposta preparata (come prepared) per una richiesta già letta, errori compresi"""
+        if method not in ('GET', 'HEAD'):
+            return json_response({'error': 'metodo non supportato'}, 405, extra=('Allow: GET, HEAD',))
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip('/') or '/'
+
+        if path == '/health':
+            response = self.health()
+        elif path.startswith('/images/'):
+            response = self.image(image_slug(path[len('/images/'):]), url.query, headers.get('accept', ''))
+        elif not self.table:
+            return json_response({'error': 'previsioni in preparazione'}, 503)
+        elif path == '/nearby':
+            response = self.nearby(url.query)
+            if response is None:
+                return json_response({'error': 'parametri richiesti: lat, lon (numeri); facoltativi radius, limit'}, 400)
+        else:
+            response = self.table.get(path)
+        if response is None:
+            return json_response({'error': f'percorso sconosciuto: {path}'}, 404)
+        return response
+
+    def respond(self, method, target, headers):
+        """Byte della risposta a una richiesta già letta (a HEAD solo le intestazioni, anche per gli errori)"""
+        self.requests += 1
+        response = self.route(method, target, headers)
+        if response['etag'] is not None and headers.get('if-none-match') == response['etag']:
+            return response['not_modified']
+        return response['head'] if method == 'HEAD' else response['full']
+
+    async def handle(self, reader, writer):
+        """Connessione HTTP/1.1 persistente: una richiesta alla volta finché il client non chiude"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                if len(parts) != 3:
+                    writer.write(json_response({'error': 'richiesta non valida'}, 400)['full'])
+                    break
+                method, target, version = parts
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+
+                # Il corpo (nessun endpoint lo usa) va consumato, altrimenti diventa la richiesta successiva
+                length = request_body_length(headers)
+                if length:
+                    try:
+                        await asyncio.wait_for(reader.readexactly(length), KEEPALIVE_TIMEOUT)
+                    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                        break
+                elif length is None:
+                    writer.write(closing(self.respond(method, target, headers)))
+                    break
+
+                url = urlsplit(target)
+                if method == 'GET' and url.path.rstrip('/') == '/events':
+                    # Il flusso occupa la connessione fino alla chiusura del client
+                    self.requests += 1
+                    await self.stream(writer, url.query)
+                    break
+
+                writer.write(self.respond(method, target, headers))
+                connection = headers.get('connection', '').lower()
+                if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+                    break
+                await writer.drain()
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+            except ConnectionError:
+                pass
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, refresh_interval=REFRESH_INTERVAL, force_refresh=False):
+    service = ForecastService(refresh_interval)
+    # Primo calcolo prima di accettare connessioni: nessuna risposta vuota all'avvio
+    await asyncio.get_running_loop().run_in_executor(None, service.refresh, force_refresh)
+    server = await asyncio.start_server(service.handle, host, port, limit=MAX_REQUEST_HEAD)
+    print(f"API in ascolto su http://{host}:{port} ({len(service.table)} risposte pronte, "
+          f"calcolate in {service.refresh_seconds:.2f} s)", file=sys.stderr)
+    refresher = asyncio.create_task(service.refresh_forever())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        refresher.cancel()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="API HTTP JSON con le previsioni di pesca precalcolate")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"indirizzo di ascolto (default: {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"porta (default: {DEFAULT_PORT})")
+    parser.add_argument('--refresh-interval', type=int, default=REFRESH_INTERVAL,
+                        help=f"secondi tra due ricalcoli delle risposte (default: {REFRESH_INTERVAL})")
+    parser.add_argument('--refresh', action='store_true', help="ignora la cache al primo calcolo")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.refresh_interval, args.refresh))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
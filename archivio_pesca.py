@@ -0,0 +1,171 @@
+# Archivio su disco delle risposte grezze di Open-Meteo: riavvii a caldo e replay
+
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+SNAPSHOT_DIR = "snapshots"
+# Una snapshot per zona e ora del modello (UTC), presa da current.time della risposta
+SNAPSHOT_NAME_FORMAT = "%Y%m%dT%H"
+SNAPSHOT_SUFFIX = ".json.gz"
+# Le snapshot più vecchie si eliminano a ogni scrittura della zona (None: si tengono tutte)
+SNAPSHOT_MAX_AGE = 30 * 24 * 3600
+# Compressione veloce: le risposte sono JSON molto ripetitivo
+COMPRESS_LEVEL = 5
+
+
+def zone_dir_name(key):
+    """Cartella della zona: coordinate arrotondate più un hash delle variabili richieste"""
+    lat, lon, current, hourly = key
+    variables = zlib.crc32(f"{current}|{hourly}".encode('utf-8'))
+    return f"{lat:.2f}_{lon:.2f}_{variables:08x}"
+
+
+def run_name(timestamp):
+    """Nome del file della snapshot per un istante (epoch), troncato all'ora UTC"""
+    return time.strftime(SNAPSHOT_NAME_FORMAT, time.gmtime(timestamp)) + SNAPSHOT_SUFFIX
+
+
+def model_time(data):
+    """Istante (epoch) di current.time nella risposta, con il suo fuso; None se manca"""
+    try:
+        local = datetime.fromisoformat(data['current']['time'])
+        offset = timedelta(seconds=data.get('utc_offset_seconds', 0))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return local.replace(tzinfo=timezone(offset)).timestamp()
+
+
+class SnapshotStore:
+    """Snapshot compresse (gzip JSON) in <root>/<zona>/<ora UTC>.json.gz.
+
+    Il nome è l'ora del modello (current.time), non quella del download: due
+    download della stessa ora del modello danno una sola snapshot. Le scritture
+    avvengono in un thread dedicato e sono atomiche (file temporaneo più
+    os.replace): un processo che legge non vede mai una snapshot a metà. Dopo ogni
+    scrittura si eliminano le snapshot della zona più vecchie di max_age secondi.
+    """
+
+    def __init__(self, root=SNAPSHOT_DIR, max_age=SNAPSHOT_MAX_AGE):
+        self.root = root
+        self.max_age = max_age
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='meteo-snapshot')
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.reads = 0
+
+    def _path(self, key, data, fetched_at):
+        stamp = model_time(data)
+        return os.path.join(self.root, zone_dir_name(key), run_name(fetched_at if stamp is None else stamp))
+
+    def _prune(self, zone_dir):
+        """Elimina le snapshot della zona più vecchie di max_age (i nomi sono ordinati per ora)"""
+        if self.max_age is None:
+            return
+        oldest = run_name(time.time() - self.max_age)
+        try:
+            names = os.listdir(zone_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith(SNAPSHOT_SUFFIX) and name < oldest:
+                try:
+                    os.remove(os.path.join(zone_dir, name))
+                except OSError:
+                    pass
+
+    def _write(self, key, data, fetched_at):
+        path = self._path(key, data, fetched_at)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        record = {'key': list(key), 'fetched_at': fetched_at, 'data': data}
+        try:
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL) as f:
+                json.dump(record, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self.writes += 1
+        self._prune(os.path.dirname(path))
+
+    def save(self, key, data, fetched_at=None):
+        """Salva la risposta in background (una nuova risposta per la stessa ora del modello sostituisce la precedente)"""
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        return self._writer.submit(self._write, key, data, fetched_at)
+
+    def _read(self, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            record = json.load(f)
+        with self._lock:
+            self.reads += 1
+        return record
+
+    def latest(self, key):
+        """Snapshot più recente della zona come (payload, istante del download), o (None, None)"""
+        zone_dir = os.path.join(self.root, zone_dir_name(key))
+        try:
+            names = sorted(n for n in os.listdir(zone_dir) if n.endswith(SNAPSHOT_SUFFIX))
+        except OSError:
+            return None, None
+        # I nomi sono ordinati per ora: si prova dalla più recente, saltando file illeggibili
+        for name in reversed(names):
+            try:
+                record = self._read(os.path.join(zone_dir, name))
+                return record['data'], record['fetched_at']
+            except (OSError, ValueError, KeyError, EOFError):
+                continue
+        return None, None
+
+    def zones(self):
+        """Cartelle delle zone presenti nell'archivio"""
+        try:
+            return sorted(n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n)))
+        except OSError:
+            return []
+
+    def replay(self, keys=None, start=None, end=None):
+        """Snapshot in ordine cronologico come (chiave, istante del download, payload).
+
+        keys limita le zone (chiavi come forecast_key); start ed end sono epoch in
+        secondi e selezionano le ore del modello senza aprire gli altri file.
+        """
+        zone_dirs = self.zones() if keys is None else [zone_dir_name(tuple(k)) for k in keys]
+        first = None if start is None else run_name(start)
+        last = None if end is None else run_name(end)
+
+        paths = []
+        for zone_dir in zone_dirs:
+            try:
+                names = os.listdir(os.path.join(self.root, zone_dir))
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith(SNAPSHOT_SUFFIX):
+                    continue
+                if (first is not None and name < first) or (last is not None and name > last):
+                    continue
+                paths.append((name, os.path.join(self.root, zone_dir, name)))
+
+        for _, path in sorted(paths):
+            try:
+                record = self._read(path)
+            except (OSError, ValueError, EOFError):
+                continue
+            yield tuple(record['key']), record['fetched_at'], record['data']
+
+    def flush(self):
+        """Attende la fine delle scritture in coda"""
+        self._writer.submit(lambda: None).result()
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,380 @@
+# Back-testing del punteggio di attività su anni di dati storici Open-Meteo
+#
+# Esempi:
+#   python backtest_pesca.py --catch-log catture.csv                      # ultimi 3 anni
+#   python backtest_pesca.py --catch-log catture.csv --start 2016-01-01 --end 2024-12-31 --workers 4
+#   python backtest_pesca.py --start 2020-01-01 --save-scores punteggi.npz  # solo punteggi, senza registro
+#
+# Il registro delle catture è un CSV con le colonne:
+#   date     "2024-05-18 07:30" oppure solo "2024-05-18" (vale la media delle ore diurne)
+#   zone     nome come in ZONE_COORDINATES
+#   species  nome come in FISH_SPECIES
+#   catches  numero di catture (opzionale, default 1; 0 per le uscite senza catture)
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database_pesca import ZONE_COORDINATES, FISH_SPECIES, get_water
+from meteo_pesca import TIMEZONE, COORD_PRECISION, http_session, hourly_times
+from acqua_pesca import DAYTIME_HOURS, seasonal_base, daily_weather, simulate_water_temperature
+from effemeridi_pesca import moon_phase_indices, season_indices
+from punteggio_pesca import ScoringEngine, weather_code_index
+
+ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
+# Stesse variabili del blocco orario delle previsioni (l'archivio non ha la probabilità di pioggia)
+ARCHIVE_VARIABLES = ('temperature_2m', 'weather_code', 'wind_speed_10m', 'pressure_msl')
+ARCHIVE_DIR = "archivio_storico"
+ARCHIVE_TIMEOUT = 60
+# I dati di rianalisi arrivano con qualche giorno di ritardo
+ARCHIVE_DELAY_DAYS = 7
+
+# Giorni simulati prima dell'inizio per far dimenticare al modello termico lo stato iniziale
+WARMUP_DAYS = 30
+# Ore per processo quando il calcolo dei punteggi viene diviso tra più processi
+CHUNK_HOURS = 24 * 365
+
+
+def archive_path(archive_dir, coords, year):
+    """File .npz con un anno di dati orari della zona"""
+    lat, lon = round(coords['lat'], COORD_PRECISION), round(coords['lon'], COORD_PRECISION)
+    return os.path.join(archive_dir, f"{lat:.2f}_{lon:.2f}", f"{year}.npz")
+
+
+def _read_archive_year(path):
+    """Colonne salvate di un anno (None se il file manca o è illeggibile)"""
+    try:
+        with np.load(path) as f:
+            return {name: f[name] for name in ('time',) + ARCHIVE_VARIABLES}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def download_archive(zones, start, end, archive_dir=ARCHIVE_DIR):
+    """Scarica (una richiesta per anno per tutte le zone) gli anni non ancora in archivio.
+
+    Un anno già salvato viene riscaricato solo se non arriva fino alla data richiesta.
+    """
+    for year in range(start.year, end.year + 1):
+        year_end = min(end, date(year, 12, 31))
+        missing = {}
+        for name, coords in zones.items():
+            stored = _read_archive_year(archive_path(archive_dir, coords, year))
+            if stored is None or len(stored['time']) == 0 or stored['time'][-1] < np.datetime64(year_end, 'h') + 23:
+                missing[name] = coords
+        if not missing:
+            continue
+
+        params = {
+            'latitude': ','.join(str(c['lat']) for c in missing.values()),
+            'longitude': ','.join(str(c['lon']) for c in missing.values()),
+            'start_date': date(year, 1, 1).isoformat(),
+            'end_date': year_end.isoformat(),
+            'hourly': ','.join(ARCHIVE_VARIABLES),
+            'timezone': TIMEZONE
+        }
+        response = http_session.get(ARCHIVE_URL, params=params, timeout=ARCHIVE_TIMEOUT)
+        response.raise_for_status()
+        payloads = response.json()
+        if isinstance(payloads, dict):
+            payloads = [payloads]
+
+        for (name, coords), payload in zip(missing.items(), payloads):
+            hourly = payload['hourly']
+            path = archive_path(archive_dir, coords, year)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez_compressed(
+                path,
+                time=hourly_times(hourly['time']).astype('datetime64[h]'),
+                **{var: np.array(hourly[var], dtype=np.float64).astype(np.float32) for var in ARCHIVE_VARIABLES}
+            )
+            print(f"Archivio {name} {year}: {len(hourly['time'])} ore", file=sys.stderr)
+
+
+def load_archive(zones, start, end, archive_dir=ARCHIVE_DIR):
+    """Dati orari delle zone su un asse comune da start a end compresi.
+
+    Restituisce 'time' (ore,) e una matrice (zone, ore) per variabile, con NaN
+    dove l'archivio non ha dati.
+    """
+    axis = np.arange(np.datetime64(start, 'h'), np.datetime64(end + timedelta(days=1), 'h'))
+    columns = {var: np.full((len(zones), len(axis)), np.nan, dtype=np.float32) for var in ARCHIVE_VARIABLES}
+
+    for z, coords in enumerate(zones.values()):
+        for year in range(start.year, end.year + 1):
+            stored = _read_archive_year(archive_path(archive_dir, coords, year))
+            if stored is None:
+                continue
+            # Posizione di ogni ora sull'asse comune (ore fuori intervallo scartate)
+            index = (stored['time'] - axis[0]).astype(np.int64)
+            inside = (index >= 0) & (index < len(axis))
+            for var in ARCHIVE_VARIABLES:
+                columns[var][z, index[inside]] = stored[var][inside]
+
+    columns['time'] = axis
+    return columns
+
+
+def prepare_inputs(zones, start, end, archive_dir=ARCHIVE_DIR):
+    """Ingressi del motore di punteggio per ogni zona e ora tra start e end.
+
+    Il modello termico gira sui passi giornalieri in modo vettoriale sulle zone, a
+    partire da WARMUP_DAYS prima di start. Come nell'app, l'ora di un giorno usa la
+    temperatura dell'acqua a fine del giorno precedente.
+    """
+    names = list(zones)
+    archive = load_archive(zones, start - timedelta(days=WARMUP_DAYS), end, archive_dir)
+    times = archive['time']
+
+    daily = [
+        daily_weather({'time': times, 'temperature_2m': archive['temperature_2m'][z],
+                       'weather_code': archive['weather_code'][z], 'wind_speed_10m': archive['wind_speed_10m'][z]})
+        for z in range(len(names))
+    ]
+    days = daily[0]['day']
+    months = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    base = np.stack([seasonal_base(name, months) for name in names], axis=1)
+
+    def stack(field):
+        return np.stack([d[field] for d in daily], axis=1)
+
+    # Giorni senza dati: l'aria alla media stagionale tiene il modello vicino alla base
+    replay = {field: stack(field) for field in ('gain_factor', 'rain', 'windy')}
+    replay['air_temp'] = np.where(stack('hours') > 0, stack('air_temp'), base)
+
+    limits = np.array([get_water(name)['limits'] for name in names], dtype=np.float64)
+    temps, _ = simulate_water_temperature(
+        base[0], np.zeros(len(names)), replay, base,
+        np.array([get_water(name)['heat_factor'] for name in names]), limits[:, 0], limits[:, 1]
+    )
+
+    # Temperatura a inizio giorno = fine del giorno precedente, ripetuta per le sue ore
+    start_of_day = np.vstack([base[:1], temps[:-1]])
+    day_index = (times.astype('datetime64[D]') - days[0]).astype(np.int64)
+    water = np.round(start_of_day[day_index].T, 1)
+
+    keep = times >= np.datetime64(start, 'h')
+    pressure = np.round(archive['pressure_msl'].astype(np.float64))
+    return {
+        'time': times[keep],
+        'zones': names,
+        'water_temp': water[:, keep],
+        'pressure': pressure[:, keep],
+        'moon': moon_phase_indices(times[keep]),
+        'season': season_indices(times[keep]),
+        'weather': weather_code_index(archive['weather_code'][:, keep]),
+        'valid': ~np.isnan(pressure[:, keep]) & ~np.isnan(archive['temperature_2m'][:, keep])
+    }
+
+
+def _score_chunk(engine, water_temp, pressure, moon, season, weather):
+    """Punteggi di un blocco di ore (eseguito anche nei processi worker)"""
+    return engine.score(water_temp, pressure, moon[None], season[None], weather)
+
+
+def score_inputs(inputs, engine, workers=None, chunk_hours=CHUNK_HOURS):
+    """Punteggi (specie, zone, ore) per gli ingressi di prepare_inputs().
+
+    Le ore vengono divise in blocchi calcolati in parallelo su più processi; con un
+    solo blocco o workers=1 il calcolo resta nel processo corrente.
+    """
+    hours = len(inputs['time'])
+    bounds = [(i, min(i + chunk_hours, hours)) for i in range(0, hours, chunk_hours)]
+    fields = ('water_temp', 'pressure', 'moon', 'season', 'weather')
+
+    def chunk_args(a, b):
+        return [inputs[f][..., a:b] for f in fields]
+
+    workers = min(workers or os.cpu_count() or 1, len(bounds))
+    if workers <= 1:
+        chunks = [_score_chunk(engine, *chunk_args(a, b)) for a, b in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_score_chunk, engine, *chunk_args(a, b)) for a, b in bounds]
+            chunks = [future.result() for future in futures]
+    if not chunks:
+        return np.empty((len(engine.species_names), len(inputs['zones']), 0), dtype=np.int16)
+    return np.concatenate(chunks, axis=2)
+
+
+def load_catch_log(path):
+    """Registro delle catture come DataFrame (date, zone, species, catches, date_only)"""
+    log = pd.read_csv(path, dtype={'date': str, 'zone': str, 'species': str})
+    missing = {'date', 'zone', 'species'} - set(log.columns)
+    if missing:
+        raise ValueError(f"Colonne mancanti nel registro catture: {', '.join(sorted(missing))}")
+    if 'catches' not in log.columns:
+        log['catches'] = 1
+    log['date_only'] = log['date'].str.strip().str.len() <= 10
+    log['date'] = pd.to_datetime(log['date'].str.strip(), format='ISO8601')
+    return log
+
+
+def match_catch_log(inputs, species_names, log):
+    """Righe del registro con gli indici di specie, zona e ora (colonne s, z, h).
+
+    Scarta le righe fuori periodo o con zona o specie sconosciute.
+    """
+    times = inputs['time']
+    zone_ids = {name: i for i, name in enumerate(inputs['zones'])}
+    species_ids = {name: i for i, name in enumerate(species_names)}
+
+    s = log['species'].map(species_ids)
+    z = log['zone'].map(zone_ids)
+    hour = (log['date'].values.astype('datetime64[m]') - np.datetime64(times[0], 'm')) // np.timedelta64(60, 'm')
+    usable = (s.notna() & z.notna()).values & (hour >= 0) & (hour < len(times))
+    rows = log[usable].copy()
+    rows['s'], rows['z'], rows['h'] = s[usable].astype(int), z[usable].astype(int), hour[usable]
+    return rows
+
+
+def catch_scores(scores, valid, rows):
+    """Punteggio di ogni riga del registro (NaN se l'ora non ha dati).
+
+    Le uscite con solo la data valgono la media delle ore diurne valide del giorno.
+    """
+    si, zi, hi = rows['s'].values, rows['z'].values, rows['h'].values
+    date_only = rows['date_only'].values
+    masked = np.where(valid[zi, hi], scores[si, zi, hi], np.nan).astype(np.float64)
+
+    if date_only.any():
+        # Finestra delle ore diurne del giorno, come matrice (righe, ore) per una sola media vettoriale
+        day_start = hi[date_only] - hi[date_only] % 24
+        window = day_start[:, None] + np.arange(DAYTIME_HOURS[0], DAYTIME_HOURS[1] + 1)[None]
+        window = np.minimum(window, scores.shape[2] - 1)
+        sd, zd = si[date_only][:, None], zi[date_only][:, None]
+        values = np.where(valid[zd, window], scores[sd, zd, window], np.nan).astype(np.float64)
+        counts = (~np.isnan(values)).sum(axis=1)
+        masked[date_only] = np.where(counts > 0, np.nansum(values, axis=1) / np.maximum(counts, 1), np.nan)
+    return masked
+
+
+def score_histograms(scores, valid):
+    """Distribuzione dei punteggi interi (0-100) per specie e zona, sulle ore valide"""
+    species, zones, _ = scores.shape
+    cell = (np.arange(species)[:, None, None] * zones + np.arange(zones)[None, :, None]) * 101
+    index = (cell + np.clip(scores, 0, 100))[np.broadcast_to(valid[None], scores.shape)]
+    return np.bincount(index, minlength=species * zones * 101).reshape(species, zones, 101).astype(np.float64)
+
+
+def percentile_ranks(histogram, s, z, values):
+    """Rango (0-1) di ogni punteggio tra le ore della sua specie e zona, interpolato per i valori medi"""
+    totals = np.maximum(histogram.sum(axis=2), 1)
+    below = np.cumsum(histogram, axis=2) - histogram
+    lower, upper = np.floor(values).astype(int), np.ceil(values).astype(int)
+    rank_low = (below[s, z, lower] + histogram[s, z, lower] / 2) / totals[s, z]
+    rank_high = (below[s, z, upper] + histogram[s, z, upper] / 2) / totals[s, z]
+    return rank_low + (rank_high - rank_low) * (values - lower)
+
+
+def evaluate(scores, inputs, engine, log):
+    """Confronto tra punteggi e registro delle catture, per specie.
+
+    - score_at_catch: punteggio medio nelle ore delle catture (pesato per catture)
+    - baseline: punteggio medio su tutte le ore, nelle stesse zone del registro
+    - lift: score_at_catch - baseline
+    - percentile: rango medio del punteggio di cattura tra le ore della zona
+      (0.5 = nessuna capacità predittiva, 1 = catture sempre nelle ore migliori)
+    - spearman: correlazione tra punteggio e catture, se il registro ha uscite
+      con numeri di catture diversi (es. anche a zero)
+    Restituisce (DataFrame delle metriche, numero di righe del registro scartate).
+    """
+    rows = match_catch_log(inputs, engine.species_names, log)
+    rows['score'] = catch_scores(scores, inputs['valid'], rows)
+    rows = rows[rows['score'].notna()]
+
+    # Medie e ranghi dagli istogrammi dei punteggi, senza ordinare le ore
+    histogram = score_histograms(scores, inputs['valid'])
+    baseline = (histogram * np.arange(101)).sum(axis=2) / np.maximum(histogram.sum(axis=2), 1)
+    rows['percentile'] = percentile_ranks(histogram, rows['s'].values, rows['z'].values, rows['score'].values)
+    rows['baseline'] = baseline[rows['s'].values, rows['z'].values]
+
+    metrics = []
+    for label, group in list(rows.groupby('species', sort=True)) + [('TOTALE', rows)]:
+        weights = group['catches'].clip(lower=0)
+        caught = weights > 0
+        total = weights.sum()
+        # Spearman come correlazione dei ranghi (senza dipendere da scipy)
+        spearman = (group['score'].rank().corr(group['catches'].rank())
+                    if group['catches'].nunique() > 1 else np.nan)
+        score_at_catch = np.average(group['score'][caught], weights=weights[caught]) if total else np.nan
+        baseline_mean = np.average(group['baseline'][caught], weights=weights[caught]) if total else np.nan
+        metrics.append({
+            'species': label,
+            'records': len(group),
+            'catches': int(total),
+            'score_at_catch': round(score_at_catch, 2),
+            'baseline': round(baseline_mean, 2),
+            'lift': round(score_at_catch - baseline_mean, 2),
+            'percentile': round(np.average(group['percentile'][caught], weights=weights[caught]), 3) if total else np.nan,
+            'spearman': round(spearman, 3) if not pd.isna(spearman) else np.nan
+        })
+    return pd.DataFrame(metrics), int(len(log) - len(rows))
+
+
+def run_backtest(start, end, zones=ZONE_COORDINATES, species=FISH_SPECIES, archive_dir=ARCHIVE_DIR,
+                 workers=None, download=True):
+    """Scarica (se serve) l'archivio, prepara gli ingressi e calcola tutti i punteggi.
+
+    Restituisce (ingressi, motore, punteggi (specie, zone, ore)).
+    """
+    # Una sola versione delle tabelle per tutto il calcolo, anche se il file cambia nel frattempo
+    zones, species = dict(zones), dict(species)
+    if download:
+        download_archive(zones, start - timedelta(days=WARMUP_DAYS), end, archive_dir)
+    inputs = prepare_inputs(zones, start, end, archive_dir)
+    engine = ScoringEngine(species, zones)
+    return inputs, engine, score_inputs(inputs, engine, workers)
+
+
+def parse_args(argv=None):
+    today = date.today()
+    parser = argparse.ArgumentParser(description="Back-testing del punteggio di attività su dati storici")
+    parser.add_argument('--start', type=date.fromisoformat, default=date(today.year - 3, 1, 1),
+                        help="primo giorno (default: 1 gennaio di tre anni fa)")
+    parser.add_argument('--end', type=date.fromisoformat, default=today - timedelta(days=ARCHIVE_DELAY_DAYS),
+                        help=f"ultimo giorno (default: {ARCHIVE_DELAY_DAYS} giorni fa)")
+    parser.add_argument('--catch-log', help="CSV del registro catture da confrontare con i punteggi")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help=f"cartella dell'archivio storico (default: {ARCHIVE_DIR})")
+    parser.add_argument('--workers', type=int, help="processi per il calcolo dei punteggi (default: CPU disponibili)")
+    parser.add_argument('--offline', action='store_true', help="usa solo l'archivio già scaricato")
+    parser.add_argument('--output', '-o', help="salva le metriche in questo CSV")
+    parser.add_argument('--save-scores', help="salva ore, zone, specie e punteggi in questo .npz")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.end < args.start:
+        print("--end precede --start", file=sys.stderr)
+        return 2
+
+    inputs, engine, scores = run_backtest(args.start, args.end, archive_dir=args.archive_dir,
+                                          workers=args.workers, download=not args.offline)
+    valid_hours = int(inputs['valid'].sum())
+    print(f"{len(inputs['zones'])} zone × {len(inputs['time'])} ore ({valid_hours} con dati), "
+          f"{len(engine.species_names)} specie", file=sys.stderr)
+
+    if args.save_scores:
+        np.savez_compressed(args.save_scores, time=inputs['time'], zones=np.array(inputs['zones']),
+                            species=np.array(engine.species_names), scores=scores, valid=inputs['valid'],
+                            habitat=engine.habitat)
+
+    if args.catch_log:
+        metrics, skipped = evaluate(scores, inputs, engine, load_catch_log(args.catch_log))
+        if skipped:
+            print(f"{skipped} righe del registro fuori periodo, senza dati o con zona/specie sconosciuta",
+                  file=sys.stderr)
+        if args.output:
+            metrics.to_csv(args.output, index=False)
+        print(metrics.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+# Benchmark dei percorsi critici (elaborazione meteo, temperatura acqua, punteggi) senza rete
+#
+# Esempi:
+#   python benchmarks/bench_pesca.py                      # tutti i benchmark sulle fixture
+#   python benchmarks/bench_pesca.py --scale 10 100 1000  # zone × specie sintetiche fino a 1000×1000
+#   python benchmarks/bench_pesca.py --record             # registra fixture reali da Open-Meteo
+#   python benchmarks/bench_pesca.py --from-snapshots     # fixture dalle ultime snapshot dell'archivio
+#   python benchmarks/bench_pesca.py --synthesize         # rigenera fixture deterministiche offline
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database_pesca import ZONE_COORDINATES, FISH_SPECIES
+from meteo_pesca import FORECAST_DAYS, PAST_DAYS, OPEN_METEO_URL, build_forecast_params, forecast_key, http_session
+from archivio_pesca import SNAPSHOT_DIR, SnapshotStore
+import acqua_pesca
+from acqua_pesca import WaterTempStore, calculate_water_temperature
+from effemeridi_pesca import get_moon_phase, get_season
+from punteggio_pesca import (ScoringEngine, calculate_fish_activity, weather_index, moon_index, season_index, scoring_engine,
+                             zone_ranking)
+from meteo_pesca import parse_hourly_columns
+from core_pesca import process_weather_data, process_hourly_forecast
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_path(location_name):
+    """File della fixture di una zona"""
+    slug = ''.join(c.lower() if c.isalnum() else '_' for c in location_name).strip('_')
+    return os.path.join(FIXTURES_DIR, f"{slug}.json")
+
+
+def record_fixtures():
+    """Scarica e salva le risposte reali di Open-Meteo per tutte le zone"""
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for location_name, coords in ZONE_COORDINATES.items():
+        response = http_session.get(OPEN_METEO_URL, params=build_forecast_params(coords['lat'], coords['lon']), timeout=30)
+        response.raise_for_status()
+        with open(fixture_path(location_name), 'w', encoding='utf-8') as f:
+            json.dump(response.json(), f)
+        print(f"Registrata {fixture_path(location_name)}")
+
+
+def fixtures_from_snapshots(root=SNAPSHOT_DIR):
+    """Usa come fixture l'ultima risposta archiviata di ogni zona (nessuna chiamata di rete)"""
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    store = SnapshotStore(root)
+    for location_name, coords in ZONE_COORDINATES.items():
+        data, fetched_at = store.latest(forecast_key(coords['lat'], coords['lon']))
+        if data is None:
+            print(f"Nessuna snapshot per {location_name} in {root}")
+            continue
+        with open(fixture_path(location_name), 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        print(f"Copiata {fixture_path(location_name)} (download del {datetime.fromtimestamp(fetched_at):%Y-%m-%d %H:%M})")
+
+
+def synthesize_fixtures(seed=42):
+    """Genera fixture deterministiche con lo stesso schema delle risposte di Open-Meteo"""
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    rng = random.Random(seed)
+    start = datetime(2025, 5, 1)
+    hours = 24 * (PAST_DAYS + FORECAST_DAYS)
+    codes = [0, 1, 2, 3, 45, 51, 61, 63, 80, 95]
+    for location_name, coords in ZONE_COORDINATES.items():
+        times = [(start + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M') for i in range(hours)]
+        base = rng.uniform(10, 16)
+        temperature = [round(base + 6 * np.sin((i % 24 - 9) / 24 * 2 * np.pi) + rng.gauss(0, 0.8), 1) for i in range(hours)]
+        pressure = [round(1013 + 8 * np.sin(i / 60) + rng.gauss(0, 1), 1) for i in range(hours)]
+        payload = {
+            'latitude': coords['lat'], 'longitude': coords['lon'], 'generationtime_ms': 0.2,
+            'utc_offset_seconds': 7200, 'timezone': 'Europe/Rome', 'timezone_abbreviation': 'CEST', 'elevation': 200.0,
+            'current_units': {'time': 'iso8601', 'interval': 'seconds', 'temperature_2m': '°C', 'relative_humidity_2m': '%',
+                              'pressure_msl': 'hPa', 'wind_speed_10m': 'km/h', 'cloud_cover': '%', 'weather_code': 'wmo code'},
+            'current': {'time': times[24 * PAST_DAYS + 10], 'interval': 900, 'temperature_2m': temperature[24 * PAST_DAYS + 10],
+                        'relative_humidity_2m': rng.randint(50, 90), 'pressure_msl': pressure[24 * PAST_DAYS + 10],
+                        'wind_speed_10m': round(rng.uniform(0, 8), 1), 'cloud_cover': rng.randint(0, 100),
+                        'weather_code': rng.choice(codes)},
+            'hourly_units': {'time': 'iso8601', 'temperature_2m': '°C', 'precipitation_probability': '%',
+                             'weather_code': 'wmo code', 'wind_speed_10m': 'km/h', 'pressure_msl': 'hPa'},
+            'hourly': {
+                'time': times,
+                'temperature_2m': temperature,
+                'precipitation_probability': [rng.randint(0, 100) for _ in range(hours)],
+                'weather_code': [rng.choice(codes) for _ in range(hours)],
+                'wind_speed_10m': [round(rng.uniform(0, 10), 1) for _ in range(hours)],
+                'pressure_msl': pressure
+            }
+        }
+        with open(fixture_path(location_name), 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        print(f"Generata {fixture_path(location_name)}")
+
+
+def load_fixtures():
+    """Carica le fixture spostando gli orari sul giorno corrente (le ore future restano future)"""
+    fixtures = {}
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for location_name in ZONE_COORDINATES:
+        with open(fixture_path(location_name), encoding='utf-8') as f:
+            data = json.load(f)
+        times = [datetime.fromisoformat(t) for t in data['hourly']['time']]
+        shift = (today - timedelta(days=PAST_DAYS)) - times[0].replace(hour=0, minute=0)
+        data['hourly']['time'] = [(t + shift).strftime('%Y-%m-%dT%H:%M') for t in times]
+        fixtures[location_name] = data
+    return fixtures
+
+
+def measure(func, repeat):
+    """Latenze (ms) su `repeat` chiamate e memoria allocata da una chiamata misurata a parte"""
+    func()  # riscaldamento
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    func()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'calls': repeat,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'peak_kb': (peak - before) / 1024,
+        'retained_kb': (after - before) / 1024
+    }
+
+
+def hot_path_benchmarks(fixtures, repeat):
+    """Benchmark delle funzioni eseguite a ogni render"""
+    results = {}
+    moon_phase, current_season = get_moon_phase(), get_season()
+    zones = list(ZONE_COORDINATES.items())
+
+    def all_zones(func):
+        return lambda: [func(name, coords, fixtures[name]) for name, coords in zones]
+
+    results['process_weather_data (4 zone)'] = measure(
+        all_zones(lambda name, coords, data: process_weather_data(data, name, coords['lat'], coords['lon'])), repeat)
+    results['process_hourly_forecast (4 zone)'] = measure(
+        all_zones(lambda name, coords, data: process_hourly_forecast(data)), repeat)
+    columns = {name: parse_hourly_columns(fixtures[name]) for name, _ in zones}
+    results['process_hourly_forecast (4 zone, colonne in cache)'] = measure(
+        all_zones(lambda name, coords, data: process_hourly_forecast(data, columns[name])), repeat)
+    results['calculate_water_temperature (4 zone, con archivio)'] = measure(
+        all_zones(lambda name, coords, data: calculate_water_temperature(
+            data['current']['temperature_2m'], data['current'], name, data['hourly'])), repeat)
+    results['water_temp_store lettura+scrittura'] = measure(
+        lambda: acqua_pesca.water_temp_store.append('Oleggio', [datetime.now().date()], [14.0], [0.1], [15.0], [14.0])
+        or acqua_pesca.water_temp_store.last_state('Oleggio', datetime.now().date() + timedelta(days=1)), repeat)
+
+    weather = {name: process_weather_data(fixtures[name], name, coords['lat'], coords['lon']) for name, coords in zones}
+    # Copia della tabella: il riferimento scalare non paga i controlli del file della vista
+    species = list(FISH_SPECIES.values())
+
+    def scalar_scores():
+        return [
+            calculate_fish_activity(fish, weather[name], moon_phase, current_season, name)
+            for name in weather
+            for fish in species
+            if any(habitat in name for habitat in fish['habitat'])
+        ]
+
+    results['calculate_fish_activity (specie × zone)'] = measure(scalar_scores, repeat)
+    results['scoring_engine.score_zone (4 zone)'] = measure(
+        lambda: [scoring_engine.score_zone(weather[name], moon_phase, current_season, name) for name in weather], repeat)
+    results['zone_ranking (4 zone, in cache)'] = measure(
+        lambda: [zone_ranking(weather[name], moon_phase, current_season, name) for name in weather], repeat)
+    return results
+
+
+def synthetic_tables(zone_count, species_count, seed=0):
+    """Zone e specie sintetiche con la stessa struttura di ZONE_COORDINATES e FISH_SPECIES"""
+    rng = random.Random(seed)
+    templates = list(FISH_SPECIES.values())
+    zones = {f"Zona {i}": {'lat': 45 + rng.random(), 'lon': 8 + rng.random()} for i in range(zone_count)}
+    zone_names = list(zones)
+    species = {}
+    for i in range(species_count):
+        template = templates[i % len(templates)]
+        temp_min = rng.randint(4, 18)
+        pressure_low = rng.randint(995, 1012)
+        # Zone preferite scelte nell'habitat, come nei dati reali (altrimenti il registro avvisa)
+        habitat = rng.sample(zone_names, max(1, zone_count // 3))
+        species[f"Specie {i}"] = {
+            **template,
+            'temp_min': temp_min,
+            'temp_max': temp_min + rng.randint(6, 14),
+            'pressure_low': pressure_low,
+            'pressure_high': pressure_low + rng.randint(10, 25),
+            'habitat': habitat,
+            'zone_preferite': rng.sample(habitat, max(1, zone_count // 5))
+        }
+    return zones, species
+
+
+def scaling_benchmarks(sizes, repeat, max_scalar_calls=1_000_000):
+    """Confronto tra il modello a dizionari (una chiamata per specie e zona) e il motore vettoriale"""
+    results = {}
+    moon_phase, current_season = get_moon_phase(), get_season()
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        zones, species = synthetic_tables(size, size)
+        zone_names = list(zones)
+        water = np.round(rng.uniform(4, 26, len(zone_names)), 1)
+        pressure = rng.integers(995, 1035, len(zone_names))
+        weather = [{'water_temperature': float(w), 'pressure': int(p), 'weather_main': 'Clouds'} for w, p in zip(water, pressure)]
+
+        calls = size * size
+        if calls <= max_scalar_calls:
+            def scalar():
+                return [
+                    calculate_fish_activity(fish, weather[z], moon_phase, current_season, name)
+                    for z, name in enumerate(zone_names)
+                    for fish in species.values()
+                    if any(habitat in name for habitat in fish['habitat'])
+                ]
+            results[f'dizionari {size}×{size}'] = measure(scalar, max(1, repeat // max(1, calls // 10_000)))
+
+        start = time.perf_counter()
+        engine = ScoringEngine(species, zones)
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        def vectorized():
+            return engine.score(water[:, None], pressure[:, None], moon_index(moon_phase), season_index(current_season),
+                                weather_index('Clouds'))
+        results[f'vettoriale {size}×{size}'] = measure(vectorized, max(1, repeat // max(1, calls // 100_000)))
+        results[f'vettoriale {size}×{size}']['compile_ms'] = compile_ms
+    return results
+
+
+def print_table(title, results):
+    """Stampa i risultati in una tabella leggibile"""
+    print(f"\n{title}")
+    print(f"{'':55} {'chiamate':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'picco KB':>10}")
+    for name, r in results.items():
+        print(f"{name:55} {r['calls']:>8} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['peak_kb']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei percorsi critici di Pesca Lombardia")
+    parser.add_argument('--repeat', type=int, default=200, help="chiamate misurate per benchmark")
+    parser.add_argument('--scale', type=int, nargs='*', default=[10, 100, 1000],
+                        help="dimensioni zone × specie sintetiche (default: 10 100 1000)")
+    parser.add_argument('--record', action='store_true', help="registra fixture reali da Open-Meteo ed esce")
+    parser.add_argument('--synthesize', action='store_true', help="genera fixture deterministiche ed esce")
+    parser.add_argument('--from-snapshots', nargs='?', const=SNAPSHOT_DIR, metavar='DIR',
+                        help="copia come fixture le ultime snapshot dell'archivio ed esce")
+    parser.add_argument('--json', help="salva anche i risultati in questo file JSON")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixtures()
+        return 0
+    if args.synthesize:
+        synthesize_fixtures()
+        return 0
+    if args.from_snapshots:
+        fixtures_from_snapshots(args.from_snapshots)
+        return 0
+
+    fixtures = load_fixtures()
+    results = {}
+    # L'archivio delle temperature va in una cartella temporanea, non tocca quello reale
+    with tempfile.TemporaryDirectory() as workdir:
+        acqua_pesca.water_temp_store = WaterTempStore(path=os.path.join(workdir, "water_temp_history.bin"), legacy_path=None)
+        results['hot_path'] = hot_path_benchmarks(fixtures, args.repeat)
+        print_table("Percorsi eseguiti a ogni render", results['hot_path'])
+        if args.scale:
+            results['scaling'] = scaling_benchmarks(args.scale, args.repeat)
+            print_table("Scalabilità zone × specie", results['scaling'])
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# Cache in memoria condivisa tra tutte le sessioni Streamlit
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Cache LRU con scadenza allineata a intervalli fissi (es. allo scoccare dell'ora)"""
+
+    def __init__(self, ttl=3600, max_entries=128, align=True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.align = align
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expiry(self, stored_at):
+        """Calcola l'istante di scadenza di una voce"""
+        if self.align:
+            # Scade al prossimo multiplo del TTL: con 3600 s segue l'aggiornamento orario dei modelli
+            return (stored_at // self.ttl + 1) * self.ttl
+        return stored_at + self.ttl
+
+    def _lookup(self, key):
+        """Voce valida per la chiave (None se assente o scaduta), aggiornando LRU e contatori"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires'] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get(self, key, default=None):
+        """Restituisce il valore se presente e non scaduto, altrimenti default"""
+        entry = self._lookup(key)
+        return default if entry is None else entry['value']
+
+    def get_with_time(self, key):
+        """Come get(), ma restituisce (valore, istante di inserimento) oppure (None, None)"""
+        entry = self._lookup(key)
+        if entry is None:
+            return None, None
+        return entry['value'], entry['stored_at']
+
+    def contains(self, key):
+        """Vero se la voce è presente e non scaduta (non aggiorna i contatori)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry['expires'] > time.time()
+
+    def put(self, key, value, stored_at=None):
+        """Inserisce un valore, eliminando le voci usate meno di recente oltre il limite.
+
+        stored_at permette di reinserire un valore salvato in passato (es. da disco)
+        mantenendone l'età e quindi la scadenza originale.
+        """
+        stored_at = time.time() if stored_at is None else stored_at
+        with self._lock:
+            self._entries[key] = {'value': value, 'stored_at': stored_at, 'expires': self._expiry(stored_at), 'derived': {}}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_derived(self, key, name, source):
+        """Risultato derivato associato alla voce, se contiene ancora il valore source e non è scaduta"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['value'] is not source or entry['expires'] <= time.time():
+                return None
+            return entry['derived'].get(name)
+
+    def put_derived(self, key, name, value, source):
+        """Associa un risultato derivato alla voce, solo se contiene ancora il valore source.
+
+        I risultati derivati scadono e vengono eliminati insieme alla voce da cui provengono.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['value'] is source:
+                entry['derived'][name] = value
+
+    def invalidate_where(self, predicate):
+        """Rimuove le voci la cui chiave soddisfa predicate; restituisce quante"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def invalidate_derived(self, predicate):
+        """Rimuove da tutte le voci i risultati derivati il cui nome soddisfa predicate; restituisce quanti"""
+        removed = 0
+        with self._lock:
+            for entry in self._entries.values():
+                for name in [name for name in entry['derived'] if predicate(name)]:
+                    del entry['derived'][name]
+                    removed += 1
+        return removed
+
+    def age(self, key):
+        """Secondi trascorsi dall'inserimento della voce (None se assente)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return time.time() - entry['stored_at']
+
+    def invalidate(self, key=None):
+        """Rimuove una voce, o tutte se key è None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Contatori di hit/miss ed età delle voci presenti"""
+        now = time.time()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'ages': {key: round(now - entry['stored_at'], 1) for key, entry in self._entries.items()}
+            }
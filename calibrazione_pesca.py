@@ -0,0 +1,355 @@
+# Calibrazione delle soglie delle specie e dei pesi del punteggio su dati storici
+#
+# Esempi:
+#   python calibrazione_pesca.py --catch-log catture.csv                          # ricerca a griglia
+#   python calibrazione_pesca.py --catch-log catture.csv --method random --samples 400 --workers 8
+#   python calibrazione_pesca.py --catch-log catture.csv --output calibrazione.json
+#
+# Gli ingressi (meteo orario, temperatura acqua, luna, stagione) si calcolano una volta
+# sola con backtest_pesca; ogni configurazione candidata costa solo un nuovo punteggio
+# vettoriale. L'obiettivo è il rango medio delle ore di cattura tra le ore della zona
+# (il "percentile" del back-testing), misurato su un periodo di addestramento e
+# verificato sulle catture più recenti (holdout).
+
+import argparse
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from database_pesca import ZONE_COORDINATES, FISH_SPECIES
+from acqua_pesca import DAYTIME_HOURS
+from punteggio_pesca import SCORE_WEIGHTS, ScoringEngine
+from backtest_pesca import (ARCHIVE_DIR, ARCHIVE_DELAY_DAYS, WARMUP_DAYS, download_archive, prepare_inputs,
+                            load_catch_log, match_catch_log, catch_scores, score_histograms, percentile_ranks)
+
+THRESHOLDS = ('temp_min', 'temp_max', 'pressure_low', 'pressure_high')
+# Spostamenti provati per le soglie (°C e hPa) nella ricerca a griglia
+TEMP_OFFSETS = (-3.0, -1.5, 0.0, 1.5, 3.0)
+PRESSURE_OFFSETS = (-6, -3, 0, 3, 6)
+# Pesi calibrati a gruppi, con moltiplicatori rispetto a SCORE_WEIGHTS
+WEIGHT_GROUPS = {
+    'temperature': ('temp_in_range', 'temp_near', 'temp_out'),
+    'pressure': ('pressure_in_range', 'pressure_out'),
+    'moon': ('moon',),
+    'season': ('season',),
+    'zone': ('zone',),
+    'weather': ('weather_dry', 'weather_wet')
+}
+WEIGHT_MULTIPLIERS = (0.5, 1.0, 1.5)
+RANDOM_MULTIPLIER_RANGE = (0.25, 2.0)
+
+# Ore campionate per stimare la distribuzione dei punteggi di ogni zona (0 = tutte):
+# i ranghi restano stimati bene e ogni candidato costa una frazione del periodo intero
+SAMPLE_HOURS = 20000
+# Quota più recente delle catture tenuta da parte per la verifica
+HOLDOUT = 0.25
+TOP_CONFIGURATIONS = 10
+
+# Stato dei processi worker: ingressi e registro caricati una volta per processo
+_worker = {}
+
+
+def _init_worker(inputs, rows, zones):
+    _worker.update(inputs=inputs, rows=rows, zones=zones)
+
+
+def _objective(species, weights):
+    """Rango medio delle catture per specie su addestramento e holdout, per una configurazione"""
+    inputs, rows = _worker['inputs'], _worker['rows']
+    engine = ScoringEngine(species, _worker['zones'], weights)
+    scores = engine.score(inputs['water_temp'], inputs['pressure'], inputs['moon'][None], inputs['season'][None],
+                          inputs['weather'])
+
+    values = catch_scores(scores, inputs['valid'], rows)
+    ok = ~np.isnan(values)
+    ranks = np.zeros(len(values))
+    histogram = score_histograms(scores, inputs['valid'] & inputs['sample'][None])
+    ranks[ok] = percentile_ranks(histogram, rows['s'].values[ok], rows['z'].values[ok], values[ok])
+
+    result = []
+    for part in (rows['train'].values, ~rows['train'].values):
+        weight = np.where(ok & part, rows['catches'].values, 0)
+        total = np.bincount(rows['s'].values, weights=weight, minlength=len(species))
+        ranked = np.bincount(rows['s'].values, weights=weight * ranks, minlength=len(species))
+        result.append((ranked, total))
+    return result
+
+
+def _evaluate(candidate):
+    """Worker: candidate è (tabella specie, pesi); restituisce somme per specie (train, holdout)"""
+    return _objective(*candidate)
+
+
+def apply_offsets(species, offsets):
+    """Tabella specie con le quattro soglie spostate degli stessi offset"""
+    shifted = {}
+    for name, profile in species.items():
+        profile = dict(profile)
+        for field, offset in zip(THRESHOLDS, offsets):
+            profile[field] = round(profile[field] + offset, 1)
+        shifted[name] = profile
+    return shifted
+
+
+def _valid_profile(profile):
+    return profile['temp_min'] < profile['temp_max'] and profile['pressure_low'] < profile['pressure_high']
+
+
+def threshold_candidates(method, samples, rng):
+    """Offset (temp_min, temp_max, pressure_low, pressure_high) da provare (il primo è sempre nullo)"""
+    if method == 'grid':
+        grid = itertools.product(TEMP_OFFSETS, TEMP_OFFSETS, PRESSURE_OFFSETS, PRESSURE_OFFSETS)
+        return [(0.0, 0.0, 0, 0)] + [o for o in grid if any(o)]
+    temp, pressure = max(TEMP_OFFSETS), max(PRESSURE_OFFSETS)
+    return [(0.0, 0.0, 0, 0)] + [
+        (round(rng.uniform(-temp, temp), 1), round(rng.uniform(-temp, temp), 1),
+         int(rng.integers(-pressure, pressure + 1)), int(rng.integers(-pressure, pressure + 1)))
+        for _ in range(samples)
+    ]
+
+
+def weight_candidates(method, samples, rng):
+    """Pesi da provare, come moltiplicatori per gruppo applicati a SCORE_WEIGHTS"""
+    if method == 'grid':
+        multipliers = list(itertools.product(WEIGHT_MULTIPLIERS, repeat=len(WEIGHT_GROUPS)))
+    else:
+        multipliers = [(1.0,) * len(WEIGHT_GROUPS)] + [
+            tuple(np.round(rng.uniform(*RANDOM_MULTIPLIER_RANGE, len(WEIGHT_GROUPS)), 2)) for _ in range(samples)
+        ]
+    candidates = []
+    for factors in multipliers:
+        weights = dict(SCORE_WEIGHTS)
+        for group, factor in zip(WEIGHT_GROUPS.values(), factors):
+            for name in group:
+                weights[name] = int(round(SCORE_WEIGHTS[name] * factor))
+        candidates.append((dict(zip(WEIGHT_GROUPS, factors)), weights))
+    return candidates
+
+
+def _run(candidates, inputs, rows, zones, workers):
+    """Valuta le configurazioni, in parallelo su più processi se workers > 1"""
+    workers = min(workers or os.cpu_count() or 1, len(candidates))
+    if workers <= 1:
+        _init_worker(inputs, rows, zones)
+        return [_evaluate(candidate) for candidate in candidates]
+    chunksize = max(1, len(candidates) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(inputs, rows, zones)) as pool:
+        return list(pool.map(_evaluate, candidates, chunksize=chunksize))
+
+
+def reduce_inputs(inputs, rows, sample_hours=SAMPLE_HOURS, seed=0):
+    """Restringe gli ingressi alle ore che servono: un campione fisso per le distribuzioni
+    dei punteggi più le ore del registro (con le ore diurne delle uscite senza orario).
+
+    Restituisce (ingressi ridotti con la maschera 'sample', righe con gli indici ora rimappati).
+    """
+    hours = len(inputs['time'])
+    if not sample_hours or sample_hours >= hours:
+        sample = np.ones(hours, dtype=bool)
+    else:
+        sample = np.zeros(hours, dtype=bool)
+        sample[np.random.default_rng(seed).choice(hours, sample_hours, replace=False)] = True
+
+    needed = sample.copy()
+    needed[rows['h'].values] = True
+    day_start = rows['h'].values[rows['date_only'].values] - rows['h'].values[rows['date_only'].values] % 24
+    daytime = (day_start[:, None] + np.arange(DAYTIME_HOURS[0], DAYTIME_HOURS[1] + 1)[None]).ravel()
+    needed[daytime[daytime < hours]] = True
+
+    columns = np.flatnonzero(needed)
+    reduced = {key: (value[..., columns] if isinstance(value, np.ndarray) else value) for key, value in inputs.items()}
+    reduced['sample'] = sample[columns]
+
+    # Posizione delle ore nel sottoinsieme; le finestre diurne restano contigue solo sul periodo intero,
+    # quindi le uscite senza orario diventano righe con l'ora esatta per ciascuna ora diurna
+    position = np.full(hours, -1)
+    position[columns] = np.arange(len(columns))
+    exact = rows[~rows['date_only']].copy()
+    exact['h'] = position[exact['h'].values]
+    by_day = rows[rows['date_only']]
+    expanded = []
+    for hour in range(DAYTIME_HOURS[0], DAYTIME_HOURS[1] + 1):
+        part = by_day.copy()
+        part['h'] = part['h'].values - part['h'].values % 24 + hour
+        part = part[part['h'] < hours]
+        part['h'] = position[part['h'].values]
+        # Ogni ora diurna pesa 1/n della cattura
+        part['catches'] = part['catches'] / (DAYTIME_HOURS[1] - DAYTIME_HOURS[0] + 1)
+        part['date_only'] = False
+        expanded.append(part)
+    return reduced, pd.concat([exact] + expanded, ignore_index=True)
+
+
+def _mean(ranked, total):
+    return np.where(total > 0, ranked / np.maximum(total, 1), np.nan)
+
+
+def calibrate(inputs, rows, species=FISH_SPECIES, zones=ZONE_COORDINATES, method='grid', samples=200,
+              workers=None, seed=0, sample_hours=SAMPLE_HOURS):
+    """Ricerca in due fasi: soglie per specie (separabili), poi pesi globali.
+
+    Il punteggio di una specie dipende solo dalle sue soglie: ogni candidato sposta
+    le soglie di tutte le specie insieme e per ciascuna si tiene lo spostamento
+    migliore. I pesi sono comuni a tutte le specie e si valutano sulla media totale.
+    Restituisce un dizionario con le classifiche delle due fasi, la tabella specie e
+    i pesi risultanti.
+    """
+    rng = np.random.default_rng(seed)
+    # Una sola versione delle tabelle per tutta la ricerca, anche se il file cambia nel frattempo
+    species, zones = dict(species), dict(zones)
+    names = list(species)
+    inputs, rows = reduce_inputs(inputs, rows, sample_hours, seed)
+
+    # Fase 1: soglie per specie
+    offsets = threshold_candidates(method, samples, rng)
+    tables = [apply_offsets(species, o) for o in offsets]
+    results = _run([(table, SCORE_WEIGHTS) for table in tables], inputs, rows, zones, workers)
+    original = [r[0].sum() / max(r[1].sum(), 1) for r in results[0]]
+    train = np.array([_mean(*r[0]) for r in results])        # (candidati, specie)
+    holdout = np.array([_mean(*r[1]) for r in results])
+    for k, table in enumerate(tables):
+        for s, name in enumerate(names):
+            if not _valid_profile(table[name]):
+                train[k, s] = -np.inf
+
+    threshold_ranking = []
+    calibrated = {}
+    for s, name in enumerate(names):
+        if np.isnan(train[0, s]):
+            # Nessuna cattura della specie nel periodo: soglie invariate
+            calibrated[name] = dict(species[name])
+            continue
+        order = np.argsort(np.nan_to_num(-train[:, s], nan=np.inf), kind='stable')
+        best = order[0] if train[order[0], s] > train[0, s] else 0
+        calibrated[name] = tables[best][name]
+        for rank, k in enumerate(order[:TOP_CONFIGURATIONS], 1):
+            threshold_ranking.append({
+                'species': name, 'rank': rank, **dict(zip(THRESHOLDS, offsets[k])),
+                'train': round(train[k, s], 4), 'holdout': round(holdout[k, s], 4),
+                'baseline_train': round(train[0, s], 4), 'baseline_holdout': round(holdout[0, s], 4)
+            })
+
+    # Fase 2: pesi sulle soglie calibrate
+    weight_sets = weight_candidates(method, samples, rng)
+    results = _run([(calibrated, weights) for _, weights in weight_sets], inputs, rows, zones, workers)
+    totals = [[r[part][0].sum() / max(r[part][1].sum(), 1) for part in (0, 1)] for r in results]
+    baseline = next(i for i, (factors, _) in enumerate(weight_sets) if all(f == 1.0 for f in factors.values()))
+
+    order = sorted(range(len(weight_sets)), key=lambda i: totals[i][0], reverse=True)
+    best = order[0] if totals[order[0]][0] > totals[baseline][0] else baseline
+    weight_ranking = [
+        {'rank': rank, **weight_sets[i][0], 'train': round(totals[i][0], 4), 'holdout': round(totals[i][1], 4)}
+        for rank, i in enumerate(order[:TOP_CONFIGURATIONS], 1)
+    ]
+
+    return {
+        'thresholds': pd.DataFrame(threshold_ranking),
+        'weights_ranking': pd.DataFrame(weight_ranking),
+        'species': calibrated,
+        'weights': weight_sets[best][1],
+        'objective': {
+            'before': {'train': round(original[0], 4), 'holdout': round(original[1], 4)},
+            'after': {'train': round(totals[best][0], 4), 'holdout': round(totals[best][1], 4)}
+        },
+        'candidates': len(offsets) + len(weight_sets)
+    }
+
+
+def species_changes(before, after):
+    """Tabella delle soglie cambiate (vecchio -> nuovo) per la revisione"""
+    changes = []
+    for name, profile in after.items():
+        for field in THRESHOLDS:
+            if profile[field] != before[name][field]:
+                changes.append({'species': name, 'field': field, 'before': before[name][field], 'after': profile[field]})
+    return pd.DataFrame(changes, columns=['species', 'field', 'before', 'after'])
+
+
+def split_holdout(rows, holdout=HOLDOUT):
+    """Segna come addestramento le catture più vecchie, lasciando le ultime per la verifica"""
+    rows = rows.copy()
+    if holdout <= 0 or rows.empty:
+        rows['train'] = True
+    else:
+        cutoff = rows['date'].quantile(1 - holdout)
+        rows['train'] = rows['date'] < cutoff
+    return rows
+
+
+def parse_args(argv=None):
+    today = date.today()
+    parser = argparse.ArgumentParser(description="Calibrazione di soglie e pesi del punteggio su dati storici")
+    parser.add_argument('--catch-log', required=True, help="CSV del registro catture (come per backtest_pesca.py)")
+    parser.add_argument('--start', type=date.fromisoformat, default=date(today.year - 3, 1, 1),
+                        help="primo giorno (default: 1 gennaio di tre anni fa)")
+    parser.add_argument('--end', type=date.fromisoformat, default=today - timedelta(days=ARCHIVE_DELAY_DAYS),
+                        help=f"ultimo giorno (default: {ARCHIVE_DELAY_DAYS} giorni fa)")
+    parser.add_argument('--method', choices=['grid', 'random'], default='grid', help="tipo di ricerca (default: grid)")
+    parser.add_argument('--samples', type=int, default=200, help="configurazioni per fase con --method random")
+    parser.add_argument('--holdout', type=float, default=HOLDOUT,
+                        help=f"quota più recente delle catture usata solo per la verifica (default: {HOLDOUT})")
+    parser.add_argument('--workers', type=int, help="processi (default: CPU disponibili)")
+    parser.add_argument('--seed', type=int, default=0, help="seme della ricerca casuale e del campione di ore")
+    parser.add_argument('--sample-hours', type=int, default=SAMPLE_HOURS,
+                        help=f"ore campionate per le distribuzioni dei punteggi, 0 = tutte (default: {SAMPLE_HOURS})")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help=f"cartella dell'archivio storico (default: {ARCHIVE_DIR})")
+    parser.add_argument('--offline', action='store_true', help="usa solo l'archivio già scaricato")
+    parser.add_argument('--output', '-o', help="salva tabella specie, pesi e classifiche in questo JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.end < args.start:
+        print("--end precede --start", file=sys.stderr)
+        return 2
+
+    zones, species = dict(ZONE_COORDINATES), dict(FISH_SPECIES)
+    if not args.offline:
+        download_archive(zones, args.start - timedelta(days=WARMUP_DAYS), args.end, args.archive_dir)
+    inputs = prepare_inputs(zones, args.start, args.end, args.archive_dir)
+    rows = match_catch_log(inputs, tuple(species), load_catch_log(args.catch_log))
+    rows = split_holdout(rows[rows['catches'] > 0], args.holdout)
+    if rows.empty:
+        print("Nessuna cattura del registro nel periodo indicato", file=sys.stderr)
+        return 1
+    print(f"{len(rows)} righe del registro ({int(rows['train'].sum())} di addestramento), "
+          f"{len(inputs['time'])} ore × {len(inputs['zones'])} zone", file=sys.stderr)
+
+    result = calibrate(inputs, rows, species, zones, method=args.method, samples=args.samples, workers=args.workers, seed=args.seed,
+                       sample_hours=args.sample_hours)
+    print(f"{result['candidates']} configurazioni valutate", file=sys.stderr)
+
+    print("\nSoglie per specie (offset migliori)")
+    print(result['thresholds'].groupby('species').head(3).to_string(index=False))
+    print("\nPesi (moltiplicatori per gruppo)")
+    print(result['weights_ranking'].to_string(index=False))
+    print("\nSoglie modificate")
+    print(species_changes(species, result['species']).to_string(index=False))
+    print("\nPesi risultanti")
+    print(', '.join(f"{name}={value}" for name, value in result['weights'].items()))
+    print(f"\nObiettivo prima: {result['objective']['before']}  dopo: {result['objective']['after']}")
+
+    if args.output:
+        report = {
+            'period': [args.start.isoformat(), args.end.isoformat()],
+            'method': args.method,
+            'objective': result['objective'],
+            'weights': result['weights'],
+            'species': result['species'],
+            'threshold_ranking': result['thresholds'].to_dict(orient='records'),
+            'weight_ranking': result['weights_ranking'].to_dict(orient='records')
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
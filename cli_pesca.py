@@ -0,0 +1,60 @@
+# Calcolo delle previsioni di pesca da riga di comando, senza Streamlit
+#
+# Esempi:
+#   python cli_pesca.py                                  # JSON su stdout
+#   python cli_pesca.py --format csv --output previsioni.csv
+#   python cli_pesca.py --format parquet --output previsioni.parquet --refresh
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from core_pesca import build_zone_forecasts, forecasts_to_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Previsioni di pesca per tutte le zone e specie")
+    parser.add_argument('--format', choices=['json', 'csv', 'parquet'], default='json',
+                        help="formato di uscita (default: json)")
+    parser.add_argument('--output', '-o', help="file di uscita (default: stdout, non per parquet)")
+    parser.add_argument('--refresh', action='store_true',
+                        help="ignora la cache e scarica previsioni nuove")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.format == 'parquet' and not args.output:
+        print("Il formato parquet richiede --output", file=sys.stderr)
+        return 2
+
+    forecasts = build_zone_forecasts(force_refresh=args.refresh)
+
+    if args.format == 'json':
+        text = json.dumps({'generated_at': datetime.now().isoformat(timespec='seconds'), 'zones': forecasts},
+                          ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(text)
+        else:
+            print(text)
+        return 0
+
+    table = pd.DataFrame(forecasts_to_rows(forecasts))
+    if args.format == 'csv':
+        table.to_csv(args.output or sys.stdout, index=False)
+        return 0
+
+    try:
+        table.to_parquet(args.output, index=False)
+    except ImportError:
+        print("Per il formato parquet installa pyarrow (pip install pyarrow)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
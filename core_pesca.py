@@ -0,0 +1,352 @@
+# Logica dell'app senza interfaccia: meteo, temperatura acqua e punteggi per tutte le zone
+# Non importa streamlit: è usabile da script, cron job e worker
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+from database_pesca import get_zones
+from meteo_pesca import (fetch_forecast_stale, fetch_forecasts_stale, get_weather_description, get_weather_main, describe_weather_codes, hourly_columns, parse_hourly_columns)
+from acqua_pesca import calculate_water_temperature
+from effemeridi_pesca import get_moon_phase, get_season
+from punteggio_pesca import zone_ranking, hourly_activity, best_windows
+from immagini_pesca import DETAIL_IMAGE_WIDTH, image_catalog
+from spaziale_pesca import get_zone_index
+
+# Ricerca delle zone migliori attorno a una posizione
+NEARBY_RADIUS_KM = 20
+NEARBY_LIMIT = 10
+
+
+def get_water_level_trend(location_name, current_data):
+    """Determina l'andamento del livello dell'acqua basato su meteo e condizioni"""
+    precipitation = current_data.get('precipitation', 0)
+    weather_code = current_data.get('weather_code', 0)
+    
+    # Pioggia attuale o prevista aumenta il livello
+    if weather_code in [61, 63, 65, 80, 81, 82, 95, 96, 99]:
+        return "↑ Salendo", "green"
+    elif precipitation > 2.0:
+        return "↑ Salendo", "green"
+    # Condizioni secche diminuiscono il livello
+    elif weather_code in [0, 1] and precipitation == 0:
+        return "↓ Scendendo", "red"
+    else:
+        return "→ Stabile", "blue"
+
+# Immagini delle specie (varianti già ridimensionate in memoria)
+def get_fish_image(fish_name, width=DETAIL_IMAGE_WIDTH, image_format='jpeg'):
+    """Variante in memoria dell'immagine del pesce (dict con data, mime, etag), o None se manca.
+
+    Di default JPEG: st.image ricodifica in JPEG i formati diversi da JPEG/PNG/GIF,
+    mentre un JPEG già della larghezza giusta passa senza essere toccato.
+    """
+    return image_catalog.variant(fish_name, width, image_format)
+
+# Funzione per ottenere dati meteo reali da Open-Meteo (GRATUITA)
+def get_real_weather_data(lat, lon, location_name, force_refresh=False):
+    """Ottiene dati meteo reali da Open-Meteo - API Gratuita (con cache oraria condivisa).
+
+    Se la cache è scaduta restituisce subito l'ultima previsione valida, con la sua
+    età, mentre quella nuova viene scaricata in background.
+    """
+    try:
+        # API Open-Meteo - completamente gratuita con previsioni orarie
+        data, fetched_at, stale = fetch_forecast_stale(lat, lon, force_refresh=force_refresh)
+        
+        if data is not None:
+            return process_weather_data(data, location_name, lat, lon, fetched_at, stale)
+        else:
+            return get_fallback_weather_data(location_name)
+            
+    except Exception as e:
+        return get_fallback_weather_data(location_name)
+
+def format_data_age(seconds):
+    """Età dei dati in forma leggibile (es. '5 min', '2 h 10 min')"""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "meno di 1 min"
+    if minutes < 60:
+        return f"{minutes} min"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} h {minutes} min" if minutes else f"{hours} h"
+
+def process_weather_data(data, location_name, lat, lon, fetched_at=None, stale=False):
+    """Elabora i dati meteo ricevuti dall'API Open-Meteo.
+
+    fetched_at è l'istante del download (per l'età dei dati), stale indica che la
+    previsione è l'ultima valida servita mentre si scarica quella nuova.
+    """
+    current = data['current']
+    air_temp = current['temperature_2m']
+    
+    # Converti weather code in descrizione
+    weather_condition = get_weather_description(current['weather_code'])
+    
+    # Colonne orarie tipizzate, condivise da previsioni, modello termico e punteggi
+    columns = hourly_columns(data, lat, lon)
+    
+    # Processa le previsioni orarie con pressione
+    hourly_data = process_hourly_forecast(data, columns)
+    
+    # Calcola andamento livello acqua
+    water_level_trend, level_color = get_water_level_trend(location_name, current)
+    
+    # Il blocco orario include i giorni passati: servono a rigiocare il modello termico
+    water_temp = calculate_water_temperature(air_temp, current, location_name, columns)
+    
+    weather_info = {
+        'location': location_name,
+        'temperature': round(air_temp, 1),
+        'water_temperature': water_temp,
+        'pressure': round(current['pressure_msl']),
+        'humidity': current['relative_humidity_2m'],
+        'wind_speed': round(current['wind_speed_10m'] * 3.6, 1),  # m/s to km/h
+        'weather_condition': weather_condition,
+        'weather_main': get_weather_main(current['weather_code']),
+        'clouds': current['cloud_cover'],
+        'visibility': 10,
+        'hourly_forecast': hourly_data,
+        # Punteggi di tutte le specie per ogni ora dell'orizzonte (in cache con la previsione)
+        'hourly_activity': hourly_activity(lat, lon, location_name, data, water_temp, columns),
+        'water_level_trend': water_level_trend,
+        'water_level_color': level_color,
+        'data_age': None if fetched_at is None else round(time.time() - fetched_at),
+        'fetched_at': fetched_at,
+        'stale': stale,
+        'success': True
+    }
+    return weather_info
+
+def process_hourly_forecast(data, columns=None):
+    """Processa le previsioni orarie per le prossime 6 ore con pressione.
+
+    Lavora sulle colonne tipizzate: la finestra si trova con una ricerca binaria sugli
+    orari e i dizionari vengono creati solo per le righe mostrate.
+    """
+    if columns is None:
+        columns = parse_hourly_columns(data)
+    times = columns['time']
+    
+    # Prendiamo solo le prossime 6 ore (la prima ora successiva ad adesso e le 5 seguenti)
+    start = np.searchsorted(times, np.datetime64(datetime.now(), 'm'), side='right')
+    window = slice(start, start + 6)
+    descriptions = describe_weather_codes(columns['weather_code'][window])
+    
+    forecast = []
+    for offset, i in enumerate(range(*window.indices(len(times)))):
+        forecast.append({
+            'time': times[i].astype(datetime).strftime('%H:%M'),
+            'temperature': round(float(columns['temperature_2m'][i]), 1),
+            'pressure': round(float(columns['pressure_msl'][i])),
+            'precipitation_probability': int(columns['precipitation_probability'][i]),
+            'weather_code': int(columns['weather_code'][i]),
+            'weather_description': descriptions[offset],
+            'wind_speed': round(float(columns['wind_speed_10m'][i]) * 3.6, 1)
+        })
+    
+    return forecast
+
+def get_fallback_weather_data(location_name):
+    """Dati di fallback se l'API non funziona"""
+    current_month = datetime.now().month
+    if current_month in [12, 1, 2]:
+        temp = np.random.randint(0, 8)
+        water_temp = max(2, temp - 2)
+        weather_cond = np.random.choice(['Nuvoloso', 'Sereno', 'Nebbia'])
+    elif current_month in [6, 7, 8]:
+        temp = np.random.randint(22, 32)
+        water_temp = temp - 3
+        weather_cond = np.random.choice(['Sereno', 'Parzialmente nuvoloso', 'Temporale'])
+    else:
+        temp = np.random.randint(10, 20)
+        water_temp = temp - 2
+        weather_cond = np.random.choice(['Nuvoloso', 'Pioggia leggera', 'Sereno'])
+    
+    if "Panperduto" in location_name:
+        water_temp -= 1
+    elif "Lago di Varese" in location_name:
+        water_temp += 1
+    elif "Oleggio" in location_name:
+        water_temp += 0.5
+    
+    # Calcola andamento livello acqua per fallback
+    water_level_trend, level_color = get_water_level_trend(location_name, {'weather_code': 0})
+    
+    # Previsioni orarie fallback con pressione
+    hourly_forecast = []
+    current_hour = datetime.now().hour
+    base_pressure = np.random.randint(1005, 1025)
+    
+    for i in range(6):
+        hour = (current_hour + i + 1) % 24
+        pressure = base_pressure + np.random.randint(-3, 4)
+            
+        hourly_forecast.append({
+            'time': f"{hour:02d}:00",
+            'temperature': temp + np.random.randint(-2, 3),
+            'pressure': pressure,
+            'precipitation_probability': np.random.randint(0, 30),
+            'weather_description': weather_cond,
+            'wind_speed': np.random.randint(5, 15)
+        })
+    
+    return {
+        'location': location_name,
+        'temperature': temp,
+        'water_temperature': water_temp,
+        'pressure': base_pressure,
+        'humidity': np.random.randint(50, 85),
+        'wind_speed': np.random.randint(5, 20),
+        'weather_condition': weather_cond,
+        'weather_main': 'Clouds',
+        'clouds': np.random.randint(20, 80),
+        'visibility': np.random.randint(5, 15),
+        'hourly_forecast': hourly_forecast,
+        'hourly_activity': None,
+        'water_level_trend': water_level_trend,
+        'water_level_color': level_color,
+        'data_age': None,
+        'fetched_at': None,
+        'stale': False,
+        'success': False
+    }
+
+
+def get_all_zones_weather(zones=None, force_refresh=False, wait_missing=True):
+    """Dati meteo elaborati per tutte le zone, serviti subito dalla cache.
+
+    zones è un dict nome -> coordinate (default le zone correnti del file dei dati).
+    Con la cache scaduta ogni zona riceve l'ultima previsione valida, mentre quelle
+    nuove si scaricano in background con una sola richiesta batch. Si aspetta la
+    rete solo per le zone mai viste (e con force_refresh); con wait_missing=False
+    mai, e le zone senza previsioni usano i dati simulati.
+    """
+    zones = get_zones() if zones is None else zones
+    try:
+        forecasts = fetch_forecasts_stale(zones, force_refresh=force_refresh, wait_missing=wait_missing)
+    except Exception:
+        forecasts = {}
+
+    weather = {}
+    for location_name, coords in zones.items():
+        data, fetched_at, stale = forecasts.get(location_name, (None, None, False))
+        try:
+            if data is not None:
+                weather[location_name] = process_weather_data(
+                    data, location_name, coords['lat'], coords['lon'], fetched_at, stale
+                )
+                continue
+        except Exception:
+            pass
+        weather[location_name] = get_fallback_weather_data(location_name)
+    return weather
+
+
+def best_spots(lat, lon, radius_km=NEARBY_RADIUS_KM, limit=NEARBY_LIMIT, species=None, force_refresh=False):
+    """Zone entro radius_km dalla posizione, ordinate per punteggio attuale e poi per distanza.
+
+    Il punteggio è quello della specie indicata o, senza species, della specie migliore
+    della zona. Chiamata a ogni rendering, non aspetta mai la rete: usa le previsioni in
+    cache o l'ultima valida e avvia in background il download (batch) delle zone
+    scadute o mancanti. Le classifiche arrivano dalla cache condivisa; le zone senza
+    previsioni reali (ancora in download o con soli dati simulati) sono escluse.
+    """
+    zones = get_zones()
+    nearby = [(name, distance) for name, distance in get_zone_index().within(lat, lon, radius_km) if name in zones]
+    if not nearby:
+        return []
+    weather = get_all_zones_weather({name: zones[name] for name, _ in nearby}, force_refresh, wait_missing=False)
+    moon_phase = get_moon_phase()
+    current_season = get_season()
+
+    spots = []
+    for name, distance in nearby:
+        if not weather[name]['success']:
+            continue
+        ranking = zone_ranking(weather[name], moon_phase, current_season, name)
+        if species is not None:
+            score = dict(ranking).get(species)
+            best = species
+        else:
+            best, score = ranking[0] if ranking else (None, None)
+        if score is None:
+            continue
+        spots.append({
+            'zone': name,
+            'lat': zones[name]['lat'],
+            'lon': zones[name]['lon'],
+            'distance_km': round(distance, 1),
+            'species': best,
+            'score': score,
+            'stale': weather[name]['stale']
+        })
+    spots.sort(key=lambda spot: (-spot['score'], spot['distance_km']))
+    return spots[:limit]
+
+
+def build_zone_forecasts(zones=None, force_refresh=False):
+    """Condizioni, previsioni orarie e classifica delle specie per ogni zona (serializzabile in JSON)"""
+    moon_phase = get_moon_phase()
+    current_season = get_season()
+    results = {}
+
+    for location_name, weather_data in get_all_zones_weather(zones, force_refresh).items():
+        ranking = zone_ranking(weather_data, moon_phase, current_season, location_name)
+        windows = {}
+        if weather_data['hourly_activity'] is not None:
+            windows = {window['species']: window for window in best_windows(weather_data['hourly_activity'])}
+
+        species = []
+        for fish_name, score in ranking:
+            window = windows.get(fish_name)
+            species.append({
+                'species': fish_name,
+                'score': score,
+                'best_window_start': window['start'].isoformat() if window else None,
+                'best_window_end': window['end'].isoformat() if window else None,
+                'best_window_score': window['score'] if window else None
+            })
+
+        conditions = {key: value for key, value in weather_data.items() if key != 'hourly_activity'}
+        results[location_name] = {
+            'conditions': _to_builtin(conditions),
+            'moon_phase': moon_phase,
+            'season': current_season,
+            'species': species
+        }
+    return results
+
+
+def forecasts_to_rows(forecasts):
+    """Appiattisce il risultato di build_zone_forecasts in una riga per zona e specie"""
+    rows = []
+    for location_name, forecast in forecasts.items():
+        conditions = forecast['conditions']
+        for entry in forecast['species']:
+            rows.append({
+                'zone': location_name,
+                'air_temperature': conditions['temperature'],
+                'water_temperature': conditions['water_temperature'],
+                'pressure': conditions['pressure'],
+                'weather_condition': conditions['weather_condition'],
+                'moon_phase': forecast['moon_phase'],
+                'season': forecast['season'],
+                'real_data': conditions['success'],
+                'data_age': conditions['data_age'],
+                **entry
+            })
+    return rows
+
+
+def _to_builtin(value):
+    """Converte gli scalari NumPy (es. dai dati di fallback) in tipi Python serializzabili"""
+    if isinstance(value, dict):
+        return {key: _to_builtin(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_builtin(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
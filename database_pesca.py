@@ -1,171 +1,253 @@
-# Database delle specie ittiche e configurazioni
+# Database delle specie ittiche e configurazioni, letto da dati_pesca.json e ricaricato a caldo
 
+import copy
+import json
+import os
+import threading
+import time
+import warnings
+from collections.abc import Mapping
 from datetime import date
 
-# Coordinate precise delle zone di pesca richieste - AGGIORNATE
-ZONE_COORDINATES = {
-    'Panperduto': {'lat': 45.7286, 'lon': 8.6358},
-    'Lago Maggiore - Lombardia': {'lat': 45.9000, 'lon': 8.6500},
-    'Lago di Varese': {'lat': 45.8167, 'lon': 8.7333},
-    'Oleggio': {'lat': 45.5967, 'lon': 8.6386}
-}
-
-# Calendario aperture pesca in Lombardia (Regolamento Regionale) - AGGIORNATO 2025
-FISHING_CALENDAR = {
-    'Trota Fario': {
-        'apertura': date(2025, 3, 1),
-        'chiusura': date(2025, 9, 30),
-        'note': 'Misura minima 22 cm - Limite giornaliero 5 esemplari',
-        'zone': ['Panperduto', 'Oleggio']
-    },
-    'Luccio': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Misura minima 50 cm - Divieto di pesca dal 15/03 al 31/05',
-        'zone': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Panperduto', 'Oleggio']
-    },
-    'Carpa': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Nessuna misura minima - No limite giornaliero',
-        'zone': ['Lago di Varese', 'Oleggio', 'Lago Maggiore - Lombardia']
-    },
-    'Persico Reale': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Misura minima 18 cm - Limite giornaliero 10 esemplari',
-        'zone': ['Lago Maggiore - Lombardia', 'Lago di Varese']
-    },
-    'Siluro': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Nessuna misura minima - Obbligo di rimozione',
-        'zone': ['Panperduto', 'Oleggio']
-    },
-    'Cavedano': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Misura minima 15 cm - Limite giornaliero 20 esemplari',
-        'zone': ['Panperduto', 'Oleggio']
-    },
-    'Luccio Perca': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Misura minima 18 cm - Limite giornaliero 10 esemplari',
-        'zone': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Oleggio']
-    },
-    'Barbo': {
-        'apertura': date(2025, 1, 1),
-        'chiusura': date(2025, 12, 31),
-        'note': 'Misura minima 20 cm - Limite giornaliero 5 esemplari',
-        'zone': ['Panperduto', 'Oleggio']
+# Zone (coordinate e parametri termici dell'acqua), calendario e specie
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dati_pesca.json")
+# Ogni quanti secondi al massimo si controlla se il file è cambiato
+RELOAD_CHECK_INTERVAL = 2.0
+# Parametri termici per le zone che non li specificano
+DEFAULT_ZONE_WATER = {'monthly': (15.0,) * 12, 'limits': (2, 28), 'heat_factor': 0.0}
+
+
+class DataWarning(UserWarning):
+    """Il file dei dati modificato non è leggibile o non è valido: resta in uso la versione precedente"""
+
+
+def parse_month_day(text):
+    """Giorno che si ripete ogni anno come (mese, giorno), da 'MM-GG' (in 'AAAA-MM-GG' l'anno è ignorato)"""
+    parts = str(text).split('-')
+    if len(parts) == 3:
+        parts = parts[1:]
+    if len(parts) != 2:
+        raise ValueError(f"data non valida: {text!r} (atteso 'MM-GG')")
+    month, day = int(parts[0]), int(parts[1])
+    # Il 2000 è bisestile: il 29 febbraio è un giorno valido
+    date(2000, month, day)
+    return month, day
+
+
+def parse_calendar_entry(entry):
+    """Voce del calendario con apertura, chiusura e divieti come (mese, giorno)"""
+    return {
+        **entry,
+        'apertura': parse_month_day(entry['apertura']),
+        'chiusura': parse_month_day(entry['chiusura']),
+        'divieti': tuple(
+            {
+                'dal': parse_month_day(period['dal']),
+                'al': parse_month_day(period['al']),
+                'zone': None if period.get('zone') is None else tuple(period['zone']),
+                'nota': period.get('nota', '')
+            }
+            for period in entry.get('divieti', ())
+        )
     }
-}
-
-# Database delle specie ittiche specifiche per le tue zone - AGGIORNATO CORRETTAMENTE
-FISH_SPECIES = {
-    'Trota Fario': {
-        'temp_min': 8,
-        'temp_max': 18,
-        'pressure_low': 1000,
-        'pressure_high': 1020,
-        'moon_best': ['🌑 Luna Nuova', '🌕 Luna Piena'],
-        'season_best': ['Primavera', 'Autunno'],
-        'active_hours': ['mattina', 'sera'],
-        'habitat': ['Panperduto', 'Oleggio'],
-        'esche': ['Camoscio', 'Lombrico', 'Artificiali'],
-        'tecniche': ['Spinning', 'Mosca'],
-        'zone_preferite': ['Panperduto']
-    },
-    'Luccio': {
-        'temp_min': 10,
-        'temp_max': 22,
-        'pressure_low': 1005,
-        'pressure_high': 1025,
-        'moon_best': ['🌒 Luna Crescente', '🌓 Primo Quarto'],
-        'season_best': ['Primavera', 'Autunno'],
-        'active_hours': ['alba', 'tramonto'],
-        'habitat': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Panperduto', 'Oleggio'],
-        'esche': ['Cucchiaini', 'Siluri', 'Esche vive'],
-        'tecniche': ['Spinning', 'Traina'],
-        'zone_preferite': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Oleggio']
-    },
-    'Carpa': {
-        'temp_min': 15,
-        'temp_max': 25,
-        'pressure_low': 1010,
-        'pressure_high': 1030,
-        'moon_best': ['🌕 Luna Piena', '🌒 Luna Crescente'],
-        'season_best': ['Estate', 'Primavera'],
-        'active_hours': ['giorno', 'sera', 'notte'],
-        'habitat': ['Lago di Varese', 'Oleggio', 'Panperduto'],
-        'esche': ['Mais', 'Bolle', 'Paste'],
-        'tecniche': ['Carpfishing', 'Feeder'],
-        'zone_preferite': ['Lago di Varese', 'Oleggio']
-    },
-    'Persico Reale': {
-        'temp_min': 12,
-        'temp_max': 24,
-        'pressure_low': 1008,
-        'pressure_high': 1022,
-        'moon_best': ['🌒 Luna Crescente', '🌓 Primo Quarto'],
-        'season_best': ['Primavera', 'Estate'],
-        'active_hours': ['mattina', 'pomeriggio'],
-        'habitat': ['Lago Maggiore - Lombardia', 'Lago di Varese'],
-        'esche': ['Camosci', 'Lombrici', 'Artificiali'],
-        'tecniche': ['Spinning', 'Bolognese'],
-        'zone_preferite': ['Lago Maggiore - Lombardia', 'Lago di Varese']
-    },
-    'Siluro': {
-        'temp_min': 16,
-        'temp_max': 28,
-        'pressure_low': 1000,
-        'pressure_high': 1020,
-        'moon_best': ['🌑 Luna Nuova'],
-        'season_best': ['Estate', 'Autunno'],
-        'active_hours': ['sera', 'notte'],
-        'habitat': ['Panperduto', 'Oleggio'],
-        'esche': ['Esche vive', 'Pesci morti'],
-        'tecniche': ['Spinning', 'Traina', 'Fondo'],
-        'zone_preferite': ['Panperduto', 'Oleggio']
-    },
-    'Cavedano': {
-        'temp_min': 10,
-        'temp_max': 26,
-        'pressure_low': 1005,
-        'pressure_high': 1025,
-        'moon_best': ['🌕 Luna Piena', '🌒 Luna Crescente'],
-        'season_best': ['Primavera', 'Estate'],
-        'active_hours': ['giorno', 'tramonto'],
-        'habitat': ['Panperduto', 'Oleggio'],
-        'esche': ['Lombrico', 'Mais', 'Paste'],
-        'tecniche': ['Bolognese', 'Inglese'],
-        'zone_preferite': ['Oleggio', 'Panperduto']
-    },
-    'Luccio Perca': {
-        'temp_min': 14,
-        'temp_max': 26,
-        'pressure_low': 1008,
-        'pressure_high': 1025,
-        'moon_best': ['🌒 Luna Crescente', '🌓 Primo Quarto'],
-        'season_best': ['Primavera', 'Estate', 'Autunno'],
-        'active_hours': ['mattina', 'pomeriggio', 'sera'],
-        'habitat': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Oleggio'],
-        'esche': ['Cucchiaini', 'Artificiali', 'Esche vive'],
-        'tecniche': ['Spinning', 'Traina', 'Bolognese'],
-        'zone_preferite': ['Lago Maggiore - Lombardia', 'Lago di Varese', 'Oleggio']
-    },
-    'Barbo': {
-        'temp_min': 12,
-        'temp_max': 24,
-        'pressure_low': 1005,
-        'pressure_high': 1020,
-        'moon_best': ['🌕 Luna Piena', '🌒 Luna Crescente'],
-        'season_best': ['Primavera', 'Estate'],
-        'active_hours': ['sera', 'notte'],
-        'habitat': ['Panperduto', 'Oleggio'],
-        'esche': ['Lombrico', 'Bigattini', 'Paste', 'Mais'],
-        'tecniche': ['Bolognese', 'Feeder', 'Fondo'],
-        'zone_preferite': ['Panperduto', 'Oleggio']
+
+
+def parse_data(raw):
+    """Tabelle in memoria dal contenuto del file (stessa struttura dei vecchi letterali Python).
+
+    Restituisce un dict con 'zones' (nome -> lat, lon), 'water' (nome -> parametri del
+    modello dell'acqua, solo per le zone che li hanno), 'calendar' (periodi ricorrenti
+    ogni anno, con le date come (mese, giorno)) e 'species'.
+    """
+    zones, water = {}, {}
+    for name, zone in raw['zone'].items():
+        zones[name] = {'lat': float(zone['lat']), 'lon': float(zone['lon'])}
+        if 'acqua_mensile' in zone:
+            monthly = tuple(float(t) for t in zone['acqua_mensile'])
+            if len(monthly) != 12:
+                raise ValueError(f"{name}: acqua_mensile deve avere 12 valori")
+            water[name] = {
+                'monthly': monthly,
+                'limits': tuple(zone.get('limiti_acqua', DEFAULT_ZONE_WATER['limits'])),
+                'heat_factor': float(zone.get('fattore_calore', DEFAULT_ZONE_WATER['heat_factor']))
+            }
+
+    calendar = {name: parse_calendar_entry(entry) for name, entry in raw.get('calendario', {}).items()}
+    return {'zones': zones, 'water': water, 'calendar': calendar, 'species': raw['specie']}
+
+
+def load_data(path=DATA_FILE):
+    """Legge e converte il file dei dati"""
+    with open(path, encoding='utf-8') as f:
+        return parse_data(json.load(f))
+
+
+def diff_data(old, new):
+    """Nomi delle voci aggiunte, rimosse o modificate per tabella: {'zones', 'calendar', 'species'}.
+
+    Una zona cambia anche quando cambiano solo i suoi parametri termici.
+    """
+    def changed(a, b):
+        return {name for name in a.keys() | b.keys() if a.get(name) != b.get(name)}
+
+    return {
+        'zones': changed(old['zones'], new['zones']) | changed(old['water'], new['water']),
+        'calendar': changed(old['calendar'], new['calendar']),
+        'species': changed(old['species'], new['species'])
     }
-}
\ No newline at end of file
+
+
+class Database:
+    """Dati correnti del file, sostituiti in blocco quando il file cambia.
+
+    data è un dict mai modificato dopo la pubblicazione: chi lo legge una volta ha
+    una vista coerente anche se nel frattempo arriva una nuova versione. I validatori
+    (funzione(dati) che solleva ValueError) possono scartare una versione prima che
+    venga pubblicata; i listener (funzione(vecchi, nuovi, modifiche)) ricevono solo
+    le voci cambiate e invalidano le cache derivate di conseguenza.
+    """
+
+    def __init__(self, path=DATA_FILE, check_interval=RELOAD_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._validators = []
+        self._listeners = []
+        self._signature = self._stat()
+        self._last_check = time.time()
+        self.data = load_data(path)
+        self.version = 1
+        self.reloads = 0
+        self.error = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def add_validator(self, validator):
+        self._validators.append(validator)
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def maybe_reload(self):
+        """Ricarica il file se è cambiato; il controllo costa un os.stat ogni check_interval secondi.
+
+        Restituisce le modifiche applicate, o None se non è cambiato nulla.
+        """
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return None
+        # Un solo thread controlla e ricarica; gli altri proseguono con i dati attuali
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self._last_check = now
+            signature = self._stat()
+            if signature is None or signature == self._signature:
+                return None
+            self._signature = signature
+            return self._reload()
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        """Ricarica subito il file, anche se non sembra cambiato"""
+        with self._lock:
+            self._signature = self._stat()
+            self._last_check = time.time()
+            return self._reload()
+
+    def _reload(self):
+        try:
+            data = load_data(self.path)
+            for validator in self._validators:
+                validator(data)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # File scritto a metà o dati incoerenti: si tiene la versione in uso
+            self.error = f"{type(e).__name__}: {e}"
+            warnings.warn(f"{self.path} non ricaricato ({self.error})", DataWarning, stacklevel=3)
+            return None
+
+        self.error = None
+        old = self.data
+        changes = diff_data(old, data)
+        if not any(changes.values()):
+            return None
+        self.data = data
+        self.version += 1
+        self.reloads += 1
+        for listener in self._listeners:
+            listener(old, data, changes)
+        return changes
+
+
+database = Database()
+
+
+def get_zones():
+    """Coordinate delle zone nella versione più recente del file"""
+    database.maybe_reload()
+    return database.data['zones']
+
+
+def get_calendar():
+    """Calendario delle aperture nella versione più recente del file"""
+    database.maybe_reload()
+    return database.data['calendar']
+
+
+def get_species():
+    """Tabella delle specie nella versione più recente del file"""
+    database.maybe_reload()
+    return database.data['species']
+
+
+def get_water(location_name):
+    """Parametri termici dell'acqua della zona (DEFAULT_ZONE_WATER se il file non li indica)"""
+    return database.data['water'].get(location_name, DEFAULT_ZONE_WATER)
+
+
+class LiveTable(Mapping):
+    """Vista in sola lettura di una tabella del database, sempre sulla versione più recente del file.
+
+    Ogni accesso controlla il file come get_zones(): chi deve leggere più volte una
+    versione coerente ne prende una copia (dict(vista)). Copie profonde e pickle (es.
+    verso i processi worker) diventano dict ordinari con i dati del momento.
+    """
+
+    def __init__(self, source, table):
+        self._source = source
+        self._table = table
+
+    def _current(self):
+        self._source.maybe_reload()
+        return self._source.data[self._table]
+
+    def __getitem__(self, name):
+        return self._current()[name]
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+    def __repr__(self):
+        return f"LiveTable({self._table!r}, {self._current()!r})"
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self._current()), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self._current()),)
+
+
+# Tabelle della versione corrente, come nomi storici per script e strumenti batch
+# (back-test, calibrazione, benchmark); si aggiornano con i ricaricamenti del file
+ZONE_COORDINATES = LiveTable(database, 'zones')
+FISHING_CALENDAR = LiveTable(database, 'calendar')
+FISH_SPECIES = LiveTable(database, 'species')
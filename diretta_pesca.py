@@ -0,0 +1,103 @@
+# Condizioni in diretta: un'istantanea condivisa da tutte le sessioni e, per il flusso /events
+# dell'API, le differenze tra due versioni
+
+import threading
+import time
+
+from database_pesca import get_zones
+from core_pesca import get_all_zones_weather
+from meteo_pesca import prefetch_zones
+
+# Ogni quanto si aggiornano metriche e previsioni orarie mostrate (secondi)
+LIVE_INTERVAL = 60
+# Campi non pubblicati: punteggi orari (pesanti e non mostrati) ed età dei dati (cambia a ogni lettura:
+# resta fetched_at, l'istante del download, da cui chi mostra i dati ricava l'età)
+LIVE_EXCLUDED = ('hourly_activity', 'data_age')
+
+
+def live_values(weather_data):
+    """Condizioni attuali e previsioni orarie di una zona, senza i campi esclusi"""
+    return {key: value for key, value in weather_data.items() if key not in LIVE_EXCLUDED}
+
+
+def conditions_diff(old, new):
+    """Valori cambiati tra due istantanee zona -> condizioni, come {zona: {campo: nuovo valore}}.
+
+    Una zona nuova compare con tutti i campi, una zona rimossa con None; le zone
+    senza cambiamenti non compaiono.
+    """
+    changes = {}
+    for zone, values in new.items():
+        before = old.get(zone, {})
+        changed = {key: value for key, value in values.items() if before.get(key) != value}
+        if changed:
+            changes[zone] = changed
+    for zone in old.keys() - new.keys():
+        changes[zone] = None
+    return changes
+
+
+class LiveFeed:
+    """Istantanea delle condizioni di tutte le zone, ricalcolata al più una volta per intervallo.
+
+    La prima sessione che la trova scaduta la ricalcola (lock non bloccante, come il
+    ricaricamento del file dei dati) e le altre continuano a leggere quella corrente.
+    Il ricalcolo non aspetta mai la rete: usa le previsioni in cache o l'ultima valida,
+    mentre le zone scadute si scaricano in background e arrivano al ricalcolo successivo.
+    I frammenti di Streamlit ridisegnano comunque tutto il blocco: i soli valori cambiati
+    viaggiano sul flusso /events dell'API (conditions_diff).
+    """
+
+    def __init__(self, interval=LIVE_INTERVAL):
+        self.interval = interval
+        self.snapshot = {}
+        self.updated_at = None
+        self._expired = False
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        # Prima di leggere le cache: un download che finisce durante il ricalcolo lo fa ripetere
+        self._expired = False
+        weather = get_all_zones_weather(get_zones(), wait_missing=False)
+        self.snapshot = {zone: live_values(data) for zone, data in weather.items()}
+        self.updated_at = time.time()
+
+    def _expire(self, _future=None):
+        """Fa ricalcolare l'istantanea alla prossima lettura (callback di fine download)"""
+        self._expired = True
+
+    def is_expired(self):
+        return self._expired or self.updated_at is None or time.time() - self.updated_at >= self.interval
+
+    def refresh(self, force_refresh=False):
+        """Ricalcola subito l'istantanea con le previsioni in memoria.
+
+        Con force_refresh invece riscarica in background tutte le zone e ritorna subito:
+        l'istantanea si ricalcola alla prima lettura dopo la fine di ogni download.
+        """
+        if force_refresh:
+            for future in prefetch_zones(get_zones(), force_refresh=True).values():
+                future.add_done_callback(self._expire)
+            return
+        with self._lock:
+            self._refresh()
+
+    def maybe_refresh(self):
+        """Ricalcola l'istantanea se è scaduta; non aspetta mai, né la rete né un altro ricalcolo"""
+        if not self.is_expired():
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self.is_expired():
+                self._refresh()
+        finally:
+            self._lock.release()
+
+    def get(self, zone):
+        """Condizioni correnti della zona, o None se non è nell'istantanea (es. mentre la prima si calcola)"""
+        self.maybe_refresh()
+        return self.snapshot.get(zone)
+
+
+live_feed = LiveFeed()
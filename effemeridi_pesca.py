@@ -0,0 +1,177 @@
+# Tabella precalcolata di fasi lunari e stagioni, con ricerca vettoriale per data
+
+import os
+from datetime import date
+
+import numpy as np
+
+# Etichette usate in FISH_SPECIES (moon_best, season_best)
+MOON_PHASES = ('🌑 Luna Nuova', '🌒 Luna Crescente', '🌓 Primo Quarto', '🌕 Luna Piena', '🌗 Ultimo Quarto')
+SEASONS = ('Inverno', 'Primavera', 'Estate', 'Autunno')
+
+# Mese (1-12) -> indice in SEASONS
+SEASON_BY_MONTH = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0], dtype=np.int8)
+
+MOON_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "effemeridi_luna.npz")
+MOON_TABLE_YEARS = (2020, 2045)
+
+# Fasi principali (elongazione 0, 90, 180, 270 gradi) -> indice in MOON_PHASES
+PRINCIPAL_PHASES = np.array([0, 2, 3, 4], dtype=np.int8)
+# Giorni dall'istante di luna nuova entro cui un giorno è "Luna Nuova"
+NEW_MOON_DAYS = 1.0
+# Margine (giorni) attorno ai giorni richiesti per trovare gli istanti precedente e successivo
+PHASE_SEARCH_MARGIN = 10
+
+
+def moon_elongation(days):
+    """Elongazione Luna-Sole in gradi per istanti in giorni giuliani dal J2000 (serie ridotta di Meeus)"""
+    d = np.asarray(days, dtype=np.float64)
+    rad = np.radians
+
+    # Sole: anomalia media e longitudine eclittica
+    sun_anomaly = rad(357.5291 + 0.98560028 * d)
+    sun_lon = 280.459 + 0.98564736 * d + 1.915 * np.sin(sun_anomaly) + 0.020 * np.sin(2 * sun_anomaly)
+
+    # Luna: longitudine media, anomalia media, elongazione media
+    moon_mean_lon = 218.316 + 13.176396 * d
+    moon_anomaly = rad(134.963 + 13.064993 * d)
+    mean_elongation = rad(297.850 + 12.190749 * d)
+    moon_lon = (moon_mean_lon
+                + 6.289 * np.sin(moon_anomaly)
+                + 1.274 * np.sin(2 * mean_elongation - moon_anomaly)
+                + 0.658 * np.sin(2 * mean_elongation)
+                + 0.214 * np.sin(2 * moon_anomaly)
+                - 0.186 * np.sin(sun_anomaly)
+                - 0.114 * np.sin(2 * rad(93.272 + 13.229350 * d)))
+
+    return np.mod(moon_lon - sun_lon, 360.0)
+
+
+def principal_phase_times(first_day, last_day):
+    """Istanti (giorni dal J2000) delle fasi principali tra first_day e last_day, con il tipo (0-3).
+
+    L'elongazione campionata ogni ora cresce sempre: ogni volta che supera un multiplo
+    di 90 gradi c'è una fase principale, e l'istante si interpola tra le due ore.
+    """
+    hours = np.arange(np.floor(first_day) * 24, np.ceil(last_day) * 24 + 1) / 24
+    elongation = np.degrees(np.unwrap(np.radians(moon_elongation(hours))))
+    quarter = np.floor(elongation / 90).astype(np.int64)
+    crossed = np.flatnonzero(np.diff(quarter) > 0)
+    target = quarter[crossed + 1] * 90.0
+    fraction = (target - elongation[crossed]) / (elongation[crossed + 1] - elongation[crossed])
+    return hours[crossed] + fraction / 24, quarter[crossed + 1] % 4
+
+
+def classify_moon_phases(days):
+    """Indice in MOON_PHASES per istanti in giorni dal J2000, dalla fase principale più vicina.
+
+    Primo Quarto, Luna Piena e Ultimo Quarto vanno ai giorni più vicini al loro istante;
+    tra i giorni più vicini alla luna nuova è "Luna Nuova" chi dista meno di NEW_MOON_DAYS,
+    "Luna Crescente" chi viene dopo e "Ultimo Quarto" (luna calante) chi viene prima.
+    """
+    days = np.asarray(days, dtype=np.float64)
+    if days.size == 0:
+        return np.zeros(days.shape, dtype=np.int8)
+    times, kinds = principal_phase_times(days.min() - PHASE_SEARCH_MARGIN, days.max() + PHASE_SEARCH_MARGIN)
+    following = np.searchsorted(times, days)
+    after = np.abs(times[following] - days) < np.abs(days - times[following - 1])
+    nearest = np.where(after, following, following - 1)
+    offset = days - times[nearest]
+
+    phases = PRINCIPAL_PHASES[kinds[nearest]]
+    waxing = MOON_PHASES.index('🌒 Luna Crescente')
+    waning = MOON_PHASES.index('🌗 Ultimo Quarto')
+    new_moon = kinds[nearest] == 0
+    phases = np.where(new_moon & (np.abs(offset) >= NEW_MOON_DAYS), np.where(offset > 0, waxing, waning), phases)
+    return phases.astype(np.int8)
+
+
+def build_moon_table(first_year=MOON_TABLE_YEARS[0], last_year=MOON_TABLE_YEARS[1]):
+    """Calcola illuminazione e fase per ogni giorno (alle 12 UTC) degli anni indicati"""
+    start = np.datetime64(f'{first_year}-01-01', 'D')
+    end = np.datetime64(f'{last_year + 1}-01-01', 'D')
+    days = np.arange(start, end)
+    # Giorni dal J2000 (2000-01-01 12:00 UTC): a mezzogiorno coincidono con la data
+    j2000 = (days - np.datetime64('2000-01-01', 'D')).astype(np.float64)
+    elongation = moon_elongation(j2000)
+
+    return {
+        'start': start,
+        'illumination': ((1 - np.cos(np.radians(elongation))) / 2).astype(np.float32),
+        'phase': classify_moon_phases(j2000)
+    }
+
+
+def load_moon_table(path=MOON_TABLE_FILE):
+    """Carica la tabella dal file .npz (rigenerandola se manca)"""
+    try:
+        with np.load(path) as table:
+            return {
+                'start': table['start'][()],
+                'illumination': table['illumination'],
+                'phase': table['phase']
+            }
+    except (OSError, KeyError, ValueError):
+        table = build_moon_table()
+        try:
+            np.savez_compressed(path, **table)
+        except OSError:
+            pass
+        return table
+
+
+moon_table = load_moon_table()
+
+
+def _day_offsets(times):
+    """Posizione nella tabella per ogni istante (-1 fuori dall'intervallo coperto)"""
+    offsets = (np.asarray(times, dtype='datetime64[D]') - moon_table['start']).astype(np.int64)
+    return np.where((offsets >= 0) & (offsets < len(moon_table['phase'])), offsets, -1)
+
+
+def moon_phase_indices(times):
+    """Indice in MOON_PHASES per un array di datetime64, con ricerca O(1) nella tabella"""
+    offsets = _day_offsets(times)
+    phases = moon_table['phase'][np.maximum(offsets, 0)]
+    outside = offsets < 0
+    if outside.any():
+        # Fuori tabella si calcola direttamente (stesso metodo, più lento)
+        days = (np.asarray(times, dtype='datetime64[D]')[outside] - np.datetime64('2000-01-01', 'D')).astype(np.float64)
+        phases = phases.copy()
+        phases[outside] = classify_moon_phases(days)
+    return phases
+
+
+def moon_illumination(times):
+    """Frazione illuminata del disco lunare per un array di datetime64"""
+    offsets = _day_offsets(times)
+    illumination = moon_table['illumination'][np.maximum(offsets, 0)].astype(np.float64)
+    outside = offsets < 0
+    if outside.any():
+        days = (np.asarray(times, dtype='datetime64[D]')[outside] - np.datetime64('2000-01-01', 'D')).astype(np.float64)
+        illumination[outside] = (1 - np.cos(np.radians(moon_elongation(days)))) / 2
+    return illumination
+
+
+def season_indices(times):
+    """Indice in SEASONS per un array di datetime64"""
+    months = np.asarray(times, dtype='datetime64[M]').astype(np.int64) % 12
+    return SEASON_BY_MONTH[months]
+
+
+def get_moon_phase(day=None):
+    """Fase lunare del giorno indicato (default oggi)"""
+    day = day or date.today()
+    return MOON_PHASES[int(moon_phase_indices(np.array([day], dtype='datetime64[D]'))[0])]
+
+
+def get_season(day=None):
+    """Stagione del giorno indicato (default oggi)"""
+    day = day or date.today()
+    return SEASONS[SEASON_BY_MONTH[day.month - 1]]
+
+
+if __name__ == "__main__":
+    # Rigenera il file della tabella (es. per estendere gli anni coperti)
+    np.savez_compressed(MOON_TABLE_FILE, **build_moon_table())
+    print(f"Tabella salvata in {MOON_TABLE_FILE}")
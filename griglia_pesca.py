@@ -0,0 +1,296 @@
+# Modalità griglia: punteggi di attività su tutte le celle di un riquadro, come mappe di calore
+#
+# Esempi:
+#   python griglia_pesca.py                                        # area Ticino/Verbano, celle da 0.02°
+#   python griglia_pesca.py --bbox 45.55 8.45 46.10 8.85 --resolution 0.01 --output griglia.npz
+#   python griglia_pesca.py --png mappe/ --hour 6                  # una PNG per specie, tra 6 ore
+#
+# Il file .npz contiene 'scores' (specie, ore, righe, colonne) int16, 'valid' (ore, righe,
+# colonne), 'water_temp' (righe, colonne), gli assi 'lat', 'lon', 'time' e i nomi 'species'.
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+from database_pesca import get_zones, get_water
+from meteo_pesca import (OPEN_METEO_URL, TIMEZONE, FORECAST_DAYS, PAST_DAYS, PREFETCH_WORKERS, http_session,
+                         hourly_times)
+from acqua_pesca import (DAYTIME_HOURS, CLEAR_CODES, RAIN_CODES, daily_weather, simulate_water_temperature,
+                         water_temperature_step)
+from effemeridi_pesca import moon_phase_indices, season_indices
+from punteggio_pesca import get_engine, weather_code_index
+
+# Riquadro (lat min, lon min, lat max, lon max): Ticino da Oleggio al Lago Maggiore e Lago di Varese
+DEFAULT_BBOX = (45.55, 8.45, 46.10, 8.85)
+# Gradi (~2 km): vicino alla risoluzione dei modelli usati da Open-Meteo in zona
+DEFAULT_RESOLUTION = 0.02
+DEFAULT_OUTPUT = "griglia_pesca.npz"
+GRID_VARIABLES = ('temperature_2m', 'weather_code', 'wind_speed_10m', 'pressure_msl')
+# Coordinate per richiesta (URL entro i limiti) e richieste contemporanee verso Open-Meteo
+CHUNK_SIZE = 100
+MAX_CONCURRENCY = PREFETCH_WORKERS
+GRID_TIMEOUT = 30
+# Protezione dalle griglie troppo fitte: ogni cella conta come una chiamata nei limiti di Open-Meteo
+MAX_CELLS = 20000
+# Celle per blocco di calcolo: limita la memoria degli intermedi specie × celle × ore
+SCORE_CHUNK_CELLS = 1000
+# Pixel per cella nelle PNG
+PNG_CELL_PIXELS = 8
+
+
+def grid_axes(bbox, resolution):
+    """Centri delle celle: latitudini (righe, da sud a nord) e longitudini (colonne, da ovest a est)"""
+    lat_min, lon_min, lat_max, lon_max = bbox
+    if lat_min >= lat_max or lon_min >= lon_max or resolution <= 0:
+        raise ValueError("Riquadro o risoluzione non validi")
+    lats = np.round(np.arange(lat_min + resolution / 2, lat_max, resolution), 4)
+    lons = np.round(np.arange(lon_min + resolution / 2, lon_max, resolution), 4)
+    return lats, lons
+
+
+def _fetch_chunk(lats, lons, timeout):
+    """Una richiesta Open-Meteo per un blocco di celle; restituisce una risposta per cella"""
+    params = {
+        'latitude': ','.join(f"{lat:.4f}" for lat in lats),
+        'longitude': ','.join(f"{lon:.4f}" for lon in lons),
+        'hourly': ','.join(GRID_VARIABLES),
+        'timezone': TIMEZONE,
+        'forecast_days': FORECAST_DAYS,
+        'past_days': PAST_DAYS
+    }
+    response = http_session.get(OPEN_METEO_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    payloads = response.json()
+    # Con una sola coordinata Open-Meteo restituisce un oggetto invece di una lista
+    return [payloads] if isinstance(payloads, dict) else payloads
+
+
+def fetch_grid(lats, lons, chunk_size=CHUNK_SIZE, concurrency=MAX_CONCURRENCY, timeout=GRID_TIMEOUT):
+    """Dati orari di tutte le celle, a blocchi di chunk_size con al massimo `concurrency` richieste insieme.
+
+    Restituisce 'time' (ore,), una matrice (celle, ore) float32 per variabile e 'failed'
+    (celle senza risposta, lasciate a NaN).
+    """
+    cells = len(lats)
+    bounds = [(a, min(a + chunk_size, cells)) for a in range(0, cells, chunk_size)]
+    failed = np.zeros(cells, dtype=bool)
+    columns, axis = None, None
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='griglia') as pool:
+        futures = {pool.submit(_fetch_chunk, lats[a:b], lons[a:b], timeout): (a, b) for a, b in bounds}
+        for future in as_completed(futures):
+            a, b = futures[future]
+            try:
+                payloads = future.result()
+            except Exception:
+                failed[a:b] = True
+                continue
+            for i, payload in enumerate(payloads[:b - a], a):
+                hourly = payload['hourly']
+                if columns is None:
+                    # Stesso fuso e stessi giorni per tutte le celle: un solo asse orario
+                    axis = hourly_times(hourly['time'])
+                    columns = {var: np.full((cells, len(axis)), np.nan, dtype=np.float32) for var in GRID_VARIABLES}
+                if len(hourly['time']) != len(axis):
+                    failed[i] = True
+                    continue
+                for var in GRID_VARIABLES:
+                    columns[var][i] = np.array(hourly[var], dtype=np.float64)
+            failed[a + len(payloads):b] = True
+
+    if columns is None:
+        raise RuntimeError("Nessuna risposta da Open-Meteo per la griglia")
+    columns['time'] = axis
+    columns['failed'] = failed
+    return columns
+
+
+def nearest_zone_index(lats, lons, zones):
+    """Indice della zona più vicina (distanza equirettangolare) per ogni cella"""
+    zone_lat = np.array([coords['lat'] for coords in zones.values()])
+    zone_lon = np.array([coords['lon'] for coords in zones.values()])
+    scale = np.cos(np.radians(np.mean(lats)))
+    distance = (lats[:, None] - zone_lat) ** 2 + ((lons[:, None] - zone_lon) * scale) ** 2
+    return np.argmin(distance, axis=1)
+
+
+def cell_water_params(lats, lons, zones):
+    """Parametri termici per cella, presi dalla zona configurata più vicina (stessa acqua, stessa inerzia)"""
+    names = list(zones)
+    nearest = nearest_zone_index(lats, lons, zones)
+    water = [get_water(name) for name in names]
+    limits = np.array([w['limits'] for w in water], dtype=np.float64)[nearest]
+    return {
+        'monthly': np.array([w['monthly'] for w in water], dtype=np.float64)[nearest],
+        'heat_factor': np.array([w['heat_factor'] for w in water], dtype=np.float64)[nearest],
+        'min_temp': limits[:, 0],
+        'max_temp': limits[:, 1]
+    }
+
+
+def grid_water_temperature(columns, params, now):
+    """Temperatura dell'acqua attuale di ogni cella, come calculate_water_temperature ma su tutte le celle.
+
+    Il modello parte dalla media stagionale e rigioca i giorni passati del blocco orario
+    (vettoriale sulle celle), poi applica il passo provvisorio di oggi con le condizioni
+    dell'ora corrente. Celle senza dati -> NaN.
+    """
+    times = columns['time']
+    daily = daily_weather({var: columns[var] for var in ('temperature_2m', 'weather_code', 'wind_speed_10m')}
+                          | {'time': times})
+    past = daily['day'] < np.datetime64(now.date(), 'D')
+    months = daily['day'][past].astype('datetime64[M]').astype(np.int64) % 12 + 1
+    cells = len(params['heat_factor'])
+
+    temp = params['monthly'][:, now.month - 1]
+    heat = np.zeros(cells)
+    if past.any():
+        base = params['monthly'][:, months - 1].T
+        replay = {field: daily[field][:, past].T for field in ('gain_factor', 'rain', 'windy')}
+        # Giorni senza dati: l'aria alla media stagionale tiene il modello vicino alla base
+        replay['air_temp'] = np.where(daily['hours'][:, past].T > 0, daily['air_temp'][:, past].T, base)
+        temps, heats = simulate_water_temperature(
+            base[0], heat, replay, base, params['heat_factor'], params['min_temp'], params['max_temp']
+        )
+        temp, heat = temps[-1], heats[-1]
+
+    # Passo provvisorio di oggi con le regole orarie del modello
+    hour = int(np.clip(np.searchsorted(times, np.datetime64(now, 'm'), side='right') - 1, 0, len(times) - 1))
+    codes = columns['weather_code'][:, hour]
+    gain_factor = (1.3 if DAYTIME_HOURS[0] <= now.hour <= DAYTIME_HOURS[1] else 1.0) * np.where(
+        np.isin(codes, CLEAR_CODES), 1.5, 1.0)
+    rain = np.isin(codes, RAIN_CODES).astype(np.float64)
+    windy = (columns['wind_speed_10m'][:, hour] * 3.6 > 25).astype(np.float64)
+    water, _ = water_temperature_step(
+        temp, heat, columns['temperature_2m'][:, hour].astype(np.float64), gain_factor, rain, windy,
+        params['monthly'][:, now.month - 1], params['heat_factor'], params['min_temp'], params['max_temp']
+    )
+    return np.round(water, 1)
+
+
+def score_grid(columns, water_temp, engine, now):
+    """Punteggi (specie, celle, ore) dall'ora corrente alla fine della previsione.
+
+    Come nell'app, la temperatura dell'acqua resta quella stimata ora; le celle non
+    hanno zone preferite, quindi niente bonus di zona. Il calcolo procede a blocchi di
+    SCORE_CHUNK_CELLS celle per tenere bassa la memoria.
+    """
+    keep = columns['time'] >= np.datetime64(now.replace(minute=0, second=0, microsecond=0), 'm')
+    times = columns['time'][keep]
+    pressure = np.round(columns['pressure_msl'][:, keep].astype(np.float64))
+    weather = weather_code_index(columns['weather_code'][:, keep])
+    moon, season = moon_phase_indices(times)[None], season_indices(times)[None]
+
+    cells = len(water_temp)
+    scores = np.empty((len(engine.species_names), cells, len(times)), dtype=np.int16)
+    for a in range(0, cells, SCORE_CHUNK_CELLS):
+        b = min(a + SCORE_CHUNK_CELLS, cells)
+        scores[:, a:b] = engine.score(water_temp[a:b, None], pressure[a:b], moon, season, weather[a:b],
+                                      zone_bonus=False)
+    valid = ~np.isnan(pressure) & ~np.isnan(water_temp)[:, None]
+    return times, scores, valid
+
+
+def run_grid(bbox=DEFAULT_BBOX, resolution=DEFAULT_RESOLUTION, chunk_size=CHUNK_SIZE, concurrency=MAX_CONCURRENCY,
+             max_cells=MAX_CELLS, now=None):
+    """Scarica e calcola la griglia; restituisce il raster (vedi intestazione del file) e i tempi"""
+    now = now or datetime.now()
+    lats, lons = grid_axes(bbox, resolution)
+    if len(lats) * len(lons) > max_cells:
+        raise ValueError(f"{len(lats) * len(lons)} celle oltre il limite di {max_cells}: aumenta la risoluzione")
+    # Celle in ordine per righe: la cella (r, c) è l'indice r * colonne + c
+    cell_lat = np.repeat(lats, len(lons))
+    cell_lon = np.tile(lons, len(lats))
+
+    start = time.perf_counter()
+    columns = fetch_grid(cell_lat, cell_lon, chunk_size, concurrency)
+    fetched = time.perf_counter()
+
+    engine = get_engine()
+    params = cell_water_params(cell_lat, cell_lon, get_zones())
+    water_temp = grid_water_temperature(columns, params, now)
+    times, scores, valid = score_grid(columns, water_temp, engine, now)
+    shape = (len(lats), len(lons))
+    raster = {
+        'scores': scores.reshape((len(engine.species_names),) + shape + (len(times),)).transpose(0, 3, 1, 2),
+        'valid': valid.reshape(shape + (len(times),)).transpose(2, 0, 1),
+        'water_temp': water_temp.reshape(shape).astype(np.float32),
+        'lat': lats,
+        'lon': lons,
+        'time': times,
+        'species': np.array(engine.species_names)
+    }
+    timing = {'cells': len(cell_lat), 'failed': int(columns['failed'].sum()),
+              'fetch_seconds': fetched - start, 'compute_seconds': time.perf_counter() - fetched}
+    return raster, timing
+
+
+def heatmap_png(scores, valid, path, cell_pixels=PNG_CELL_PIXELS):
+    """Mappa di calore (righe, colonne) in PNG: rosso 0, giallo 50, verde 100, trasparente senza dati"""
+    from PIL import Image
+
+    levels = np.clip(scores, 0, 100).astype(np.float64) / 100
+    rgba = np.zeros(scores.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = np.where(levels < 0.5, 220, np.round(220 * (1 - levels) * 2)).astype(np.uint8)
+    rgba[..., 1] = np.where(levels < 0.5, np.round(200 * levels * 2), 200).astype(np.uint8)
+    rgba[..., 2] = 40
+    rgba[..., 3] = np.where(valid, 255, 0)
+    # Righe da sud a nord nel raster, da nord a sud nell'immagine
+    image = Image.fromarray(rgba[::-1], 'RGBA')
+    image = image.resize((image.width * cell_pixels, image.height * cell_pixels), Image.NEAREST)
+    image.save(path, optimize=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Punteggi di attività su una griglia di celle (mappe di calore)")
+    parser.add_argument('--bbox', type=float, nargs=4, default=DEFAULT_BBOX,
+                        metavar=('LAT_MIN', 'LON_MIN', 'LAT_MAX', 'LON_MAX'),
+                        help="riquadro in gradi (default: area Ticino/Verbano)")
+    parser.add_argument('--resolution', type=float, default=DEFAULT_RESOLUTION,
+                        help=f"lato della cella in gradi (default: {DEFAULT_RESOLUTION})")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help=f"celle per richiesta a Open-Meteo (default: {CHUNK_SIZE})")
+    parser.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY,
+                        help=f"richieste contemporanee (default: {MAX_CONCURRENCY})")
+    parser.add_argument('--max-cells', type=int, default=MAX_CELLS, help=f"limite di celle (default: {MAX_CELLS})")
+    parser.add_argument('--output', '-o', default=DEFAULT_OUTPUT, help=f"file .npz (default: {DEFAULT_OUTPUT})")
+    parser.add_argument('--png', metavar='DIR', help="cartella per una PNG per specie all'ora --hour")
+    parser.add_argument('--hour', type=int, default=0, help="ore da adesso per le PNG e il riepilogo (default: 0)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        raster, timing = run_grid(tuple(args.bbox), args.resolution, args.chunk_size, args.concurrency, args.max_cells)
+    except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    np.savez_compressed(args.output, **raster)
+    print(f"{timing['cells']} celle ({len(raster['lat'])}×{len(raster['lon'])}), {len(raster['time'])} ore, "
+          f"{timing['failed']} senza dati - download {timing['fetch_seconds']:.2f} s, "
+          f"calcolo {timing['compute_seconds']:.2f} s -> {args.output}", file=sys.stderr)
+
+    hour = min(max(args.hour, 0), len(raster['time']) - 1)
+    valid = raster['valid'][hour]
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
+    print(f"Celle migliori alle {raster['time'][hour].astype(datetime):%d/%m %H:%M}:")
+    for s, name in enumerate(raster['species']):
+        scores = raster['scores'][s, hour]
+        if valid.any():
+            r, c = np.unravel_index(np.argmax(np.where(valid, scores, -1)), scores.shape)
+            print(f"  {name:15} {scores[r, c]:>3}/100 a {raster['lat'][r]:.4f}, {raster['lon'][c]:.4f}")
+        if args.png:
+            heatmap_png(scores, valid, os.path.join(args.png, f"{name.lower().replace(' ', '_')}.png"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
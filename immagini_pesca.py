@@ -0,0 +1,128 @@
+# Immagini delle specie: varianti ridimensionate (WebP e JPEG) costruite una volta e tenute in memoria
+
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Larghezze delle varianti in pixel (mai ingrandite oltre l'originale)
+VARIANT_WIDTHS = (160, 320, 480)
+# Larghezza della colonna immagine nel dettaglio specie (colonne [1, 2] nel layout wide,
+# a tutta larghezza su mobile)
+DETAIL_IMAGE_WIDTH = 480
+# Qualità di compressione: a queste dimensioni la differenza con 90+ non si vede
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+MIME_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def image_slug(species_name):
+    """Nome del file dell'immagine di una specie: 'Trota Fario' -> 'trota_fario'"""
+    return species_name.lower().replace(' ', '_')
+
+
+def _encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'webp':
+        image.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+    else:
+        image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def build_variants(path, widths=VARIANT_WIDTHS):
+    """Varianti di un'immagine come lista di dict (formato, larghezza, altezza, byte, mime, etag)"""
+    with open(path, 'rb') as f:
+        source = f.read()
+    with Image.open(io.BytesIO(source)) as original:
+        source_format = original.format
+        original = original.convert('RGB')
+    variants = []
+    # Larghezze uniche: le varianti più larghe dell'originale collassano sulla sua larghezza
+    for width in sorted({min(w, original.width) for w in widths}):
+        height = max(1, round(original.height * width / original.width))
+        resized = original if width == original.width else original.resize((width, height), Image.LANCZOS)
+        for image_format in MIME_TYPES:
+            data = _encode(resized, image_format)
+            # A larghezza piena un JPEG già compresso bene può battere la ricodifica: si tiene il più piccolo
+            if image_format == 'jpeg' and source_format == 'JPEG' and resized is original and len(source) < len(data):
+                data = source
+            variants.append({
+                'format': image_format,
+                'width': width,
+                'height': height,
+                'data': data,
+                'mime': MIME_TYPES[image_format],
+                'etag': hashlib.sha1(data).hexdigest()
+            })
+    return variants
+
+
+class ImageCatalog:
+    """Varianti delle immagini di images/, indicizzate per nome del file senza estensione.
+
+    Costruito una volta (all'import): durante il render non si accede al disco.
+    Le varianti sono byte immutabili con un etag (sha1 del contenuto) da usare
+    come impronta per la cache del browser.
+    """
+
+    def __init__(self, root=IMAGES_DIR, widths=VARIANT_WIDTHS):
+        self.root = root
+        self.widths = widths
+        self._lock = threading.Lock()
+        self._variants = {}
+        self.original_bytes = 0
+        self.reload()
+
+    def reload(self):
+        """Ricostruisce le varianti da disco (es. dopo aver aggiunto immagini di nuove specie)"""
+        variants, original_bytes = {}, 0
+        try:
+            names = sorted(os.listdir(self.root))
+        except OSError:
+            names = []
+        for name in names:
+            slug, extension = os.path.splitext(name)
+            if extension.lower() not in IMAGE_EXTENSIONS or slug in variants:
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                variants[slug] = build_variants(path, self.widths)
+                original_bytes += os.path.getsize(path)
+            except OSError:
+                continue
+        with self._lock:
+            self._variants = variants
+            self.original_bytes = original_bytes
+
+    def variant(self, species_name, width, image_format='webp'):
+        """Variante più piccola larga almeno `width` pixel (o la più larga disponibile); None se manca l'immagine"""
+        candidates = [v for v in self._variants.get(image_slug(species_name), ()) if v['format'] == image_format]
+        if not candidates:
+            return None
+        for candidate in candidates:
+            if candidate['width'] >= width:
+                return candidate
+        return candidates[-1]
+
+    def variants(self):
+        """Tutte le varianti di tutte le immagini"""
+        return [v for variants in self._variants.values() for v in variants]
+
+    def stats(self):
+        """Numero di immagini e byte degli originali e delle varianti per formato"""
+        with self._lock:
+            variants = self._variants
+            stats = {'images': len(variants), 'original_bytes': self.original_bytes}
+        for image_format in MIME_TYPES:
+            stats[f'{image_format}_bytes'] = sum(
+                len(v['data']) for vs in variants.values() for v in vs if v['format'] == image_format
+            )
+        return stats
+
+
+image_catalog = ImageCatalog()
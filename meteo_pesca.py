@@ -0,0 +1,467 @@
+# Recupero dati meteo da Open-Meteo con cache condivisa tra le sessioni
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache_pesca import TTLCache
+from archivio_pesca import snapshot_store
+
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast"
+CURRENT_VARIABLES = ('temperature_2m', 'relative_humidity_2m', 'pressure_msl', 'wind_speed_10m', 'cloud_cover', 'weather_code')
+HOURLY_VARIABLES = ('temperature_2m', 'precipitation_probability', 'weather_code', 'wind_speed_10m', 'pressure_msl')
+# Sette giorni: servono per le finestre di pesca orarie sull'intero orizzonte
+FORECAST_DAYS = 7
+# Giorni passati nella stessa richiesta: il modello termico recupera i giorni persi
+PAST_DAYS = 7
+TIMEZONE = 'Europe/Rome'
+REQUEST_TIMEOUT = 10
+
+# Open-Meteo aggiorna i modelli ogni ora: le voci scadono allo scoccare dell'ora
+FORECAST_TTL = 3600
+FORECAST_CACHE_SIZE = 64
+# Due decimali (~1 km) bastano: la griglia dei modelli è molto più larga
+COORD_PRECISION = 2
+
+# Download paralleli del prefetch (uno per zona, ognuno con il proprio timeout)
+PREFETCH_WORKERS = 4
+# Modalità batch del prefetch: tutte le zone mancanti in una sola richiesta con liste di
+# coordinate (una chiamata invece di una per zona a ogni ciclo). Se il batch fallisce o va
+# in timeout ogni zona riparte da sola con il proprio timeout: nessuna resta senza dati
+BATCH_FETCH = True
+
+forecast_cache = TTLCache(ttl=FORECAST_TTL, max_entries=FORECAST_CACHE_SIZE)
+
+# Ultima previsione valida per zona, servita subito quando la cache è scaduta:
+# copre sette giorni, quindi anche vecchia di un giorno è meglio di dati simulati
+LAST_GOOD_MAX_AGE = 2 * 24 * 3600
+last_good_cache = TTLCache(ttl=LAST_GOOD_MAX_AGE, max_entries=FORECAST_CACHE_SIZE, align=False)
+
+
+def _build_session():
+    """Sessione HTTP con connessioni keep-alive riutilizzate tra le richieste"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PREFETCH_WORKERS)
+    session.mount('https://', adapter)
+    return session
+
+
+http_session = _build_session()
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='meteo-prefetch')
+
+# Download in corso per chiave: chi arriva dopo aspetta lo stesso risultato
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Zone già cercate nell'archivio su disco in questo processo (evento: lettura terminata).
+# Oltre il limite si dimenticano le letture concluse più vecchie: al più si rilegge il disco
+WARMED_MAX_ENTRIES = 4 * FORECAST_CACHE_SIZE
+_warmed = {}
+_warm_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_upstream_calls = 0
+_forced_refreshes = 0
+
+
+def forecast_key(lat, lon, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES):
+    """Chiave di cache: coordinate arrotondate più l'insieme di variabili richieste"""
+    return (
+        round(lat, COORD_PRECISION),
+        round(lon, COORD_PRECISION),
+        ','.join(sorted(current)),
+        ','.join(sorted(hourly))
+    )
+
+
+def build_forecast_params(lat, lon, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES):
+    """Parametri della richiesta Open-Meteo"""
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'current': ','.join(current),
+        'hourly': ','.join(hourly),
+        'timezone': TIMEZONE,
+        'forecast_days': FORECAST_DAYS,
+        'past_days': PAST_DAYS
+    }
+
+
+def _claim_download(key):
+    """Registra un download per la chiave; restituisce (future, True se tocca a noi scaricare)"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future, False
+        future = Future()
+        _inflight[key] = future
+        return future, True
+
+
+def _store(key, data):
+    """Salva una risposta valida nella cache oraria, come ultima previsione della zona e su disco"""
+    fetched_at = time.time()
+    forecast_cache.put(key, data, stored_at=fetched_at)
+    last_good_cache.put(key, data, stored_at=fetched_at)
+    snapshot_store.save(key, data, fetched_at)
+
+
+def _prune_warmed(limit):
+    """Scarta le letture concluse più vecchie finché c'è posto per una nuova (da chiamare con _warm_lock)"""
+    for key in [key for key, done in _warmed.items() if done.is_set()]:
+        if len(_warmed) < limit:
+            break
+        del _warmed[key]
+
+
+def _warm_from_disk(key):
+    """Alla prima richiesta della zona dopo un riavvio carica l'ultima snapshot su disco.
+
+    Se è dell'ora corrente torna valida anche nella cache oraria e non serve nessuna
+    chiamata; se è più vecchia diventa l'ultima previsione valida da servire subito.
+    Il file si legge fuori dal lock (le altre zone non aspettano); chi chiede la
+    stessa zona nel frattempo attende la fine della lettura.
+    """
+    with _warm_lock:
+        done = _warmed.get(key)
+        owner = done is None
+        if owner:
+            _prune_warmed(WARMED_MAX_ENTRIES)
+            done = _warmed[key] = threading.Event()
+    if not owner:
+        done.wait()
+        return
+
+    try:
+        if last_good_cache.contains(key):
+            return
+        data, fetched_at = snapshot_store.latest(key)
+        if data is None or time.time() - fetched_at > LAST_GOOD_MAX_AGE:
+            return
+        # Un download finito durante la lettura è più recente: non si sovrascrive
+        with _warm_lock:
+            if not last_good_cache.contains(key):
+                last_good_cache.put(key, data, stored_at=fetched_at)
+            if not forecast_cache.contains(key):
+                forecast_cache.put(key, data, stored_at=fetched_at)
+    finally:
+        done.set()
+
+
+def _download(key, lat, lon, current, hourly, timeout, future):
+    """Scarica le previsioni, aggiorna la cache e completa il future"""
+    global _upstream_calls
+
+    try:
+        with _stats_lock:
+            _upstream_calls += 1
+        response = http_session.get(OPEN_METEO_URL, params=build_forecast_params(lat, lon, current, hourly), timeout=timeout)
+        data = response.json() if response.status_code == 200 else None
+        if data is not None:
+            _store(key, data)
+        future.set_result(data)
+    except Exception as e:
+        future.set_exception(e)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def fetch_forecast(lat, lon, force_refresh=False, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES, timeout=REQUEST_TIMEOUT):
+    """Restituisce la risposta grezza di Open-Meteo, dalla cache se ancora valida.
+
+    Con force_refresh=True la cache viene ignorata e aggiornata con i dati nuovi.
+    Se la stessa zona è già in download (es. dal prefetch) si attende quel risultato.
+    Restituisce None se l'API risponde con un errore.
+    """
+    global _forced_refreshes
+
+    key = forecast_key(lat, lon, current, hourly)
+    if not force_refresh:
+        _warm_from_disk(key)
+        data = forecast_cache.get(key)
+        if data is not None:
+            return data
+
+    future, owner = _claim_download(key)
+    if owner:
+        if force_refresh:
+            with _stats_lock:
+                _forced_refreshes += 1
+        _download(key, lat, lon, current, hourly, timeout, future)
+    return future.result(timeout=timeout)
+
+
+def refresh_in_background(lat, lon, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES, timeout=REQUEST_TIMEOUT):
+    """Avvia il download della zona in un worker (se non è già in corso) e restituisce il future"""
+    key = forecast_key(lat, lon, current, hourly)
+    future, owner = _claim_download(key)
+    if owner:
+        _executor.submit(_download, key, lat, lon, current, hourly, timeout, future)
+    return future
+
+
+def last_good_forecast(lat, lon, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES):
+    """Ultima previsione valida della zona come (payload, istante del download), o (None, None)"""
+    key = forecast_key(lat, lon, current, hourly)
+    _warm_from_disk(key)
+    return last_good_cache.get_with_time(key)
+
+
+def fetch_forecast_stale(lat, lon, force_refresh=False, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES, timeout=REQUEST_TIMEOUT):
+    """Previsione da mostrare subito: restituisce (payload, istante del download, scaduta).
+
+    Con la cache scaduta si restituisce l'ultima previsione valida e l'aggiornamento
+    parte in un worker, fuori dal percorso della richiesta. Si aspetta la rete solo se
+    la zona non ha mai avuto una previsione o con force_refresh; se il download
+    fallisce si ripiega sull'ultima previsione valida. (None, None, False) solo se
+    non esiste nessuna previsione reale.
+    """
+    key = forecast_key(lat, lon, current, hourly)
+    _warm_from_disk(key)
+    if not force_refresh:
+        data, fetched_at = forecast_cache.get_with_time(key)
+        if data is not None:
+            return data, fetched_at, False
+        data, fetched_at = last_good_cache.get_with_time(key)
+        if data is not None:
+            refresh_in_background(lat, lon, current, hourly, timeout)
+            return data, fetched_at, True
+
+    try:
+        data = fetch_forecast(lat, lon, force_refresh=force_refresh, current=current, hourly=hourly, timeout=timeout)
+    except Exception:
+        data = None
+    if data is not None:
+        return data, time.time(), False
+
+    data, fetched_at = last_good_cache.get_with_time(key)
+    return data, fetched_at, data is not None
+
+
+def _download_batch(keys, coords, current, hourly, timeout, futures):
+    """Scarica più zone in una sola richiesta e divide la risposta per zona.
+
+    Se la richiesta fallisce (errore, timeout o risposta che non ha una voce per
+    zona) ogni zona riparte da sola con il proprio timeout, come senza batch;
+    nessun future resta in sospeso.
+    """
+    global _upstream_calls
+
+    retried = set()
+    error = None
+    try:
+        with _stats_lock:
+            _upstream_calls += 1
+        params = build_forecast_params(
+            ','.join(str(c['lat']) for c in coords),
+            ','.join(str(c['lon']) for c in coords),
+            current, hourly
+        )
+        response = http_session.get(OPEN_METEO_URL, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise ValueError(f"Risposta batch con stato {response.status_code}")
+        payloads = response.json()
+        # Con una sola coordinata Open-Meteo restituisce un oggetto invece di una lista
+        if isinstance(payloads, dict):
+            payloads = [payloads]
+        if not isinstance(payloads, list) or len(payloads) != len(keys):
+            raise ValueError(f"Risposta batch con {len(payloads)} voci per {len(keys)} zone")
+
+        for key, data, future in zip(keys, payloads, futures):
+            _store(key, data)
+            future.set_result(data)
+    except Exception as e:
+        error = e
+        for i, (key, point, future) in enumerate(zip(keys, coords, futures)):
+            if future.done():
+                continue
+            try:
+                _executor.submit(_download, key, point['lat'], point['lon'], current, hourly, timeout, future)
+                retried.add(i)
+            except Exception:
+                pass
+    finally:
+        for i, future in enumerate(futures):
+            if i not in retried and not future.done():
+                future.set_exception(error or RuntimeError("Download batch interrotto"))
+        with _inflight_lock:
+            for i, key in enumerate(keys):
+                if i not in retried:
+                    _inflight.pop(key, None)
+
+
+def prefetch_zones(zones, force_refresh=False, batch=BATCH_FETCH, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES, timeout=REQUEST_TIMEOUT):
+    """Scarica in background le previsioni di tutte le zone.
+
+    In modalità batch le zone mancanti partono in un'unica richiesta, altrimenti
+    in parallelo con una richiesta (e un timeout) per zona. Popola la cache condivisa
+    senza bloccare il chiamante: restituisce un dizionario zona -> future solo per
+    le zone effettivamente in download.
+    """
+    futures = {}
+    batch_keys, batch_coords, batch_futures = [], [], []
+    for location_name, coords in zones.items():
+        key = forecast_key(coords['lat'], coords['lon'], current, hourly)
+        _warm_from_disk(key)
+        if not force_refresh and forecast_cache.contains(key):
+            continue
+        future, owner = _claim_download(key)
+        if owner:
+            if batch:
+                batch_keys.append(key)
+                batch_coords.append(coords)
+                batch_futures.append(future)
+            else:
+                _executor.submit(_download, key, coords['lat'], coords['lon'], current, hourly, timeout, future)
+        futures[location_name] = future
+
+    if batch_keys:
+        _executor.submit(_download_batch, batch_keys, batch_coords, current, hourly, timeout, batch_futures)
+    return futures
+
+
+def cached_forecast(lat, lon, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES):
+    """Previsione già in memoria, senza rete: (payload, istante del download, scaduta) o (None, None, False)"""
+    key = forecast_key(lat, lon, current, hourly)
+    data, fetched_at = forecast_cache.get_with_time(key)
+    if data is not None:
+        return data, fetched_at, False
+    data, fetched_at = last_good_cache.get_with_time(key)
+    return data, fetched_at, data is not None
+
+
+def fetch_forecasts_stale(zones, force_refresh=False, wait_missing=True, current=CURRENT_VARIABLES, hourly=HOURLY_VARIABLES, timeout=REQUEST_TIMEOUT):
+    """Previsioni di più zone da mostrare subito: zona -> (payload, istante del download, scaduta).
+
+    Come fetch_forecast_stale per ogni zona, ma le zone scadute o mancanti partono
+    insieme in un prefetch (batch) in background. Si aspetta la rete, al più il batch
+    più il download della singola zona, solo per le zone senza nessuna previsione
+    reale o con force_refresh; con wait_missing=False non si aspetta mai e le zone
+    senza dati restano (None, None, False) finché il download non finisce.
+    """
+    futures = prefetch_zones(zones, force_refresh=force_refresh, current=current, hourly=hourly, timeout=timeout)
+    if wait_missing:
+        pending = [
+            future for location_name, future in futures.items()
+            if force_refresh or not last_good_cache.contains(
+                forecast_key(zones[location_name]['lat'], zones[location_name]['lon'], current, hourly))
+        ]
+        if pending:
+            wait(pending, timeout=2 * timeout)
+    return {
+        location_name: cached_forecast(coords['lat'], coords['lon'], current, hourly)
+        for location_name, coords in zones.items()
+    }
+
+
+def get_weather_description(weather_code):
+    """Converte weather code di Open-Meteo in descrizione"""
+    weather_codes = {
+        0: "Sereno",
+        1: "Prevalentemente sereno", 
+        2: "Parzialmente nuvoloso",
+        3: "Nuvoloso",
+        45: "Nebbia",
+        48: "Nebbia con brina",
+        51: "Pioviggine leggera",
+        53: "Pioviggine moderata",
+        55: "Pioviggine intensa",
+        61: "Pioggia leggera",
+        63: "Pioggia moderata",
+        65: "Pioggia intensa",
+        80: "Rovesci leggeri",
+        81: "Rovesci moderati",
+        82: "Rovesci intensi",
+        95: "Temporale",
+        96: "Temporale con grandine leggera",
+        99: "Temporale con grandine intensa"
+    }
+    return weather_codes.get(weather_code, "Condizioni variabili")
+
+def get_weather_main(weather_code):
+    """Converte weather code in categoria principale"""
+    if weather_code in [0, 1]:
+        return "Clear"
+    elif weather_code in [2, 3]:
+        return "Clouds"
+    elif weather_code in [51, 53, 55, 61, 63, 65, 80, 81, 82]:
+        return "Rain"
+    elif weather_code in [95, 96, 99]:
+        return "Thunderstorm"
+    else:
+        return "Clouds"
+
+
+# Weather code -> descrizione, come tabella per la conversione vettoriale
+WEATHER_DESCRIPTIONS = np.array([get_weather_description(code) for code in range(100)], dtype=object)
+
+
+def describe_weather_codes(weather_codes):
+    """Descrizioni per un array di weather code (codici mancanti o sconosciuti -> condizioni variabili)"""
+    codes = np.asarray(weather_codes, dtype=np.int64)
+    valid = (codes >= 0) & (codes < len(WEATHER_DESCRIPTIONS))
+    descriptions = np.full(codes.shape, get_weather_description(None), dtype=object)
+    descriptions[valid] = WEATHER_DESCRIPTIONS[codes[valid]]
+    return descriptions
+
+
+def hourly_times(times):
+    """Orari come datetime64; se il passo è regolare di un'ora basta leggere il primo e l'ultimo"""
+    if not times:
+        return np.array([], dtype='datetime64[m]')
+    first = np.datetime64(times[0], 'm')
+    regular = first + np.arange(len(times)).astype('timedelta64[h]')
+    if regular[-1] == np.datetime64(times[-1], 'm'):
+        return regular
+    return np.array(times, dtype='datetime64[m]')
+
+
+def parse_hourly_columns(data):
+    """Blocco orario di Open-Meteo come colonne tipizzate (datetime64, float32, int16).
+
+    I valori mancanti diventano NaN nelle colonne float, 0 nella probabilità di
+    pioggia e -1 nel weather code.
+    """
+    hourly = data['hourly']
+
+    def floats(name):
+        return np.array(hourly[name], dtype=np.float64).astype(np.float32)
+
+    def ints(name, missing):
+        values = np.array(hourly[name], dtype=np.float64)
+        return np.where(np.isnan(values), missing, values).astype(np.int16)
+
+    return {
+        'time': hourly_times(hourly['time']),
+        'temperature_2m': floats('temperature_2m'),
+        'pressure_msl': floats('pressure_msl'),
+        'wind_speed_10m': floats('wind_speed_10m'),
+        'precipitation_probability': ints('precipitation_probability', 0),
+        'weather_code': ints('weather_code', -1)
+    }
+
+
+def hourly_columns(data, lat, lon):
+    """Colonne orarie del payload, calcolate una volta e salvate in cache accanto alla previsione"""
+    key = forecast_key(lat, lon)
+    columns = forecast_cache.get_derived(key, 'hourly_columns', data)
+    if columns is None:
+        columns = parse_hourly_columns(data)
+        forecast_cache.put_derived(key, 'hourly_columns', columns, data)
+    return columns
+
+
+def get_forecast_cache_stats():
+    """Contatori della cache meteo e numero di chiamate verso Open-Meteo"""
+    stats = forecast_cache.stats()
+    stats['upstream_calls'] = _upstream_calls
+    stats['forced_refreshes'] = _forced_refreshes
+    stats['last_good_entries'] = last_good_cache.stats()['entries']
+    stats['snapshot_reads'] = snapshot_store.reads
+    stats['snapshot_writes'] = snapshot_store.writes
+    return stats
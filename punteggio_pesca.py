@@ -0,0 +1,355 @@
+# Motore vettoriale per il punteggio di attività dei pesci
+
+from datetime import date, datetime
+
+import numpy as np
+
+import registro_pesca
+from cache_pesca import TTLCache
+from database_pesca import ZONE_COORDINATES, FISH_SPECIES, database
+from effemeridi_pesca import MOON_PHASES, SEASONS, moon_phase_indices, season_indices
+from meteo_pesca import FORECAST_TTL, forecast_cache, forecast_key, get_weather_main
+from registro_pesca import SpeciesRegistry
+
+# MOON_PHASES e SEASONS: l'indice è la posizione del bit nelle maschere
+WEATHER_MAINS = ('Clear', 'Clouds', 'Rain', 'Drizzle', 'Thunderstorm')
+
+# Pesi del punteggio, gli stessi di calculate_fish_activity (ricalibrabili con calibrazione_pesca.py)
+SCORE_WEIGHTS = {
+    'base': 50,
+    'temp_in_range': 25,
+    'temp_near': 10,           # entro temp_near_margin gradi dal centro dell'intervallo
+    'temp_near_margin': 3,
+    'temp_out': -20,
+    'pressure_in_range': 15,
+    'pressure_out': -10,
+    'moon': 15,
+    'season': 10,
+    'zone': 10,
+    'weather_dry': 5,          # Clear, Clouds
+    'weather_wet': 8           # Rain, Drizzle
+}
+
+
+def weather_bonus(weights):
+    """Bonus meteo per categoria, nello stesso ordine di WEATHER_MAINS"""
+    return np.array([weights['weather_dry'], weights['weather_dry'], weights['weather_wet'], weights['weather_wet'], 0],
+                    dtype=np.int16)
+
+
+# Weather code di Open-Meteo (0-99) -> indice in WEATHER_MAINS
+WEATHER_CODE_INDEX = np.array([WEATHER_MAINS.index(get_weather_main(code)) for code in range(100)], dtype=np.int16)
+
+# Durata della finestra di pesca consigliata
+BEST_WINDOW_HOURS = 3
+
+# Classifiche per zona condivise da tutte le sessioni: poche combinazioni di input per ora
+RANKING_CACHE_SIZE = 256
+ranking_cache = TTLCache(ttl=FORECAST_TTL, max_entries=RANKING_CACHE_SIZE)
+
+
+def calculate_fish_activity(fish_species, weather, moon_phase, current_season, current_zone):
+    """Punteggio di attività di una singola specie (versione scalare di riferimento)"""
+    score = 50  # Punteggio base
+
+    # Temperatura acqua
+    water_temp = weather['water_temperature']
+    if fish_species['temp_min'] <= water_temp <= fish_species['temp_max']:
+        score += 25
+    elif abs(water_temp - (fish_species['temp_min'] + fish_species['temp_max'])/2) <= 3:
+        score += 10
+    else:
+        score -= 20
+
+    # Pressione atmosferica
+    pressure = weather['pressure']
+    if fish_species['pressure_low'] <= pressure <= fish_species['pressure_high']:
+        score += 15
+    else:
+        score -= 10
+
+    # Fase lunare
+    if any(phase in moon_phase for phase in fish_species['moon_best']):
+        score += 15
+
+    # Stagione
+    if current_season in fish_species['season_best']:
+        score += 10
+
+    # Zona preferita bonus
+    if current_zone in fish_species['zone_preferite']:
+        score += 10
+
+    # Condizioni meteo
+    if weather['weather_main'] in ['Clear', 'Clouds']:
+        score += 5
+    elif weather['weather_main'] in ['Rain', 'Drizzle']:
+        score += 8
+
+    return max(0, min(100, score))
+
+
+def _label_index(labels, values):
+    """Converte etichette in indici (-1 se sconosciute), mantenendo la forma dell'input"""
+    lookup = {label: i for i, label in enumerate(labels)}
+    if isinstance(values, str):
+        return np.int16(lookup.get(values, -1))
+    return np.array([lookup.get(v, -1) for v in np.ravel(values)], dtype=np.int16).reshape(np.shape(values))
+
+
+def moon_index(moon_phase):
+    """Indice in MOON_PHASES della fase (o array di fasi)"""
+    return _label_index(MOON_PHASES, moon_phase)
+
+
+def season_index(season):
+    """Indice in SEASONS della stagione (o array di stagioni)"""
+    return _label_index(SEASONS, season)
+
+
+def weather_index(weather_main):
+    """Indice in WEATHER_MAINS della categoria meteo (o array di categorie)"""
+    return _label_index(WEATHER_MAINS, weather_main)
+
+
+def weather_code_index(weather_codes):
+    """Indice in WEATHER_MAINS per un array di weather code (mancanti -> 'Clouds' come get_weather_main)"""
+    codes = np.asarray(weather_codes, dtype=np.float64)
+    valid = ~np.isnan(codes) & (codes >= 0) & (codes < len(WEATHER_CODE_INDEX))
+    index = np.full(codes.shape, WEATHER_MAINS.index('Clouds'), dtype=np.int16)
+    index[valid] = WEATHER_CODE_INDEX[codes[valid].astype(np.int64)]
+    return index
+
+
+class ScoringEngine:
+    """Motore di punteggio vettoriale specie × zone × ore sul registro compilato.
+
+    Senza registry compila species e zones (es. tabelle sintetiche o in calibrazione);
+    weights sostituisce in tutto o in parte SCORE_WEIGHTS.
+    """
+
+    def __init__(self, species=FISH_SPECIES, zones=ZONE_COORDINATES, weights=None, registry=None):
+        self.registry = registry or SpeciesRegistry(species, zones, strict=False)
+        self.weights = {**SCORE_WEIGHTS, **(weights or {})}
+        self.weather_bonus = weather_bonus(self.weights)
+        self.species_names = self.registry.species_names
+        self.zone_names = self.registry.zone_names
+        self.zone_ids = dict(self.registry.zone_ids)
+
+        # Colonne (specie, 1, 1) pronte per il broadcasting su (zone, ore)
+        self.temp_min = self.registry.temp_min[:, None, None]
+        self.temp_max = self.registry.temp_max[:, None, None]
+        self.temp_mid = (self.temp_min + self.temp_max) / 2
+        self.pressure_low = self.registry.pressure_low[:, None, None]
+        self.pressure_high = self.registry.pressure_high[:, None, None]
+        self.moon_mask = self.registry.moon_mask[:, None, None]
+        self.season_mask = self.registry.season_mask[:, None, None]
+
+        # Matrici specie × zone: preferenza (bonus) e habitat (specie presente nella zona)
+        self.zone_preferred = self.registry.zone_preferred
+        self.habitat = self.registry.habitat
+        # Giorni di apertura per specie e zona: le specie chiuse escono da classifiche e finestre
+        self.regulations = self.registry.regulations
+
+    def score(self, water_temp, pressure, moon, season, weather, zones=None, zone_bonus=True):
+        """Punteggi per tutte le specie, zone e ore in una sola chiamata.
+
+        water_temp, pressure, moon, season e weather sono array (o scalari) compatibili
+        con la forma (zone, ore); moon, season e weather sono indici da moon_index(),
+        season_index() e weather_index(). zones seleziona le colonne zona (default tutte).
+        Con zone_bonus=False la prima dimensione degli input sono punti qualsiasi (es. celle
+        di una griglia) e il bonus delle zone preferite non si applica.
+        Restituisce un array int16 di forma (specie, zone, ore).
+        """
+        water_temp = np.atleast_2d(np.asarray(water_temp, dtype=np.float64))
+        pressure = np.atleast_2d(np.asarray(pressure, dtype=np.float64))
+        moon = np.atleast_2d(np.asarray(moon, dtype=np.int32))
+        season = np.atleast_2d(np.asarray(season, dtype=np.int32))
+        weather = np.atleast_2d(np.asarray(weather, dtype=np.int32))
+        preferred = self.zone_preferred if zones is None else self.zone_preferred[:, zones]
+        w = self.weights
+
+        score = np.int16(w['base'])  # Punteggio base
+
+        # Temperatura acqua
+        in_range = (self.temp_min <= water_temp) & (water_temp <= self.temp_max)
+        near_mid = np.abs(water_temp - self.temp_mid) <= w['temp_near_margin']
+        score = score + np.where(in_range, w['temp_in_range'], np.where(near_mid, w['temp_near'], w['temp_out'])).astype(np.int16)
+
+        # Pressione atmosferica
+        in_band = (self.pressure_low <= pressure) & (pressure <= self.pressure_high)
+        score = score + np.where(in_band, w['pressure_in_range'], w['pressure_out']).astype(np.int16)
+
+        # Fase lunare e stagione (indici negativi = etichetta sconosciuta, nessun bonus)
+        moon_hit = (moon >= 0) & (((self.moon_mask >> np.maximum(moon, 0)) & 1) == 1)
+        score = score + np.where(moon_hit, w['moon'], 0).astype(np.int16)
+        season_hit = (season >= 0) & (((self.season_mask >> np.maximum(season, 0)) & 1) == 1)
+        score = score + np.where(season_hit, w['season'], 0).astype(np.int16)
+
+        # Zona preferita bonus
+        if zone_bonus:
+            score = score + np.where(preferred[:, :, None], w['zone'], 0).astype(np.int16)
+
+        # Condizioni meteo
+        score = score + np.where(weather >= 0, self.weather_bonus[np.maximum(weather, 0)], 0).astype(np.int16)
+
+        return np.clip(score, 0, 100).astype(np.int16)
+
+    def score_zone(self, weather, moon_phase, current_season, current_zone, day=None):
+        """Punteggi delle specie presenti nella zona e aperte il giorno day (default oggi) per le condizioni attuali"""
+        zone = self.zone_ids[current_zone]
+        scores = self.score(
+            weather['water_temperature'], weather['pressure'],
+            moon_index(moon_phase), season_index(current_season), weather_index(weather['weather_main']),
+            zones=[zone]
+        )[:, 0, 0]
+        # Habitat e specie aperte sono due maschere per ID: le specie ammesse sono la loro intersezione
+        legal = self.regulations.open_species(current_zone, day or date.today())[:len(self.species_names)]
+        present = self.habitat[:, zone] & legal
+        return {self.species_names[i]: int(scores[i]) for i in np.flatnonzero(present)}
+
+
+scoring_engine = ScoringEngine(registry=registro_pesca.species_registry)
+
+
+def affected_zones(old_registry, new_registry, changes):
+    """Zone i cui punteggi dipendono dalle voci cambiate (zone modificate e habitat delle specie modificate o con calendario modificato)"""
+    zones = set(changes['zones'])
+    for registry in (old_registry, new_registry):
+        for name in (changes['species'] | changes['calendar']) & set(registry.species_names):
+            row = registry.habitat[registry.species_ids[name]]
+            zones.update(zone for zone, present in zip(registry.zone_names, row) if present)
+    return zones
+
+
+def _rebuild_engine(old, new, changes):
+    """Sostituisce il motore dopo un ricaricamento e scarta i punteggi orari delle sole zone coinvolte"""
+    global scoring_engine
+    previous = scoring_engine
+    scoring_engine = ScoringEngine(weights=previous.weights, registry=registro_pesca.species_registry)
+    zones = affected_zones(previous.registry, scoring_engine.registry, changes)
+    if zones:
+        forecast_cache.invalidate_derived(
+            lambda name: isinstance(name, tuple) and name[0] == 'hourly_activity' and name[1] in zones
+        )
+        ranking_cache.invalidate_where(lambda key: key[0] in zones)
+
+
+# Registrato dopo il registro: quando viene chiamato, registro_pesca.species_registry è già quello nuovo
+database.subscribe(_rebuild_engine)
+
+
+def get_engine():
+    """Motore di punteggio sulla versione più recente del file dei dati"""
+    database.maybe_reload()
+    return scoring_engine
+
+
+def ranking_fingerprint(weather, moon_phase, current_season, current_zone, open_species=b''):
+    """Impronta degli input da cui dipende la classifica della zona.
+
+    Acqua e pressione sono già arrotondate da process_weather_data: una nuova
+    previsione che le cambia produce un'impronta nuova. open_species è la maschera in
+    byte delle specie aperte (RegulationCalendar.open_key): cambia solo quando una
+    specie apre o chiude, non ogni giorno.
+    """
+    return (current_zone, weather['water_temperature'], weather['pressure'], weather['weather_main'],
+            moon_phase, current_season, open_species)
+
+
+def zone_ranking(weather, moon_phase, current_season, current_zone, day=None):
+    """Specie della zona ordinate per punteggio, come tupla di (nome, punteggio).
+
+    Memorizzata per impronta degli input (ranking_fingerprint) e condivisa tra le
+    sessioni: le riesecuzioni che non cambiano gli input non ricalcolano nulla.
+    Le voci scadono allo scoccare dell'ora, con le previsioni da cui derivano.
+    Le specie chiuse il giorno day (default oggi) non compaiono.
+    """
+    day = day or date.today()
+    engine = get_engine()
+    key = ranking_fingerprint(weather, moon_phase, current_season, current_zone,
+                              engine.regulations.open_key(current_zone, day))
+    ranking = ranking_cache.get(key)
+    if ranking is None:
+        scores = engine.score_zone(weather, moon_phase, current_season, current_zone, day)
+        ranking = tuple(sorted(scores.items(), key=lambda x: x[1], reverse=True))
+        if engine is scoring_engine:
+            ranking_cache.put(key, ranking)
+    return ranking
+
+
+def score_hourly(columns, water_temp, location_name, engine=None):
+    """Punteggi ora per ora delle specie della zona sull'intero orizzonte della previsione.
+
+    columns sono le colonne orarie di parse_hourly_columns(). La temperatura dell'acqua
+    resta quella stimata ora: nell'arco di pochi giorni cambia troppo poco per
+    spostare il punteggio.
+    """
+    engine = engine or scoring_engine
+    times = columns['time']
+    pressure = np.round(columns['pressure_msl'].astype(np.float64))
+    zone = engine.zone_ids[location_name]
+
+    scores = engine.score(
+        water_temp, pressure[None], moon_phase_indices(times)[None], season_indices(times)[None],
+        weather_code_index(columns['weather_code'])[None], zones=[zone]
+    )[:, 0, :]
+
+    in_zone = engine.habitat[:, zone]
+    return {
+        'time': times,
+        'species': [name for name, present in zip(engine.species_names, in_zone) if present],
+        'scores': scores[in_zone],
+        'valid': ~np.isnan(pressure),
+        # Specie aperte ora per ora (una lettura per giorno dal calendario compilato)
+        'legal': engine.regulations.legal_matrix(location_name, times)[:len(engine.species_names)][in_zone]
+    }
+
+
+def hourly_activity(lat, lon, location_name, data, water_temp, columns):
+    """Punteggi orari della zona, calcolati una volta per previsione e salvati accanto a lei in cache"""
+    key = forecast_key(lat, lon)
+    name = ('hourly_activity', location_name, water_temp)
+    result = forecast_cache.get_derived(key, name, data)
+    if result is None:
+        engine = get_engine()
+        result = score_hourly(columns, water_temp, location_name, engine)
+        # Un ricaricamento dei dati durante il calcolo non deve lasciare in cache punteggi vecchi
+        if engine is scoring_engine:
+            forecast_cache.put_derived(key, name, result, data)
+    return result
+
+
+def best_windows(activity, hours=BEST_WINDOW_HOURS, start=None):
+    """Miglior finestra di `hours` ore consecutive per ogni specie, ordinate per punteggio medio.
+
+    Le ore in cui la specie è chiusa contano come mancanti: una specie senza finestre
+    aperte nell'orizzonte non compare.
+    """
+    times = activity['time']
+    start = np.datetime64(start or datetime.now(), 'm')
+    usable = ((times >= start) & activity['valid'])[None, :] & activity['legal']
+    if len(times) < hours:
+        return []
+
+    # Media mobile con somme cumulative; scartate le finestre con ore passate, mancanti o chiuse
+    scores = np.where(usable, activity['scores'], 0).astype(np.float64)
+    cumulative = np.cumsum(np.pad(scores, ((0, 0), (1, 0))), axis=1)
+    means = (cumulative[:, hours:] - cumulative[:, :-hours]) / hours
+    counts = np.cumsum(np.pad(usable.astype(np.int64), ((0, 0), (1, 0))), axis=1)
+    complete = (counts[:, hours:] - counts[:, :-hours]) == hours
+    means[~complete] = -np.inf
+
+    best = np.argmax(means, axis=1)
+    windows = [
+        {
+            'species': name,
+            'start': times[b].astype(datetime),
+            'end': (times[b + hours - 1] + np.timedelta64(60, 'm')).astype(datetime),
+            'score': int(round(means[i, b]))
+        }
+        for i, (name, b) in enumerate(zip(activity['species'], best))
+        if complete[i, b]
+    ]
+    windows.sort(key=lambda w: w['score'], reverse=True)
+    return windows
@@ -0,0 +1,206 @@
+# Registro compilato di specie e zone: ID interi, indici inversi e maschere di bit
+
+import warnings
+from types import MappingProxyType
+
+import numpy as np
+
+from database_pesca import ZONE_COORDINATES, FISHING_CALENDAR, FISH_SPECIES, database
+from effemeridi_pesca import MOON_PHASES, SEASONS
+from regolamento_pesca import RegulationCalendar
+
+
+class RegistryWarning(UserWarning):
+    """Incoerenze nei dati che non impediscono il calcolo (es. calendario e habitat diversi)"""
+
+
+def _bitmask(labels, selected):
+    """Maschera di bit con un bit per ogni etichetta selezionata"""
+    mask = 0
+    for i, label in enumerate(labels):
+        if label in selected:
+            mask |= 1 << i
+    return mask
+
+
+def _pack(flags):
+    """Vettore booleano come intero con il bit i acceso se flags[i] è vero"""
+    return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+def validate(species, zones, calendar=None):
+    """Controlla la coerenza delle tabelle; restituisce (errori, avvisi) come liste di messaggi.
+
+    Gli errori rendono i dati inutilizzabili (soglie invertite, etichette o zone
+    sconosciute); gli avvisi segnalano disaccordi tra calendario e tabella specie.
+    """
+    errors, notices = [], []
+    for name, profile in species.items():
+        if profile['temp_min'] > profile['temp_max']:
+            errors.append(f"{name}: temp_min maggiore di temp_max")
+        if profile['pressure_low'] > profile['pressure_high']:
+            errors.append(f"{name}: pressure_low maggiore di pressure_high")
+        for phase in profile['moon_best']:
+            if phase not in MOON_PHASES:
+                errors.append(f"{name}: fase lunare sconosciuta '{phase}'")
+        for season in profile['season_best']:
+            if season not in SEASONS:
+                errors.append(f"{name}: stagione sconosciuta '{season}'")
+        for habitat in profile['habitat']:
+            if not any(habitat in zone for zone in zones):
+                notices.append(f"{name}: l'habitat '{habitat}' non corrisponde a nessuna zona")
+        for zone in profile['zone_preferite']:
+            if zone not in zones:
+                notices.append(f"{name}: zona preferita sconosciuta '{zone}'")
+            elif not any(habitat in zone for habitat in profile['habitat']):
+                notices.append(f"{name}: zona preferita '{zone}' fuori dall'habitat")
+
+    if calendar is not None:
+        for name in species.keys() - calendar.keys():
+            notices.append(f"{name}: assente dal calendario")
+        for name in calendar.keys() - species.keys():
+            notices.append(f"{name}: nel calendario ma non nella tabella specie")
+        for name in species.keys() & calendar.keys():
+            entry = calendar[name]
+            unknown = [zone for zone in entry['zone'] if zone not in zones]
+            if unknown:
+                notices.append(f"{name}: zone del calendario sconosciute {unknown}")
+            for period in entry.get('divieti', ()):
+                unknown = [zone for zone in period['zone'] or () if zone not in zones]
+                if unknown:
+                    notices.append(f"{name}: zone del divieto sconosciute {unknown}")
+            # Il calendario può ammettere la specie dove non è punteggiata: conta solo l'habitat non ammesso
+            missing = [zone for zone in zones
+                       if any(h in zone for h in species[name]['habitat']) and zone not in entry['zone']]
+            if missing:
+                notices.append(f"{name}: zone dell'habitat assenti dal calendario {missing} (specie sempre chiusa)")
+    return errors, notices
+
+
+class SpeciesRegistry:
+    """Tabelle di specie, zone e calendario compilate una volta e non modificabili.
+
+    Specie e zone hanno ID interi (la posizione nelle tuple dei nomi). Habitat, zone
+    preferite e zone del calendario sono maschere di bit sulle zone; fasi lunari e
+    stagioni migliori sono maschere di bit su MOON_PHASES e SEASONS. L'indice inverso
+    zona -> specie rende il filtro per zona una sola lettura. regulations indicizza
+    i giorni di apertura del calendario (RegulationCalendar) con gli stessi ID.
+    """
+
+    def __init__(self, species=FISH_SPECIES, zones=ZONE_COORDINATES, calendar=None, strict=True):
+        # Una copia delle tabelle (anche delle viste su database_pesca): il registro resta di una sola versione
+        species, zones = dict(species), dict(zones)
+        calendar = None if calendar is None else dict(calendar)
+        errors, notices = validate(species, zones, calendar)
+        if errors and strict:
+            raise ValueError("Dati delle specie non validi:\n" + "\n".join(errors))
+        for notice in notices:
+            warnings.warn(notice, RegistryWarning, stacklevel=2)
+
+        names = tuple(species)
+        zone_names = tuple(zones)
+        profiles = [species[name] for name in names]
+        set_ = object.__setattr__
+        set_(self, '_source', (species, zones, calendar, strict))
+
+        set_(self, 'species_names', names)
+        set_(self, 'zone_names', zone_names)
+        set_(self, 'species_ids', MappingProxyType({name: i for i, name in enumerate(names)}))
+        set_(self, 'zone_ids', MappingProxyType({name: i for i, name in enumerate(zone_names)}))
+        set_(self, 'issues', tuple(errors + notices))
+
+        # Soglie come colonne, una riga per specie
+        for field in ('temp_min', 'temp_max', 'pressure_low', 'pressure_high'):
+            set_(self, field, _frozen(np.array([p[field] for p in profiles], dtype=np.float64)))
+
+        set_(self, 'moon_mask', _frozen(np.array([_bitmask(MOON_PHASES, p['moon_best']) for p in profiles], dtype=np.int32)))
+        set_(self, 'season_mask', _frozen(np.array([_bitmask(SEASONS, p['season_best']) for p in profiles], dtype=np.int32)))
+
+        # Habitat risolto una volta con la regola originale (nome dell'habitat contenuto nel nome della zona)
+        shape = (len(names), len(zone_names))
+        habitat = np.array([[any(h in zone for h in p['habitat']) for zone in zone_names] for p in profiles],
+                           dtype=bool).reshape(shape)
+        preferred = np.array([[zone in p['zone_preferite'] for zone in zone_names] for p in profiles],
+                             dtype=bool).reshape(shape)
+        listed = np.array([[zone in (calendar or {}).get(name, {}).get('zone', ()) for zone in zone_names] for name in names],
+                          dtype=bool).reshape(shape)
+
+        # Matrici specie × zone pronte per il motore vettoriale
+        set_(self, 'habitat', _frozen(habitat))
+        set_(self, 'zone_preferred', _frozen(preferred))
+        set_(self, 'calendar_zones', _frozen(listed))
+
+        # Maschere di bit (interi Python, senza limite sul numero di zone o specie)
+        set_(self, 'habitat_mask', tuple(_pack(row) for row in habitat))
+        set_(self, 'preferred_mask', tuple(_pack(row) for row in preferred))
+        set_(self, 'calendar_mask', tuple(_pack(row) for row in listed))
+
+        # Indice inverso: zona -> maschera delle specie presenti e tuple dei nomi
+        set_(self, 'zone_species_mask', tuple(_pack(column) for column in habitat.T))
+        species_array = np.array(names, dtype=object)
+        set_(self, 'species_by_zone', MappingProxyType({
+            zone: tuple(species_array[habitat[:, z]]) for z, zone in enumerate(zone_names)
+        }))
+        set_(self, 'profiles', MappingProxyType({name: MappingProxyType(dict(species[name])) for name in names}))
+        set_(self, 'regulations', RegulationCalendar(calendar or {}, names, zone_names))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SpeciesRegistry non è modificabile")
+
+    def __reduce__(self):
+        # Le MappingProxyType non si serializzano: i processi worker ricompilano dalle tabelle
+        return _rebuild, self._source
+
+    def species_in_zone(self, zone):
+        """Specie presenti nella zona (tupla vuota se la zona non esiste)"""
+        return self.species_by_zone.get(zone, ())
+
+    def in_zone(self, species, zone):
+        """Vero se la specie vive nella zona"""
+        return bool(self.habitat_mask[self.species_ids[species]] >> self.zone_ids[zone] & 1)
+
+    def is_preferred(self, species, zone):
+        """Vero se la zona è tra le preferite della specie"""
+        return bool(self.preferred_mask[self.species_ids[species]] >> self.zone_ids[zone] & 1)
+
+    def profile(self, species):
+        """Profilo della specie (sola lettura)"""
+        return self.profiles[species]
+
+
+def _rebuild(species, zones, calendar, strict):
+    """Ricompila un registro ricevuto da un altro processo (gli avvisi sono già stati mostrati)"""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RegistryWarning)
+        return SpeciesRegistry(species, zones, calendar, strict)
+
+
+species_registry = SpeciesRegistry(FISH_SPECIES, ZONE_COORDINATES, FISHING_CALENDAR)
+
+
+def _check_data(data):
+    """Scarta una nuova versione del file dei dati con errori bloccanti"""
+    errors, _ = validate(data['species'], data['zones'], data['calendar'])
+    if errors:
+        raise ValueError("; ".join(errors))
+
+
+def _recompile(old, new, changes):
+    """Ricompila il registro sui dati ricaricati e lo pubblica con un solo assegnamento"""
+    global species_registry
+    species_registry = SpeciesRegistry(new['species'], new['zones'], new['calendar'])
+
+
+database.add_validator(_check_data)
+database.subscribe(_recompile)
+
+
+def get_registry():
+    """Registro compilato sulla versione più recente del file dei dati"""
+    database.maybe_reload()
+    return species_registry
@@ -0,0 +1,190 @@
+# Regolamento di pesca: periodi di apertura e divieti che si ripetono ogni anno, indicizzati per giorno
+
+from calendar import isleap
+from datetime import date
+
+import numpy as np
+
+# Un giorno dell'anno per posizione, sul calendario di un anno bisestile (29 febbraio compreso)
+YEAR_DAYS = 366
+LEAP_DAY = 59
+_REFERENCE_YEAR = 2000
+_DAY_INDEX = np.arange(YEAR_DAYS)
+
+
+def day_of_year(month, day):
+    """Posizione di (mese, giorno) nell'anno di riferimento (0 = 1 gennaio, 365 = 31 dicembre)"""
+    return date(_REFERENCE_YEAR, month, day).timetuple().tm_yday - 1
+
+
+def day_slot(day):
+    """Posizione nell'anno di una sola data (come day_slots, senza passare da numpy)"""
+    ordinal = day.toordinal() - date(day.year, 1, 1).toordinal()
+    return ordinal + (ordinal >= LEAP_DAY and not isleap(day.year))
+
+
+def day_slots(days):
+    """Posizioni nell'anno di una o più date (date, datetime64 o array di datetime64).
+
+    Negli anni non bisestili le date dopo il 28 febbraio saltano la posizione del
+    29: lo stesso giorno del calendario ha sempre la stessa posizione.
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    ordinal = (days - years).astype(np.int64)
+    year = years.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    return ordinal + (~leap & (ordinal >= LEAP_DAY))
+
+
+def slot_dates(years, slots):
+    """Date delle posizioni slots negli anni years (il 29 febbraio di un anno non bisestile diventa il 1 marzo)"""
+    years = np.asarray(years, dtype=np.int64)
+    slots = np.asarray(slots, dtype=np.int64)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    ordinal = slots - (~leap & (slots > LEAP_DAY))
+    return (years - 1970).astype('datetime64[Y]').astype('datetime64[D]') + ordinal
+
+
+def recurring_days(start, end):
+    """Maschera dei giorni da start a end compresi, entrambi (mese, giorno); se end precede start il periodo scavalca l'anno"""
+    first, last = day_of_year(*start), day_of_year(*end)
+    if first <= last:
+        return (_DAY_INDEX >= first) & (_DAY_INDEX <= last)
+    return (_DAY_INDEX >= first) | (_DAY_INDEX <= last)
+
+
+def _next_true(mask):
+    """Per ogni giorno, quanti giorni mancano al primo giorno vero da lì in avanti (-1 se mai), ciclicamente"""
+    doubled = np.concatenate([mask, mask], axis=-1)
+    never = 2 * YEAR_DAYS
+    index = np.where(doubled, np.arange(2 * YEAR_DAYS), never)
+    following = np.minimum.accumulate(index[..., ::-1], axis=-1)[..., ::-1][..., :YEAR_DAYS]
+    return np.where(following == never, -1, following - _DAY_INDEX).astype(np.int16)
+
+
+def _runs(mask):
+    """Periodi consecutivi veri come (primo, ultimo) giorno; uno a cavallo del 31 dicembre resta unito"""
+    if mask.all():
+        return ((0, YEAR_DAYS - 1),)
+    edges = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    runs = list(zip(starts.tolist(), ends.tolist()))
+    if len(runs) > 1 and runs[0][0] == 0 and runs[-1][1] == YEAR_DAYS - 1:
+        runs = runs[1:-1] + [(runs[-1][0], runs[0][1])]
+    return tuple(sorted(runs))
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+class RegulationCalendar:
+    """Giorni di pesca consentiti per specie e zona, come bitmap di 366 giorni per coppia.
+
+    Una specie è aperta in una zona quando la zona è tra quelle del calendario, il giorno
+    cade nella stagione (apertura-chiusura) e in nessun divieto che riguarda la zona. Le
+    specie senza voce nel calendario sono sempre aperte. Da ogni bitmap derivano i giorni
+    al prossimo giorno aperto e al prossimo chiuso, e l'indice dei periodi aperti: ogni
+    domanda su una data (o su un array di date) è una lettura per posizione nell'anno.
+    """
+
+    def __init__(self, calendar, species_names, zone_names):
+        # Le specie solo nel calendario seguono quelle della tabella: le prime posizioni coincidono con il registro
+        names = tuple(species_names) + tuple(name for name in calendar if name not in species_names)
+        zone_names = tuple(zone_names)
+        self.species_names = names
+        self.zone_names = zone_names
+        self.species_ids = {name: i for i, name in enumerate(names)}
+        self.zone_ids = {name: i for i, name in enumerate(zone_names)}
+
+        allowed = np.ones((len(names), len(zone_names), YEAR_DAYS), dtype=bool)
+        for name, entry in calendar.items():
+            days = allowed[self.species_ids[name]]
+            listed = np.array([zone in entry['zone'] for zone in zone_names], dtype=bool)
+            days &= listed[:, None] & recurring_days(entry['apertura'], entry['chiusura'])
+            for period in entry.get('divieti', ()):
+                zones = np.array([period['zone'] is None or zone in period['zone'] for zone in zone_names], dtype=bool)
+                days[zones] &= ~recurring_days(period['dal'], period['al'])
+
+        # Specie sull'ultimo asse: la riga (zona, giorno) è la maschera delle specie aperte, contigua in memoria
+        self.open = _frozen(np.ascontiguousarray(allowed.transpose(1, 2, 0)))
+        self.open_bits = _frozen(np.packbits(self.open, axis=-1, bitorder='little'))
+        self.days_to_open = _frozen(_next_true(allowed))
+        self.days_to_close = _frozen(_next_true(~allowed))
+        self.periods = {
+            (name, zone): _runs(allowed[s, z])
+            for s, name in enumerate(names) for z, zone in enumerate(zone_names) if allowed[s, z].any()
+        }
+
+    def open_species(self, zone, day):
+        """Maschera booleana (per ID di specie) delle specie aperte nella zona il giorno day"""
+        return self.open[self.zone_ids[zone], day_slot(day)]
+
+    def open_key(self, zone, day):
+        """La stessa maschera in byte: chiave compatta per le cache che dipendono dalle specie aperte"""
+        return self.open_bits[self.zone_ids[zone], day_slot(day)].tobytes()
+
+    def legal_species(self, zone, day):
+        """Specie che si possono pescare nella zona il giorno day"""
+        return tuple(self.species_names[i] for i in np.flatnonzero(self.open_species(zone, day)))
+
+    def is_open(self, species, zone, day):
+        return bool(self.open[self.zone_ids[zone], day_slot(day), self.species_ids[species]])
+
+    def open_zones(self, species, day):
+        """Zone in cui la specie si può pescare il giorno day"""
+        row = self.open[:, day_slot(day), self.species_ids[species]]
+        return tuple(zone for zone, is_open in zip(self.zone_names, row) if is_open)
+
+    def legal_matrix(self, zone, days):
+        """Specie aperte nella zona per ogni data di days: array booleano (specie, date)"""
+        return self.open[self.zone_ids[zone]][day_slots(days)].T
+
+    def _following(self, table, species, zone, days):
+        days = np.asarray(days, dtype='datetime64[D]')
+        slots = day_slots(days)
+        offsets = table[self.species_ids[species], self.zone_ids[zone]][slots].astype(np.int64)
+        years = days.astype('datetime64[Y]').astype(np.int64) + 1970
+        targets = slots + offsets
+        # Le posizioni oltre il 31 dicembre cadono nell'anno successivo: si convertono in date di quell'anno
+        # (unica approssimazione: un periodo fatto del solo 29 febbraio, negli anni non bisestili, dà il 1 marzo)
+        wrapped = targets >= YEAR_DAYS
+        result = slot_dates(years + wrapped, targets - YEAR_DAYS * wrapped)
+        return np.where(offsets < 0, np.datetime64('NaT', 'D'), result)
+
+    def next_openings(self, species, zone, days):
+        """Primo giorno aperto a partire da ogni data di days (la data stessa se è aperta; NaT se mai)"""
+        return self._following(self.days_to_open, species, zone, days)
+
+    def next_closings(self, species, zone, days):
+        """Primo giorno chiuso a partire da ogni data di days (NaT se la specie è aperta tutto l'anno)"""
+        return self._following(self.days_to_close, species, zone, days)
+
+    def next_opening(self, species, zone, day):
+        """Primo giorno aperto da day in poi, o None se la specie è sempre chiusa nella zona"""
+        found = self.next_openings(species, zone, day)
+        return None if np.isnat(found) else found.astype(date)
+
+    def last_open_day(self, species, zone, day):
+        """Ultimo giorno del periodo aperto che comprende day (None se day è chiuso o non chiude mai)"""
+        if not self.is_open(species, zone, day):
+            return None
+        found = self.next_closings(species, zone, day)
+        return None if np.isnat(found) else (found - 1).astype(date)
+
+
+def occurrence(start, end, day):
+    """Date (inizio, fine) del periodo ricorrente start-end che comprende day o, se day è fuori, del prossimo"""
+    first, last = day_of_year(*start), day_of_year(*end)
+    slot = day_slot(day)
+    inside = first <= slot <= last if first <= last else slot >= first or slot <= last
+    if inside:
+        start_year = day.year - (first > last and slot <= last)
+    else:
+        start_year = day.year + (slot > first)
+    end_year = start_year + (first > last)
+    begin, finish = slot_dates([start_year, end_year], [first, last]).astype(date)
+    return begin, finish
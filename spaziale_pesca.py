@@ -0,0 +1,127 @@
+# Indice spaziale delle zone: le più vicine a un punto e quelle entro un raggio
+
+import math
+
+import numpy as np
+
+from database_pesca import ZONE_COORDINATES, database
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Lato dei secchi in gradi (~11 km di latitudine): un raggio di 20 km tocca pochi secchi
+DEFAULT_CELL_DEG = 0.1
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distanza in km dal punto (lat, lon) a uno o più punti"""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class SpatialIndex:
+    """Punti raggruppati in secchi di cell_deg gradi, ordinati per secchio.
+
+    Una riga di secchi adiacenti è un tratto contiguo dell'array ordinato: una query
+    legge un intervallo per riga del riquadro che contiene il cerchio e filtra i
+    candidati con la distanza vera. Non gestisce l'antimeridiano (non serve in Lombardia).
+    """
+
+    def __init__(self, names, lats, lons, cell_deg=DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.columns = int(math.ceil(360 / cell_deg)) + 1
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        keys = self._row(lats) * self.columns + self._column(lons)
+        order = np.argsort(keys, kind='stable')
+        self.names = np.asarray(names, dtype=object)[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.keys = keys[order]
+
+    @classmethod
+    def from_zones(cls, zones, cell_deg=DEFAULT_CELL_DEG):
+        """Indice di un dict nome -> {'lat', 'lon'} come ZONE_COORDINATES"""
+        return cls(list(zones), [c['lat'] for c in zones.values()], [c['lon'] for c in zones.values()], cell_deg)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _row(self, lats):
+        return np.floor((np.asarray(lats) + 90) / self.cell_deg).astype(np.int64)
+
+    def _column(self, lons):
+        return np.floor((np.asarray(lons) + 180) / self.cell_deg).astype(np.int64)
+
+    def _candidates(self, lat, lon, radius_km):
+        """Posizioni dei punti nei secchi del riquadro che contiene il cerchio"""
+        dlat = radius_km / KM_PER_DEGREE
+        row_min = max(int(self._row(lat - dlat)), 0)
+        row_max = min(int(self._row(lat + dlat)), int(self._row(90)))
+        if abs(lat) + dlat >= 90:
+            # Il cerchio contiene un polo: tutte le longitudini
+            col_min, col_max = 0, self.columns - 1
+        else:
+            # Semiampiezza in longitudine del cerchio sulla sfera: verso il polo è più larga
+            # che alla latitudine del centro, quindi non basta radius / cos(lat)
+            spread = math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat))
+            dlon = math.degrees(math.asin(min(spread, 1.0)))
+            col_min, col_max = int(self._column(lon - dlon)), int(self._column(lon + dlon))
+        rows = np.arange(row_min, row_max + 1) * self.columns
+        starts = np.searchsorted(self.keys, rows + col_min, side='left')
+        ends = np.searchsorted(self.keys, rows + col_max, side='right')
+        spans = [np.arange(a, b) for a, b in zip(starts, ends) if b > a]
+        return np.concatenate(spans) if spans else np.empty(0, dtype=np.int64)
+
+    def query(self, lat, lon, radius_km):
+        """Posizioni nell'indice e distanze in km dei punti entro radius_km, ordinate dal più vicino"""
+        candidates = self._candidates(lat, lon, radius_km)
+        distance = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distance <= radius_km
+        candidates, distance = candidates[inside], distance[inside]
+        order = np.argsort(distance, kind='stable')
+        return candidates[order], distance[order]
+
+    def _pairs(self, positions, distance):
+        return list(zip(self.names[positions].tolist(), distance.tolist()))
+
+    def within(self, lat, lon, radius_km):
+        """Punti entro radius_km dal punto, come lista di (nome, km) dal più vicino"""
+        return self._pairs(*self.query(lat, lon, radius_km))
+
+    def nearest(self, lat, lon, k=1, max_km=None):
+        """I k punti più vicini, come lista di (nome, km) dal più vicino (entro max_km se indicato).
+
+        Il raggio di ricerca parte da un secchio e raddoppia finché contiene k punti:
+        tutti i punti entro il raggio sono stati visti, quindi i primi k sono esatti.
+        """
+        if len(self) == 0 or k <= 0:
+            return []
+        radius = self.cell_deg * KM_PER_DEGREE
+        limit = max_km if max_km is not None else 2 * EARTH_RADIUS_KM * math.pi
+        while True:
+            radius = min(radius, limit)
+            positions, distance = self.query(lat, lon, radius)
+            if len(positions) >= k or radius >= limit:
+                return self._pairs(positions[:k], distance[:k])
+            radius *= 2
+
+
+zone_index = SpatialIndex.from_zones(ZONE_COORDINATES)
+
+
+def _rebuild_index(old, new, changes):
+    """Ricostruisce l'indice quando il file dei dati aggiunge, toglie o sposta zone"""
+    global zone_index
+    if changes['zones']:
+        zone_index = SpatialIndex.from_zones(new['zones'])
+
+
+database.subscribe(_rebuild_index)
+
+
+def get_zone_index():
+    """Indice delle zone nella versione più recente del file dei dati"""
+    database.maybe_reload()
+    return zone_index
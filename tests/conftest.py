@@ -0,0 +1,5 @@
+# I moduli dell'app stanno nella radice del repository, senza pacchetto
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,224 @@
+import os
+import pickle
+import threading
+import time
+from datetime import date, timedelta
+
+import warnings
+
+import numpy as np
+import pytest
+
+import acqua_pesca
+from acqua_pesca import HISTORY_DAYS, WATER_TEMP_RECORD, WaterStateWarning, WaterTempStore, zone_id
+
+TODAY = date(2024, 6, 15)
+
+
+def make_store(tmp_path, name='storico.bin', legacy_path=None):
+    store = WaterTempStore(str(tmp_path / name), legacy_path=legacy_path)
+    # Nessuna compattazione in background durante i test: si chiama compact() a mano
+    store._last_compaction = time.time()
+    return store
+
+
+def append_days(store, zone, days, first_temp=10.0):
+    temps = first_temp + np.arange(len(days), dtype=float)
+    store.append(zone, days, temps, temps / 10, temps + 5, temps - 1)
+    return temps
+
+
+def read_records(store):
+    return store._scan(lambda records: records.copy())
+
+
+def test_round_trip(tmp_path):
+    store = make_store(tmp_path)
+    days = [TODAY - timedelta(days=n) for n in (3, 2, 1)]
+    append_days(store, 'Lago di Varese', days)
+    append_days(store, 'Oleggio', days[:2], first_temp=20.0)
+
+    state = store.last_state('Lago di Varese', TODAY)
+    assert state == {'temp': 12.0, 'date': days[-1], 'heat_accumulation': 1.2,
+                     'air_temp': 17.0, 'seasonal_base': 11.0}
+    assert store.last_state('Oleggio', TODAY)['date'] == days[1]
+    # Solo i giorni prima di before_date, entro max_age_days
+    assert store.last_state('Lago di Varese', days[1])['date'] == days[0]
+    assert store.last_state('Lago di Varese', days[0]) is None
+    assert store.last_state('Lago di Varese', TODAY + timedelta(days=HISTORY_DAYS + 1)) is None
+    assert store.last_state('Panperduto', TODAY) is None
+
+
+def test_last_record_wins_for_same_day(tmp_path):
+    store = make_store(tmp_path)
+    day = TODAY - timedelta(days=1)
+    append_days(store, 'Oleggio', [day], first_temp=10.0)
+    append_days(store, 'Oleggio', [day], first_temp=11.5)
+    assert store.last_state('Oleggio', TODAY)['temp'] == 11.5
+
+
+def test_missing_file_and_partial_record(tmp_path):
+    store = make_store(tmp_path)
+    assert store.last_state('Oleggio', TODAY) is None
+    append_days(store, 'Oleggio', [TODAY - timedelta(days=1)])
+    # Un record scritto a metà da un'altra sessione viene ignorato
+    with open(store.path, 'ab') as f:
+        f.write(b'\x00' * (WATER_TEMP_RECORD.itemsize // 2))
+    assert store.last_state('Oleggio', TODAY)['temp'] == 10.0
+
+
+def test_compaction_drops_old_records_and_duplicates(tmp_path):
+    store = make_store(tmp_path)
+    old = [TODAY - timedelta(days=HISTORY_DAYS + n) for n in (5, 1)]
+    recent = [TODAY - timedelta(days=n) for n in (2, 1)]
+    append_days(store, 'Oleggio', old + recent)
+    append_days(store, 'Oleggio', recent[-1:], first_temp=30.0)
+    append_days(store, 'Panperduto', recent)
+    before = store.last_state('Oleggio', TODAY)
+
+    store.compact(current_date=TODAY)
+
+    records = read_records(store)
+    assert len(records) == 4
+    assert (TODAY.toordinal() - records['day'] <= HISTORY_DAYS).all()
+    keys = list(zip(records['zone'].tolist(), records['day'].tolist()))
+    assert len(set(keys)) == len(keys)
+    assert store.last_state('Oleggio', TODAY) == before
+    assert before['temp'] == 30.0
+
+
+def test_concurrent_append(tmp_path):
+    # Due istanze sullo stesso file simulano due sessioni: il lock su file le serializza
+    stores = [make_store(tmp_path), make_store(tmp_path)]
+    zones = ['Lago di Varese', 'Oleggio', 'Panperduto', 'Lago Maggiore - Lombardia']
+    rounds = 50
+    barrier = threading.Barrier(len(zones))
+
+    def writer(i, zone):
+        store = stores[i % 2]
+        barrier.wait()
+        for n in range(rounds):
+            day = TODAY - timedelta(days=1 + n % HISTORY_DAYS)
+            store.append(zone, [day, day], [float(n), float(n)], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0])
+
+    threads = [threading.Thread(target=writer, args=(i, zone)) for i, zone in enumerate(zones)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    records = read_records(stores[0])
+    assert len(records) == len(zones) * rounds * 2
+    for zone in zones:
+        mine = records[records['zone'] == zone_id(zone)]
+        # Ogni append resta intera e nell'ordine di scrittura della sua sessione
+        assert mine['temp'].tolist() == [float(n // 2) for n in range(rounds * 2)]
+
+
+def test_legacy_pickle_import(tmp_path):
+    legacy = tmp_path / 'storico.pkl'
+    history = {
+        f'Oleggio_{TODAY - timedelta(days=2)}': {
+            'temp': 14.0, 'date': TODAY - timedelta(days=2), 'heat_accumulation': 0.5,
+            'air_temp': 18.0, 'seasonal_base': 13.0
+        },
+        # Voci vecchie senza i campi dello stato termico
+        f'Lago di Varese_{TODAY - timedelta(days=1)}': {'temp': 15.0, 'date': TODAY - timedelta(days=1)},
+    }
+    with open(legacy, 'wb') as f:
+        pickle.dump(history, f)
+
+    store = make_store(tmp_path, legacy_path=str(legacy))
+
+    assert store.last_state('Oleggio', TODAY) == {
+        'temp': 14.0, 'date': TODAY - timedelta(days=2), 'heat_accumulation': 0.5,
+        'air_temp': 18.0, 'seasonal_base': 13.0
+    }
+    assert store.last_state('Lago di Varese', TODAY) == {
+        'temp': 15.0, 'date': TODAY - timedelta(days=1), 'heat_accumulation': 0.0,
+        'air_temp': 15.0, 'seasonal_base': 15.0
+    }
+    # L'import avviene una volta sola: con il nuovo file presente il pickle non viene riletto
+    make_store(tmp_path, legacy_path=str(legacy))
+    assert len(read_records(store)) == 2
+
+
+def test_unreadable_legacy_pickle_is_ignored(tmp_path):
+    legacy = tmp_path / 'storico.pkl'
+    legacy.write_bytes(b'non un pickle')
+    store = make_store(tmp_path, legacy_path=str(legacy))
+    assert store.last_state('Oleggio', TODAY) is None
+
+
+@pytest.mark.parametrize('max_age_days', [1, 5])
+def test_last_state_max_age(tmp_path, max_age_days):
+    store = make_store(tmp_path)
+    append_days(store, 'Oleggio', [TODAY - timedelta(days=3)])
+    state = store.last_state('Oleggio', TODAY, max_age_days=max_age_days)
+    assert (state is not None) == (max_age_days >= 3)
+
+
+def test_index_follows_other_sessions(tmp_path):
+    reader, writer = make_store(tmp_path), make_store(tmp_path)
+    append_days(writer, 'Oleggio', [TODAY - timedelta(days=3)])
+    assert reader.last_state('Oleggio', TODAY)['temp'] == 10.0
+    index = reader._index
+
+    # Le scritture successive si aggiungono all'indice senza rileggere il file
+    append_days(writer, 'Oleggio', [TODAY - timedelta(days=1)], first_temp=12.0)
+    assert reader.last_state('Oleggio', TODAY)['temp'] == 12.0
+    assert reader._index is index
+    assert reader._indexed_size == 2 * WATER_TEMP_RECORD.itemsize
+
+    # Dopo la compattazione (file sostituito) l'indice si ricostruisce senza i record eliminati
+    writer.compact(current_date=TODAY + timedelta(days=HISTORY_DAYS + 2))
+    assert reader.last_state('Oleggio', TODAY, max_age_days=100) == reader.last_state('Oleggio', TODAY)
+    assert reader.last_state('Oleggio', TODAY - timedelta(days=1), max_age_days=100) is None
+
+
+def hourly_block(first_day, days, air_temp=20.0):
+    hours = np.arange(np.datetime64(first_day, 'h'), np.datetime64(first_day + timedelta(days=days), 'h'))
+    return {
+        'time': [str(hour) for hour in hours],
+        'temperature_2m': [air_temp] * len(hours),
+        'weather_code': [0] * len(hours),
+        'wind_speed_10m': [2.0] * len(hours)
+    }
+
+
+@pytest.fixture
+def isolated_store(tmp_path, monkeypatch):
+    store = make_store(tmp_path)
+    monkeypatch.setattr(acqua_pesca, 'water_temp_store', store)
+    return store
+
+
+def test_advance_reseeds_after_gap(isolated_store, tmp_path, monkeypatch):
+    hourly = hourly_block(TODAY - timedelta(days=7), 8)
+    fresh = acqua_pesca.advance_water_temperature('Oleggio', hourly, TODAY)
+
+    # Stato salvato più vecchio del blocco orario: i giorni in mezzo non si possono simulare
+    monkeypatch.setattr(acqua_pesca, 'water_temp_store', make_store(tmp_path, name='buco.bin'))
+    append_days(acqua_pesca.water_temp_store, 'Oleggio', [TODAY - timedelta(days=20)], first_temp=4.0)
+    with pytest.warns(WaterStateWarning, match='Oleggio'):
+        state = acqua_pesca.advance_water_temperature('Oleggio', hourly, TODAY)
+    assert state == fresh
+    assert state['date'] == TODAY - timedelta(days=1)
+
+
+def test_advance_continues_without_gap(isolated_store, tmp_path, monkeypatch):
+    hourly = hourly_block(TODAY - timedelta(days=7), 8, air_temp=8.0)
+    append_days(isolated_store, 'Oleggio', [TODAY - timedelta(days=8)], first_temp=4.0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', WaterStateWarning)
+        state = acqua_pesca.advance_water_temperature('Oleggio', hourly, TODAY)
+    assert state['date'] == TODAY - timedelta(days=1)
+    # Idempotente: una seconda chiamata non aggiunge record
+    size = os.path.getsize(isolated_store.path)
+    again = acqua_pesca.advance_water_temperature('Oleggio', hourly, TODAY)
+    assert {key: again[key] for key in state} == state
+    assert os.path.getsize(isolated_store.path) == size
+
+    # Si è partiti dallo stato salvato, non dalla media stagionale
+    monkeypatch.setattr(acqua_pesca, 'water_temp_store', make_store(tmp_path, name='vuoto.bin'))
+    assert acqua_pesca.advance_water_temperature('Oleggio', hourly, TODAY)['temp'] != pytest.approx(state['temp'])
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from api_pesca import MAX_REQUEST_BODY, ForecastService, build_nearby, build_table
+
+ZONES = {
+    'Lago di Varese': {'lat': 45.8167, 'lon': 8.7333},
+    'Oleggio': {'lat': 45.5967, 'lon': 8.6386},
+}
+
+
+def forecast(success, data_age, species):
+    return {
+        'conditions': {
+            'temperature': 15.0, 'water_temperature': 13.5, 'pressure': 1012,
+            'weather_condition': 'Sereno', 'hourly_forecast': [], 'data_age': data_age,
+            'stale': False, 'success': success
+        },
+        'moon_phase': '🌕 Luna Piena',
+        'season': 'Primavera',
+        'species': [{'species': name, 'score': score} for name, score in species]
+    }
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = ForecastService()
+    forecasts = {
+        'Lago di Varese': forecast(True, 120, [('Luccio', 90), ('Carpa', 70)]),
+        # Zona con soli dati simulati: niente età dei dati
+        'Oleggio': forecast(False, None, [('Carpa', 60)]),
+    }
+    service.generated_at = time.time()
+    service.table = build_table(forecasts, ZONES, service.generated_at)
+    service.nearby_index, service.nearby_spots = build_nearby(forecasts, ZONES)
+    return service
+
+
+def split(response):
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    return int(lines[0].split(' ')[1]), headers, body
+
+
+def get(service, target, method='GET', headers=None):
+    return split(service.respond(method, target, headers or {}))
+
+
+def test_zone_payloads_carry_success_and_age(service):
+    _, _, body = get(service, '/zones')
+    zones = {zone['name']: zone for zone in json.loads(body)['zones']}
+    assert (zones['Lago di Varese']['success'], zones['Lago di Varese']['data_age']) == (True, 120)
+    assert (zones['Oleggio']['success'], zones['Oleggio']['data_age']) == (False, None)
+
+    _, _, body = get(service, '/forecasts')
+    conditions = json.loads(body)['zones']['Oleggio']['conditions']
+    assert (conditions['success'], conditions['data_age']) == (False, None)
+
+    _, _, body = get(service, '/nearby?lat=45.8&lon=8.7&radius=50')
+    spots = json.loads(body)['spots']
+    # Le zone senza dati reali non compaiono tra quelle vicine
+    assert [(spot['name'], spot['success'], spot['data_age']) for spot in spots] == [('Lago di Varese', True, 120)]
+
+
+@pytest.mark.parametrize('method, target, status', [
+    ('HEAD', '/sconosciuto', 404),
+    ('HEAD', '/nearby?lat=abc', 400),
+    ('HEAD', '/zones', 200),
+    ('GET', '/sconosciuto', 404),
+    ('DELETE', '/zones', 405),
+])
+def test_head_never_sends_a_body(service, method, target, status):
+    code, headers, body = get(service, target, method)
+    assert code == status
+    _, _, full_body = get(service, target, 'GET' if method == 'HEAD' else method)
+    # HEAD ha le stesse intestazioni di GET, Content-Length compreso, ma nessun corpo
+    assert int(headers['Content-Length']) == len(full_body) > 0
+    assert body == (b'' if method == 'HEAD' else full_body)
+
+
+def test_method_not_allowed_lists_methods(service):
+    _, headers, _ = get(service, '/zones', 'POST')
+    assert headers['Allow'] == 'GET, HEAD'
+
+
+def test_errors_have_no_etag(service):
+    _, headers, _ = get(service, '/sconosciuto')
+    assert 'ETag' not in headers
+    code, _, _ = get(service, '/sconosciuto', headers={'if-none-match': '"x"'})
+    assert code == 404
+
+
+def test_not_modified(service):
+    _, headers, _ = get(service, '/zones')
+    code, _, body = get(service, '/zones', headers={'if-none-match': headers['ETag']})
+    assert (code, body) == (304, b'')
+
+
+def exchange(service, payload):
+    """Invia payload su una sola connessione al server e restituisce le risposte lette fino alla chiusura"""
+    async def run():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(payload)
+            await writer.drain()
+            responses = []
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+                except asyncio.IncompleteReadError:
+                    break
+                code, headers, _ = split(head)
+                body = await reader.readexactly(int(headers.get('Content-Length', 0)))
+                responses.append((code, headers, body))
+                if headers.get('Connection') == 'close':
+                    break
+            writer.close()
+            return responses
+    return asyncio.run(run())
+
+
+def test_request_body_is_drained_on_keep_alive(service):
+    body = b'{"zone": "Oleggio"}\r\n\r\nGET /sconosciuto HTTP/1.1\r\n\r\n'
+    responses = exchange(service, (
+        b'POST /zones HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body
+        + b'GET /health HTTP/1.1\r\nConnection: close\r\n\r\n'
+    ))
+    # Il corpo del POST non viene letto come una richiesta: la seconda risposta è quella di /health
+    assert [code for code, _, _ in responses] == [405, 200]
+    assert json.loads(responses[1][2])['status']
+
+
+@pytest.mark.parametrize('headers', [
+    b'Transfer-Encoding: chunked',
+    b'Content-Length: abc',
+    b'Content-Length: %d' % (MAX_REQUEST_BODY + 1),
+])
+def test_unknown_body_length_closes_connection(service, headers):
+    responses = exchange(service, (
+        b'PUT /zones HTTP/1.1\r\n' + headers + b'\r\n\r\n5\r\nhello\r\n0\r\n\r\n'
+        + b'GET /health HTTP/1.1\r\n\r\n'
+    ))
+    assert len(responses) == 1
+    code, response_headers, _ = responses[0]
+    assert (code, response_headers['Connection']) == (405, 'close')
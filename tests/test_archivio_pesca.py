@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+
+import pytest
+
+import meteo_pesca
+from cache_pesca import TTLCache
+from archivio_pesca import SnapshotStore, model_time, run_name, zone_dir_name
+
+KEY = (45.6, 8.64, 'temperature_2m', 'temperature_2m')
+HOUR = 3600
+
+
+def payload(local_time, offset=7200, value=1.0):
+    return {'utc_offset_seconds': offset, 'current': {'time': local_time, 'temperature_2m': value}}
+
+
+def snapshot_names(store, key=KEY):
+    return sorted(os.listdir(os.path.join(store.root, zone_dir_name(key))))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_age=None)
+    yield store
+    store.flush()
+
+
+def test_model_time_uses_payload_offset():
+    assert model_time(payload('2025-05-08T10:45')) == model_time(payload('2025-05-08T09:45', offset=3600))
+    assert run_name(model_time(payload('2025-05-08T10:45'))) == '20250508T08.json.gz'
+    assert model_time({'current': {}}) is None
+    assert model_time({'current': {'time': 'non una data'}}) is None
+
+
+def test_snapshots_keyed_by_model_hour(store):
+    now = time.time()
+    # Stessa ora del modello scaricata in due ore diverse: una sola snapshot, l'ultima
+    store.save(KEY, payload('2025-05-08T10:00', value=1.0), now - 2 * HOUR)
+    store.save(KEY, payload('2025-05-08T10:30', value=2.0), now)
+    store.flush()
+    assert snapshot_names(store) == ['20250508T08.json.gz']
+    data, fetched_at = store.latest(KEY)
+    assert data['current']['temperature_2m'] == 2.0 and fetched_at == now
+
+    store.save(KEY, payload('2025-05-08T11:00', value=3.0), now - HOUR)
+    store.flush()
+    assert snapshot_names(store) == ['20250508T08.json.gz', '20250508T09.json.gz']
+    assert store.latest(KEY)[0]['current']['temperature_2m'] == 3.0
+
+
+def test_falls_back_to_download_time(store):
+    now = time.time()
+    store.save(KEY, {'hourly': {}}, now)
+    store.flush()
+    assert snapshot_names(store) == [run_name(now)]
+
+
+def test_prune_on_write(tmp_path):
+    store = SnapshotStore(str(tmp_path), max_age=48 * HOUR)
+    now = time.time()
+    for age in (100, 72, 47, 1):
+        stamp = time.strftime('%Y-%m-%dT%H:%M', time.gmtime(now - age * HOUR))
+        store.save(KEY, payload(stamp, offset=0), now)
+    store.flush()
+    expected = [run_name(now - age * HOUR) for age in (47, 1)]
+    assert snapshot_names(store) == expected
+    assert [fetched_at for _, fetched_at, _ in store.replay()] == [now, now]
+
+
+def test_replay_filters_by_model_hour(store):
+    now = time.time()
+    other = (45.8, 8.83, 'temperature_2m', 'temperature_2m')
+    for hour in (8, 9, 10):
+        store.save(KEY, payload(f'2025-05-08T{hour:02d}:00', offset=0), now)
+        store.save(other, payload(f'2025-05-08T{hour:02d}:00', offset=0), now)
+    store.flush()
+    start = model_time(payload('2025-05-08T09:00', offset=0))
+    records = list(store.replay(keys=[KEY], start=start, end=start + HOUR))
+    assert [data['current']['time'] for _, _, data in records] == ['2025-05-08T09:00', '2025-05-08T10:00']
+    assert len(list(store.replay())) == 6
+
+
+@pytest.fixture
+def fresh_warm_state(monkeypatch):
+    monkeypatch.setattr(meteo_pesca, '_warmed', {})
+    monkeypatch.setattr(meteo_pesca, 'forecast_cache', TTLCache(ttl=meteo_pesca.FORECAST_TTL))
+    monkeypatch.setattr(meteo_pesca, 'last_good_cache', TTLCache(ttl=meteo_pesca.LAST_GOOD_MAX_AGE, align=False))
+
+
+def test_warm_reads_outside_lock(fresh_warm_state, monkeypatch):
+    slow_key, other_key = ('lento',), ('altro',)
+    reading = threading.Event()
+    release = threading.Event()
+    reads = []
+
+    def latest(key):
+        reads.append(key)
+        if key == slow_key:
+            reading.set()
+            release.wait(5)
+        return {'zona': key[0]}, time.time()
+
+    monkeypatch.setattr(meteo_pesca.snapshot_store, 'latest', latest)
+    first = threading.Thread(target=meteo_pesca._warm_from_disk, args=(slow_key,))
+    second = threading.Thread(target=meteo_pesca._warm_from_disk, args=(slow_key,))
+    first.start()
+    assert reading.wait(5)
+    second.start()
+
+    # Un'altra zona non aspetta la lettura in corso
+    meteo_pesca._warm_from_disk(other_key)
+    assert meteo_pesca.forecast_cache.get(other_key) == {'zona': 'altro'}
+    # Chi chiede la stessa zona aspetta la prima lettura invece di rileggere il file
+    second.join(0.2)
+    assert second.is_alive()
+
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert meteo_pesca.forecast_cache.get(slow_key) == {'zona': 'lento'}
+    assert reads.count(slow_key) == 1
+
+
+def test_warm_does_not_overwrite_newer_download(fresh_warm_state, monkeypatch):
+    key = ('zona',)
+
+    def latest(key):
+        # Il download finisce mentre si legge il file
+        meteo_pesca.forecast_cache.put(key, {'nuovo': True})
+        meteo_pesca.last_good_cache.put(key, {'nuovo': True})
+        return {'nuovo': False}, time.time() - 60
+
+    monkeypatch.setattr(meteo_pesca.snapshot_store, 'latest', latest)
+    meteo_pesca._warm_from_disk(key)
+    assert meteo_pesca.forecast_cache.get(key) == {'nuovo': True}
+    assert meteo_pesca.last_good_cache.get(key) == {'nuovo': True}
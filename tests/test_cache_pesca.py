@@ -0,0 +1,121 @@
+import pytest
+
+import cache_pesca
+from cache_pesca import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Orologio controllato dal test al posto di time.time"""
+    class Clock:
+        now = 7200.0
+
+        def __call__(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(cache_pesca.time, 'time', clock)
+    return clock
+
+
+def test_aligned_expiry_at_next_hour(clock):
+    cache = TTLCache(ttl=3600)
+    clock.now = 7200 + 3500
+    cache.put('a', 1)
+    clock.now = 7200 + 3599
+    assert cache.get('a') == 1
+    # Inserita a un minuto e mezzo dall'ora: scade comunque allo scoccare dell'ora
+    clock.now = 10800
+    assert cache.get('a') is None
+    assert not cache.contains('a')
+    assert cache.stats()['entries'] == 0
+
+
+def test_unaligned_expiry_after_ttl(clock):
+    cache = TTLCache(ttl=3600, align=False)
+    clock.now = 7200 + 3500
+    cache.put('a', 1)
+    clock.now = 10800 + 3499
+    assert cache.get('a') == 1
+    clock.now = 10800 + 3500
+    assert cache.get('a') is None
+
+
+def test_stored_at_keeps_original_age(clock):
+    cache = TTLCache(ttl=3600)
+    clock.now = 10800 + 60
+    # Salvata nell'ora precedente (es. da disco): è già scaduta
+    cache.put('old', 1, stored_at=7200 + 10)
+    cache.put('now', 2, stored_at=10800 + 10)
+    assert cache.get('old') is None
+    assert cache.get_with_time('now') == (2, 10800 + 10)
+    assert cache.age('now') == 50
+
+
+def test_lru_eviction_at_capacity(clock):
+    cache = TTLCache(max_entries=3)
+    for key in 'abc':
+        cache.put(key, key)
+    # Una lettura rende 'a' la più recente: esce 'b'
+    assert cache.get('a') == 'a'
+    cache.put('d', 'd')
+    assert cache.get('b') is None
+    # contains non cambia l'ordine: la meno recente resta 'c'
+    assert cache.contains('c')
+    cache.put('e', 'e')
+    assert not cache.contains('c')
+    assert [cache.get(key) for key in 'ade'] == ['a', 'd', 'e']
+    assert cache.stats()['evictions'] == 2
+
+
+def test_hit_and_miss_counters(clock):
+    cache = TTLCache()
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    cache.contains('a')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_derived_follow_their_source(clock):
+    cache = TTLCache(ttl=3600)
+    source = {'payload': 1}
+    cache.put('a', source)
+    cache.put_derived('a', 'columns', 'derived', source)
+    assert cache.get_derived('a', 'columns', source) == 'derived'
+    # Un risultato calcolato su un valore diverso non si legge né si salva
+    assert cache.get_derived('a', 'columns', {'payload': 1}) is None
+    cache.put_derived('a', 'other', 'stale', {'payload': 1})
+    assert cache.get_derived('a', 'other', source) is None
+
+    # Un nuovo valore per la chiave scarta i derivati del precedente
+    replacement = {'payload': 2}
+    cache.put('a', replacement)
+    assert cache.get_derived('a', 'columns', replacement) is None
+    assert cache.get_derived('a', 'columns', source) is None
+
+    # I derivati scadono con la voce
+    cache.put_derived('a', 'columns', 'derived', replacement)
+    clock.now += 3600
+    assert cache.get_derived('a', 'columns', replacement) is None
+
+
+def test_invalidate_derived_and_entries(clock):
+    cache = TTLCache()
+    sources = {key: object() for key in 'ab'}
+    for key, source in sources.items():
+        cache.put(key, source)
+        cache.put_derived(key, ('hourly_activity', key), 1, source)
+        cache.put_derived(key, 'hourly_columns', 2, source)
+
+    removed = cache.invalidate_derived(lambda name: isinstance(name, tuple) and name[1] == 'a')
+    assert removed == 1
+    assert cache.get_derived('a', ('hourly_activity', 'a'), sources['a']) is None
+    assert cache.get_derived('a', 'hourly_columns', sources['a']) == 2
+    assert cache.get_derived('b', ('hourly_activity', 'b'), sources['b']) == 1
+
+    assert cache.invalidate_where(lambda key: key == 'b') == 1
+    assert not cache.contains('b')
+    cache.invalidate('a')
+    assert cache.stats()['entries'] == 0
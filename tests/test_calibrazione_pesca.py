@@ -0,0 +1,126 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import calibrazione_pesca
+from acqua_pesca import DAYTIME_HOURS
+from backtest_pesca import match_catch_log
+from calibrazione_pesca import THRESHOLDS, calibrate, reduce_inputs, split_holdout
+from database_pesca import FISH_SPECIES, ZONE_COORDINATES
+from effemeridi_pesca import moon_phase_indices, season_indices
+from punteggio_pesca import SCORE_WEIGHTS
+
+START = np.datetime64('2023-04-01T00', 'h')
+HOURS = 60 * 24
+ZONES = list(ZONE_COORDINATES)
+# Le catture di Carpa arrivano con l'acqua 3 gradi sopra il suo intervallo: la calibrazione deve accorgersene
+SHIFT = 3.0
+
+
+@pytest.fixture(scope='module')
+def inputs():
+    rng = np.random.default_rng(0)
+    times = START + np.arange(HOURS)
+    shape = (len(ZONES), HOURS)
+    return {
+        'time': times,
+        'zones': ZONES,
+        'water_temp': np.round(rng.uniform(4, 32, shape), 1),
+        'pressure': np.round(rng.uniform(995, 1035, shape)),
+        'moon': moon_phase_indices(times),
+        'season': season_indices(times),
+        'weather': rng.integers(0, 5, shape).astype(np.int16),
+        'valid': np.ones(shape, dtype=bool)
+    }
+
+
+def catch_log(rows):
+    log = pd.DataFrame(rows, columns=['date', 'zone', 'species', 'catches'])
+    log['date_only'] = log['date'].str.len() <= 10
+    log['date'] = pd.to_datetime(log['date'], format='ISO8601')
+    return log
+
+
+def carpa_catches(inputs, count=120, seed=1):
+    """Ore di Oleggio con l'acqua nell'intervallo della Carpa spostato di SHIFT gradi"""
+    carpa = FISH_SPECIES['Carpa']
+    water = inputs['water_temp'][ZONES.index('Oleggio')]
+    shifted = (water >= carpa['temp_min'] + SHIFT) & (water <= carpa['temp_max'] + SHIFT)
+    hours = np.random.default_rng(seed).choice(np.flatnonzero(shifted), count, replace=False)
+    stamps = pd.to_datetime(inputs['time'][np.sort(hours)]).strftime('%Y-%m-%d %H:%M')
+    return [(stamp, 'Oleggio', 'Carpa', 1) for stamp in stamps]
+
+
+@pytest.fixture(scope='module')
+def rows(inputs):
+    log = catch_log(carpa_catches(inputs) + [('2023-04-20', 'Oleggio', 'Luccio', 2), ('2023-05-02', 'Lago di Varese', 'Luccio', 1)])
+    return split_holdout(match_catch_log(inputs, tuple(FISH_SPECIES), log))
+
+
+def test_reduce_inputs_keeps_sample_and_catch_hours(inputs, rows):
+    reduced, remapped = reduce_inputs(inputs, rows, sample_hours=200, seed=3)
+    assert reduced['sample'].sum() == 200
+    assert reduced['zones'] == inputs['zones']
+    for field in ('water_temp', 'pressure', 'weather', 'valid'):
+        assert reduced[field].shape == (len(ZONES), len(reduced['time'])), field
+
+    # Le ore esatte puntano alla stessa ora del periodo intero
+    exact = rows[~rows['date_only']]
+    kept = remapped.iloc[:len(exact)]
+    assert (reduced['time'][kept['h'].values] == inputs['time'][exact['h'].values]).all()
+    assert (reduced['water_temp'][kept['z'].values, kept['h'].values]
+            == inputs['water_temp'][exact['z'].values, exact['h'].values]).all()
+
+    # Ogni uscita senza orario diventa una riga per ora diurna, ognuna con 1/n delle catture
+    daytime = DAYTIME_HOURS[1] - DAYTIME_HOURS[0] + 1
+    expanded = remapped.iloc[len(exact):]
+    assert len(expanded) == daytime * rows['date_only'].sum()
+    assert not remapped['date_only'].any()
+    assert expanded['catches'].sum() == pytest.approx(rows[rows['date_only']]['catches'].sum())
+    hours = pd.to_datetime(reduced['time'][expanded['h'].values]).hour
+    assert sorted(set(hours)) == list(range(DAYTIME_HOURS[0], DAYTIME_HOURS[1] + 1))
+
+
+def test_reduce_inputs_without_sampling_keeps_everything(inputs, rows):
+    reduced, _ = reduce_inputs(inputs, rows, sample_hours=0)
+    assert len(reduced['time']) == HOURS and reduced['sample'].all()
+
+
+def test_calibrate_moves_carpa_towards_its_catches(inputs, rows):
+    result = calibrate(inputs, rows, method='random', samples=40, workers=1, sample_hours=0)
+    before, after = result['objective']['before'], result['objective']['after']
+    assert after['train'] >= before['train']
+
+    carpa = result['species']['Carpa']
+    assert carpa['temp_min'] > FISH_SPECIES['Carpa']['temp_min']
+    assert carpa['temp_max'] > FISH_SPECIES['Carpa']['temp_max']
+    # Specie senza catture: soglie invariate
+    for field in THRESHOLDS:
+        assert result['species']['Siluro'][field] == FISH_SPECIES['Siluro'][field]
+
+    assert set(result['weights']) == set(SCORE_WEIGHTS)
+    assert result['candidates'] == 2 * (40 + 1)
+    assert set(result['thresholds']['species']) == {'Carpa', 'Luccio'}
+
+
+def test_main_writes_report(inputs, tmp_path, monkeypatch, capsys):
+    log_path = tmp_path / 'catture.csv'
+    pd.DataFrame(carpa_catches(inputs), columns=['date', 'zone', 'species', 'catches']).to_csv(log_path, index=False)
+    output = tmp_path / 'calibrazione.json'
+    monkeypatch.setattr(calibrazione_pesca, 'prepare_inputs', lambda zones, start, end, archive_dir: inputs)
+
+    code = calibrazione_pesca.main(['--catch-log', str(log_path), '--start', '2023-04-01', '--end', '2023-05-30',
+                                    '--offline', '--method', 'random', '--samples', '10', '--workers', '1',
+                                    '--output', str(output)])
+    assert code == 0
+    assert 'Pesi risultanti' in capsys.readouterr().out
+
+    with open(output, encoding='utf-8') as f:
+        report = json.load(f)
+    assert report['period'] == ['2023-04-01', '2023-05-30']
+    assert set(report['weights']) == set(SCORE_WEIGHTS)
+    assert set(report['species']) == set(FISH_SPECIES)
+    assert report['objective']['after']['train'] >= report['objective']['before']['train']
+    assert report['threshold_ranking'] and report['weight_ranking']
@@ -0,0 +1,137 @@
+import json
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import acqua_pesca
+import core_pesca
+from acqua_pesca import WaterTempStore
+from benchmarks.bench_pesca import fixture_path, load_fixtures
+from database_pesca import FISH_SPECIES, ZONE_COORDINATES
+from effemeridi_pesca import get_moon_phase, get_season
+from meteo_pesca import get_weather_description
+from punteggio_pesca import calculate_fish_activity, get_engine
+
+
+def loop_hourly_forecast(data, current_time):
+    """Versione a ciclo sulle stringhe degli orari, precedente alle colonne tipizzate"""
+    hourly = data['hourly']
+    forecast = []
+    for i in range(len(hourly['time'])):
+        hour_time = datetime.fromisoformat(hourly['time'][i].replace('Z', '+00:00'))
+        if hour_time > current_time and len(forecast) < 6:
+            forecast.append({
+                'time': hour_time.strftime('%H:%M'),
+                'temperature': round(hourly['temperature_2m'][i], 1),
+                'pressure': round(hourly['pressure_msl'][i]),
+                'precipitation_probability': hourly['precipitation_probability'][i],
+                'weather_code': hourly['weather_code'][i],
+                'weather_description': get_weather_description(hourly['weather_code'][i]),
+                'wind_speed': round(hourly['wind_speed_10m'][i] * 3.6, 1)
+            })
+    return forecast
+
+
+def frozen_datetime(now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+    return FrozenDatetime
+
+
+def raw_fixture(location_name):
+    with open(fixture_path(location_name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def instants(data):
+    """Istanti attorno ai bordi della finestra: prima dell'inizio, sulle ore, tra le ore, vicino alla fine"""
+    first = datetime.fromisoformat(data['hourly']['time'][0])
+    last = datetime.fromisoformat(data['hourly']['time'][-1])
+    middle = first + (last - first) / 2
+    return [
+        first - timedelta(hours=1), first, first + timedelta(minutes=30),
+        middle, middle + timedelta(seconds=30), middle + timedelta(minutes=59, seconds=59),
+        last - timedelta(hours=3), last - timedelta(minutes=1), last, last + timedelta(hours=1),
+    ]
+
+
+@pytest.mark.parametrize('location_name', list(ZONE_COORDINATES))
+def test_hourly_window_matches_loop(location_name, monkeypatch):
+    data = raw_fixture(location_name)
+    for now in instants(data):
+        monkeypatch.setattr(core_pesca, 'datetime', frozen_datetime(now))
+        assert core_pesca.process_hourly_forecast(data) == loop_hourly_forecast(data, now), now
+
+
+@pytest.fixture
+def offline_forecasts(tmp_path, monkeypatch):
+    """Previsioni di tutte le zone dalle fixture, senza rete e con uno storico dell'acqua temporaneo"""
+    fixtures = load_fixtures()
+    store = WaterTempStore(str(tmp_path / 'storico.bin'), legacy_path=None)
+    monkeypatch.setattr(acqua_pesca, 'water_temp_store', store)
+    monkeypatch.setattr(core_pesca, 'fetch_forecasts_stale', lambda zones, force_refresh=False, wait_missing=True: {
+        name: (fixtures[name], None, False) for name in zones
+    })
+    return fixtures
+
+
+def test_rows_match_loop(offline_forecasts):
+    forecasts = core_pesca.build_zone_forecasts(dict(ZONE_COORDINATES))
+    rows = core_pesca.forecasts_to_rows(forecasts)
+    moon_phase, season, today = get_moon_phase(), get_season(), date.today()
+    regulations = get_engine().regulations
+
+    expected = []
+    for location_name in ZONE_COORDINATES:
+        conditions = forecasts[location_name]['conditions']
+        assert conditions['success'] and conditions['hourly_forecast']
+        # Ciclo sulle specie come nell'app originale: presenti nella zona e aperte oggi
+        scores = [
+            (fish_name, calculate_fish_activity(fish, conditions, moon_phase, season, location_name))
+            for fish_name, fish in FISH_SPECIES.items()
+            if location_name in fish['habitat'] and regulations.is_open(fish_name, location_name, today)
+        ]
+        for fish_name, score in sorted(scores, key=lambda x: x[1], reverse=True):
+            expected.append({
+                'zone': location_name,
+                'air_temperature': round(offline_forecasts[location_name]['current']['temperature_2m'], 1),
+                'water_temperature': conditions['water_temperature'],
+                'pressure': round(offline_forecasts[location_name]['current']['pressure_msl']),
+                'weather_condition': get_weather_description(offline_forecasts[location_name]['current']['weather_code']),
+                'moon_phase': moon_phase,
+                'season': season,
+                'real_data': True,
+                'data_age': conditions['data_age'],
+                'species': fish_name,
+                'score': score,
+            })
+
+    window_fields = ('best_window_start', 'best_window_end', 'best_window_score')
+    assert [{k: v for k, v in row.items() if k not in window_fields} for row in rows] == expected
+    for row in rows:
+        if row['best_window_start'] is not None:
+            assert row['best_window_start'] < row['best_window_end']
+            assert 0 <= row['best_window_score'] <= 100
+
+
+def test_best_spots_never_wait_for_the_network(offline_forecasts, monkeypatch):
+    calls = []
+
+    def cached_only(zones, force_refresh=False, wait_missing=True):
+        calls.append(wait_missing)
+        # Panperduto è ancora in download: nessuna previsione da mostrare
+        return {name: (None, None, False) if name == 'Panperduto' else (offline_forecasts[name], None, True)
+                for name in zones}
+
+    monkeypatch.setattr(core_pesca, 'fetch_forecasts_stale', cached_only)
+    oleggio = ZONE_COORDINATES['Oleggio']
+    spots = core_pesca.best_spots(oleggio['lat'], oleggio['lon'], radius_km=100)
+    assert calls == [False]
+
+    assert {spot['zone'] for spot in spots} == set(ZONE_COORDINATES) - {'Panperduto'}
+    assert all(spot['stale'] for spot in spots)
+    assert [spot['score'] for spot in spots] == sorted((spot['score'] for spot in spots), reverse=True)
+    best = next(spot for spot in spots if spot['zone'] == 'Oleggio')
+    assert best['distance_km'] == 0
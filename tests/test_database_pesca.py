@@ -0,0 +1,142 @@
+import copy
+import json
+import os
+import pickle
+
+import pytest
+
+import database_pesca
+from database_pesca import DATA_FILE, DataWarning, Database, LiveTable, diff_data, load_data
+
+
+@pytest.fixture
+def raw():
+    with open(DATA_FILE, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def data_file(tmp_path, raw):
+    path = tmp_path / 'dati.json'
+    write(path, raw)
+    return path
+
+
+def write(path, content):
+    """Scrive il file e ne sposta la data di modifica: la firma cambia anche a parità di dimensione"""
+    text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+    path.write_text(text, encoding='utf-8')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9 * (1 + write.count)))
+    write.count += 1
+
+
+write.count = 0
+
+
+def test_edit_is_picked_up_and_listeners_get_the_diff(data_file, raw):
+    db = Database(str(data_file), check_interval=0)
+    received = []
+    db.subscribe(lambda old, new, changes: received.append((old, new, changes)))
+    before = db.data
+
+    assert db.maybe_reload() is None
+    raw['zone']['Oleggio']['lat'] += 0.01
+    raw['specie']['Carpa']['temp_max'] += 1
+    write(data_file, raw)
+
+    changes = db.maybe_reload()
+    assert changes == {'zones': {'Oleggio'}, 'calendar': set(), 'species': {'Carpa'}}
+    assert db.data['zones']['Oleggio']['lat'] == raw['zone']['Oleggio']['lat']
+    assert (db.version, db.reloads, db.error) == (2, 1, None)
+    assert received == [(before, db.data, changes)]
+    # I dati già letti non cambiano: la nuova versione è un dict nuovo
+    assert before['species']['Carpa']['temp_max'] == raw['specie']['Carpa']['temp_max'] - 1
+
+
+def test_check_interval_throttles_stat(data_file, raw):
+    db = Database(str(data_file), check_interval=3600)
+    raw['specie']['Carpa']['temp_max'] += 1
+    write(data_file, raw)
+    assert db.maybe_reload() is None
+    assert db.version == 1
+    # reload() non aspetta l'intervallo
+    assert db.reload()['species'] == {'Carpa'}
+
+
+def test_unchanged_content_publishes_nothing(data_file, raw):
+    db = Database(str(data_file), check_interval=0)
+    received = []
+    db.subscribe(lambda *args: received.append(args))
+    write(data_file, raw)
+    assert db.maybe_reload() is None
+    assert db.version == 1 and received == []
+
+
+@pytest.mark.parametrize('content', ['{"zone": {', '{"zone": {}}', '[]'])
+def test_invalid_file_keeps_previous_data(data_file, content):
+    db = Database(str(data_file), check_interval=0)
+    received = []
+    db.subscribe(lambda *args: received.append(args))
+    before = db.data
+    write(data_file, content)
+    with pytest.warns(DataWarning, match='non ricaricato'):
+        assert db.maybe_reload() is None
+    assert db.data is before and db.version == 1
+    assert db.error is not None and received == []
+
+
+def test_validator_rejects_version(data_file, raw):
+    db = Database(str(data_file), check_interval=0)
+
+    def no_hot_water(data):
+        if data['species']['Carpa']['temp_max'] > 40:
+            raise ValueError("Carpa troppo calda")
+
+    db.add_validator(no_hot_water)
+    before = db.data
+    raw['specie']['Carpa']['temp_max'] = 50
+    write(data_file, raw)
+    with pytest.warns(DataWarning, match='Carpa troppo calda'):
+        db.maybe_reload()
+    assert db.data is before
+
+    # Il file corretto viene accettato
+    raw['specie']['Carpa']['temp_max'] = 30
+    write(data_file, raw)
+    assert db.maybe_reload()['species'] == {'Carpa'}
+    assert db.error is None
+
+
+def test_water_change_counts_as_zone_change(data_file, raw):
+    old = load_data(str(data_file))
+    raw['zone']['Panperduto']['fattore_calore'] = 0.5
+    write(data_file, raw)
+    assert diff_data(old, load_data(str(data_file)))['zones'] == {'Panperduto'}
+
+
+def test_live_tables_follow_reloads(data_file, raw):
+    db = Database(str(data_file), check_interval=0)
+    zones = LiveTable(db, 'zones')
+    species = LiveTable(db, 'species')
+    assert dict(zones) == db.data['zones'] and len(species) == len(raw['specie'])
+
+    del raw['zone']['Oleggio']
+    raw['specie']['Carpa']['temp_min'] = 3
+    write(data_file, raw)
+    # La vista controlla il file a ogni accesso, come get_zones()
+    assert 'Oleggio' not in zones
+    assert species['Carpa']['temp_min'] == 3
+
+    # Copie e pickle sono dict ordinari con i dati del momento
+    snapshot = copy.deepcopy(species)
+    assert type(snapshot) is dict and snapshot == dict(species)
+    snapshot['Carpa']['temp_min'] = 99
+    assert species['Carpa']['temp_min'] == 3
+    assert pickle.loads(pickle.dumps(zones)) == dict(zones)
+
+
+def test_module_tables_are_live_views():
+    assert isinstance(database_pesca.FISH_SPECIES, LiveTable)
+    assert dict(database_pesca.ZONE_COORDINATES) == database_pesca.get_zones()
+    assert dict(database_pesca.FISHING_CALENDAR) == database_pesca.get_calendar()
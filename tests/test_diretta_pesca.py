@@ -0,0 +1,89 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import diretta_pesca
+from diretta_pesca import LiveFeed, conditions_diff, live_values
+
+ZONES = {'Oleggio': {'lat': 45.5967, 'lon': 8.6386}, 'Panperduto': {'lat': 45.6506, 'lon': 8.6917}}
+
+
+def conditions(temperature, fetched_at=1000.0):
+    return {'temperature': temperature, 'fetched_at': fetched_at, 'data_age': 5,
+            'hourly_activity': {'time': []}, 'hourly_forecast': []}
+
+
+@pytest.fixture
+def weather(monkeypatch):
+    """Condizioni restituite da get_all_zones_weather; registra ogni chiamata"""
+    state = {'values': {zone: conditions(10.0) for zone in ZONES}, 'calls': [], 'gate': None}
+
+    def all_zones_weather(zones=None, force_refresh=False, wait_missing=True):
+        state['calls'].append({'force_refresh': force_refresh, 'wait_missing': wait_missing})
+        if state['gate'] is not None:
+            state['gate'].wait(5)
+        return dict(state['values'])
+
+    monkeypatch.setattr(diretta_pesca, 'get_zones', lambda: ZONES)
+    monkeypatch.setattr(diretta_pesca, 'get_all_zones_weather', all_zones_weather)
+    return state
+
+
+def test_conditions_diff():
+    old = {'a': {'x': 1, 'y': 2}, 'b': {'x': 1}}
+    new = {'a': {'x': 1, 'y': 3}, 'c': {'x': 4}}
+    assert conditions_diff(old, new) == {'a': {'y': 3}, 'b': None, 'c': {'x': 4}}
+    assert conditions_diff(new, new) == {}
+
+
+def test_live_values_drop_excluded_fields():
+    assert live_values(conditions(10.0)) == {'temperature': 10.0, 'fetched_at': 1000.0, 'hourly_forecast': []}
+
+
+def test_snapshot_never_waits_for_the_network(weather):
+    feed = LiveFeed(interval=60)
+    assert feed.get('Oleggio')['temperature'] == 10.0
+    assert weather['calls'] == [{'force_refresh': False, 'wait_missing': False}]
+    # Entro l'intervallo si legge l'istantanea corrente
+    weather['values']['Oleggio'] = conditions(12.0)
+    assert feed.get('Oleggio')['temperature'] == 10.0
+    assert len(weather['calls']) == 1
+
+
+def test_readers_do_not_wait_for_a_rebuild(weather):
+    feed = LiveFeed(interval=60)
+    weather['gate'] = threading.Event()
+    builder = threading.Thread(target=feed.maybe_refresh)
+    builder.start()
+    while not weather['calls']:
+        time.sleep(0.005)
+    # La prima istantanea è in calcolo: chi arriva ora non aspetta e usa i propri dati
+    assert feed.get('Oleggio') is None
+    weather['gate'].set()
+    builder.join(5)
+    assert feed.get('Oleggio')['temperature'] == 10.0
+    assert len(weather['calls']) == 1
+
+
+def test_forced_refresh_downloads_in_background(weather, monkeypatch):
+    futures = {zone: Future() for zone in ZONES}
+    prefetched = []
+    monkeypatch.setattr(diretta_pesca, 'prefetch_zones', lambda zones, force_refresh=False: (
+        prefetched.append(force_refresh) or futures))
+    feed = LiveFeed(interval=60)
+    feed.maybe_refresh()
+
+    # Ritorna subito, senza ricalcolare: i dati nuovi non sono ancora arrivati
+    assert feed.refresh(force_refresh=True) is None
+    assert prefetched == [True] and len(weather['calls']) == 1
+    assert not feed.is_expired()
+
+    weather['values']['Oleggio'] = conditions(14.0, fetched_at=2000.0)
+    futures['Oleggio'].set_result({})
+    assert feed.get('Oleggio')['temperature'] == 14.0
+    assert len(weather['calls']) == 2
+    # Un solo ricalcolo per download concluso
+    assert feed.get('Oleggio')['temperature'] == 14.0
+    assert len(weather['calls']) == 2
@@ -0,0 +1,71 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+import effemeridi_pesca
+from effemeridi_pesca import MOON_PHASES, build_moon_table, get_moon_phase, moon_phase_indices
+
+NEW, WAXING, FIRST_QUARTER, FULL, LAST_QUARTER = MOON_PHASES
+
+# Date (UTC) delle fasi principali 2024-2025
+NEW_MOONS = [
+    '2024-01-11', '2024-02-09', '2024-03-10', '2024-04-08', '2024-05-08', '2024-06-06', '2024-07-05',
+    '2024-08-04', '2024-09-03', '2024-10-02', '2024-11-01', '2024-12-01', '2024-12-30',
+    '2025-01-29', '2025-02-28', '2025-03-29', '2025-04-27', '2025-05-27', '2025-06-25', '2025-07-24',
+    '2025-08-23', '2025-09-21', '2025-10-21', '2025-11-20', '2025-12-20',
+]
+FULL_MOONS = [
+    '2024-01-25', '2024-02-24', '2024-03-25', '2024-04-23', '2024-05-23', '2024-06-22', '2024-07-21',
+    '2024-08-19', '2024-09-18', '2024-10-17', '2024-11-15', '2024-12-15',
+    '2025-01-13', '2025-02-12', '2025-03-14', '2025-04-13', '2025-05-12', '2025-06-11', '2025-07-10',
+    '2025-08-09', '2025-09-07', '2025-10-07', '2025-11-05', '2025-12-04',
+]
+FIRST_QUARTERS = [
+    '2024-01-18', '2024-02-16', '2024-03-17', '2024-04-15', '2024-05-15', '2024-06-14', '2024-07-13',
+    '2024-08-12', '2024-09-11', '2024-10-10', '2024-11-09', '2024-12-08',
+]
+LAST_QUARTERS = [
+    '2024-01-04', '2024-02-02', '2024-03-03', '2024-04-01', '2024-05-01', '2024-05-30', '2024-06-28',
+    '2024-07-28', '2024-08-26', '2024-09-24', '2024-10-24', '2024-11-23', '2024-12-22',
+]
+
+
+@pytest.mark.parametrize('dates, label', [
+    (NEW_MOONS, NEW), (FULL_MOONS, FULL), (FIRST_QUARTERS, FIRST_QUARTER), (LAST_QUARTERS, LAST_QUARTER),
+])
+def test_known_phase_dates(dates, label):
+    assert [get_moon_phase(date.fromisoformat(day)) for day in dates] == [label] * len(dates)
+
+
+def test_table_matches_direct_computation(monkeypatch):
+    days = np.arange(np.datetime64('2024-01-01'), np.datetime64('2026-01-01'))
+    from_table = moon_phase_indices(days)
+    # Tabella di un solo giorno nel 1900: tutte le date sono fuori e si calcolano direttamente
+    outside = {**effemeridi_pesca.moon_table, 'start': np.datetime64('1900-01-01'), 'phase': np.zeros(1, dtype=np.int8)}
+    monkeypatch.setattr(effemeridi_pesca, 'moon_table', outside)
+    assert moon_phase_indices(days).tolist() == from_table.tolist()
+
+
+def test_shipped_table_is_current():
+    table = build_moon_table()
+    assert table['start'] == effemeridi_pesca.moon_table['start']
+    assert table['phase'].tolist() == effemeridi_pesca.moon_table['phase'].tolist()
+
+
+def test_every_cycle_has_a_new_moon_day():
+    phases = effemeridi_pesca.moon_table['phase']
+    new = np.flatnonzero(phases == MOON_PHASES.index(NEW))
+    runs = np.split(new, np.flatnonzero(np.diff(new) > 1) + 1)
+    # Uno o due giorni di luna nuova per ciclo, a distanza di un mese sinodico
+    assert {len(run) for run in runs} <= {1, 2}
+    starts = np.array([run[0] for run in runs])
+    assert np.diff(starts).min() >= 28 and np.diff(starts).max() <= 31
+    assert starts[0] < 31 and len(phases) - starts[-1] <= 31
+
+
+def test_phase_order_within_a_cycle():
+    days = np.arange(np.datetime64('2024-01-11'), np.datetime64('2024-02-09'))
+    labels = [MOON_PHASES[i] for i in moon_phase_indices(days)]
+    collapsed = [label for i, label in enumerate(labels) if i == 0 or label != labels[i - 1]]
+    assert collapsed == [NEW, WAXING, FIRST_QUARTER, FULL, LAST_QUARTER]
@@ -0,0 +1,181 @@
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+import requests
+
+import acqua_pesca
+import griglia_pesca
+from acqua_pesca import WaterTempStore, calculate_water_temperature
+from database_pesca import FISH_SPECIES, get_zones
+from effemeridi_pesca import get_moon_phase, get_season
+from griglia_pesca import GRID_VARIABLES, cell_water_params, fetch_grid, grid_water_temperature, score_grid
+from meteo_pesca import PAST_DAYS, get_weather_main, hourly_times
+from punteggio_pesca import calculate_fish_activity, get_engine
+
+# A metà mese: il primo giorno rigiocato e il precedente hanno la stessa media stagionale
+NOW = datetime(2024, 5, 20, 10, 30)
+FIRST_HOUR = datetime(2024, 5, 20 - PAST_DAYS)
+HOURS = 14 * 24
+CODES = [0, 1, 2, 3, 45, 61, 63, 80, 95]
+
+
+def hourly_payload(lat, lon, hours=HOURS):
+    """Blocco orario sintetico e riproducibile per una coordinata; valori esatti anche in float32"""
+    rng = np.random.default_rng(int(lat * 1e4) * 100000 + int(lon * 1e4))
+    day_cycle = np.sin(np.arange(hours) / 24 * 2 * np.pi - np.pi / 2)
+    return {'latitude': lat, 'longitude': lon, 'hourly': {
+        'time': [(FIRST_HOUR + timedelta(hours=i)).strftime('%Y-%m-%dT%H:%M') for i in range(hours)],
+        'temperature_2m': (np.round((14 + 6 * day_cycle + rng.normal(0, 2, hours)) * 2) / 2).tolist(),
+        'weather_code': rng.choice(CODES, hours).tolist(),
+        'wind_speed_10m': (np.round(rng.uniform(0, 12, hours) * 2) / 2).tolist(),
+        'pressure_msl': np.round(rng.uniform(995, 1030, hours)).tolist(),
+    }}
+
+
+class Response:
+    def __init__(self, data):
+        self._data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self._data
+
+
+class GridSession:
+    """Open-Meteo senza rete: una risposta per cella, con blocchi che falliscono a richiesta del test"""
+
+    def __init__(self, fail=(), short=(), mismatched=()):
+        self.fail, self.short, self.mismatched = set(fail), set(short), set(mismatched)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        lats = [float(lat) for lat in params['latitude'].split(',')]
+        lons = [float(lon) for lon in params['longitude'].split(',')]
+        with self._lock:
+            self.calls.append(lats)
+        if lats[0] in self.fail:
+            raise requests.HTTPError("503 Server Error")
+        payloads = [hourly_payload(lat, lon, HOURS - 24 if lat in self.mismatched else HOURS)
+                    for lat, lon in zip(lats, lons)]
+        if lats[0] in self.short:
+            payloads = payloads[:-1]
+        return Response(payloads[0] if len(payloads) == 1 else payloads)
+
+
+LATS = np.round(45.60 + 0.01 * np.arange(10), 4)
+LONS = np.full(10, 8.64)
+
+
+def test_fetch_grid_marks_failed_chunks(monkeypatch):
+    # Blocchi da 3 celle: [0-2] con la cella 1 su un altro asse orario, [3-5] in errore,
+    # [6-8] con una risposta in meno, [9] singolo (oggetto invece di lista)
+    session = GridSession(fail={LATS[3]}, short={LATS[6]}, mismatched={LATS[1]})
+    monkeypatch.setattr(griglia_pesca, 'http_session', session)
+    columns = fetch_grid(LATS, LONS, chunk_size=3, concurrency=2)
+
+    assert sorted(calls[0] for calls in session.calls) == [LATS[0], LATS[3], LATS[6], LATS[9]]
+    failed = {1, 3, 4, 5, 8}
+    assert set(np.flatnonzero(columns['failed'])) == failed
+    assert len(columns['time']) == HOURS
+    assert columns['time'][0] == np.datetime64(FIRST_HOUR, 'm')
+    for i, lat in enumerate(LATS):
+        for var in GRID_VARIABLES:
+            assert columns[var].shape == (len(LATS), HOURS)
+            if i in failed:
+                assert np.isnan(columns[var][i]).all(), (i, var)
+            else:
+                expected = np.array(hourly_payload(lat, LONS[i])['hourly'][var], dtype=np.float32)
+                assert np.array_equal(columns[var][i], expected), (i, var)
+
+
+def test_fetch_grid_without_answers_raises(monkeypatch):
+    monkeypatch.setattr(griglia_pesca, 'http_session', GridSession(fail=set(LATS[::3])))
+    with pytest.raises(RuntimeError):
+        fetch_grid(LATS, LONS, chunk_size=3)
+
+
+def grid_columns(points):
+    """Colonne come fetch_grid per le coordinate indicate; None come coordinata è una cella senza dati"""
+    columns = {var: np.full((len(points), HOURS), np.nan, dtype=np.float32) for var in GRID_VARIABLES}
+    for i, point in enumerate(points):
+        if point is not None:
+            hourly = hourly_payload(*point)['hourly']
+            for var in GRID_VARIABLES:
+                columns[var][i] = hourly[var]
+    columns['time'] = hourly_times(hourly_payload(0, 0)['hourly']['time'])
+    return columns
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return NOW
+
+
+@pytest.fixture
+def zone_cells():
+    zones = get_zones()
+    names = ['Oleggio', 'Lago di Varese']
+    points = [(zones[name]['lat'], zones[name]['lon']) for name in names]
+    return names, points
+
+
+def test_grid_water_matches_zone_model(zone_cells, tmp_path, monkeypatch):
+    names, points = zone_cells
+    store = WaterTempStore(str(tmp_path / 'storico.bin'), legacy_path=None)
+    monkeypatch.setattr(store, 'maybe_compact', lambda: None)
+    monkeypatch.setattr(acqua_pesca, 'water_temp_store', store)
+    monkeypatch.setattr(acqua_pesca, 'datetime', FrozenDatetime)
+
+    # Una cella sulle coordinate di ogni zona e una senza dati
+    columns = grid_columns(points + [None])
+    lats = np.array([lat for lat, _ in points] + [points[0][0]])
+    lons = np.array([lon for _, lon in points] + [points[0][1]])
+    water = grid_water_temperature(columns, cell_water_params(lats, lons, get_zones()), NOW)
+
+    hour = (NOW.replace(minute=0) - FIRST_HOUR) // timedelta(hours=1)
+    for i, (name, point) in enumerate(zip(names, points)):
+        hourly = hourly_payload(*point)['hourly']
+        current = {var: hourly[var][hour] for var in ('weather_code', 'wind_speed_10m')}
+        # Il modello dell'app per la zona, con la stessa previsione: acqua rigiocata e passo di oggi
+        expected = calculate_water_temperature(hourly['temperature_2m'][hour], current, name, hourly)
+        assert water[i] == expected, name
+    assert np.isnan(water[2])
+
+
+def test_score_grid_shapes_and_values(zone_cells, monkeypatch):
+    _, points = zone_cells
+    columns = grid_columns(points + [None])
+    columns['pressure_msl'][0, -5:] = np.nan
+    water = np.array([14.5, 21.0, np.nan])
+    engine = get_engine()
+
+    times, scores, valid = score_grid(columns, water, engine, NOW)
+    # Dall'ora corrente alla fine della previsione
+    assert times[0] == np.datetime64(NOW.replace(minute=0), 'm') and times[-1] == columns['time'][-1]
+    assert scores.shape == (len(engine.species_names), 3, len(times)) and scores.dtype == np.int16
+    assert valid.shape == (3, len(times))
+    assert valid[1].all() and not valid[2].any()
+    assert not valid[0, -5:].any() and valid[0, :-5].all()
+
+    # Il calcolo a blocchi non cambia il risultato
+    monkeypatch.setattr(griglia_pesca, 'SCORE_CHUNK_CELLS', 1)
+    assert np.array_equal(score_grid(columns, water, engine, NOW)[1], scores)
+
+    # Le celle non hanno zone preferite: come il punteggio scalare fuori da ogni zona
+    offset = len(columns['time']) - len(times)
+    for h in (0, 7, 50):
+        moment = times[h].astype(datetime)
+        for c in range(2):
+            weather = {'water_temperature': water[c],
+                       'pressure': float(np.round(columns['pressure_msl'][c, offset + h])),
+                       'weather_main': get_weather_main(int(columns['weather_code'][c, offset + h]))}
+            for s, name in enumerate(engine.species_names):
+                expected = calculate_fish_activity(FISH_SPECIES[name], weather, get_moon_phase(moment.date()),
+                                                   get_season(moment.date()), '')
+                assert scores[s, c, h] == expected, (name, c, h)
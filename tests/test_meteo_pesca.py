@@ -0,0 +1,255 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import meteo_pesca
+from archivio_pesca import SnapshotStore
+from cache_pesca import TTLCache
+
+LAT, LON = 45.73, 8.64
+
+
+def payload(lat, lon):
+    return {'latitude': lat, 'longitude': lon, 'utc_offset_seconds': 7200,
+            'current': {'time': time.strftime('%Y-%m-%dT%H:00'), 'temperature_2m': 12.0}}
+
+
+class Response:
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession:
+    """Sessione HTTP senza rete: risponde con un payload per coordinata, o con l'esito impostato dal test"""
+
+    def __init__(self):
+        self.calls = []
+        self.gate = None
+        self.status_code = 200
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        with self._lock:
+            self.calls.append(params)
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        lats = str(params['latitude']).split(',')
+        lons = str(params['longitude']).split(',')
+        points = [payload(float(lat), float(lon)) for lat, lon in zip(lats, lons)]
+        return Response(points[0] if len(points) == 1 else points, self.status_code)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """Stato del modulo ripulito: cache vuote, archivio temporaneo e nessun download in corso"""
+    session = FakeSession()
+    store = SnapshotStore(str(tmp_path))
+    monkeypatch.setattr(meteo_pesca, 'http_session', session)
+    monkeypatch.setattr(meteo_pesca, 'snapshot_store', store)
+    monkeypatch.setattr(meteo_pesca, 'forecast_cache', TTLCache(ttl=meteo_pesca.FORECAST_TTL))
+    monkeypatch.setattr(meteo_pesca, 'last_good_cache', TTLCache(ttl=meteo_pesca.LAST_GOOD_MAX_AGE, align=False))
+    monkeypatch.setattr(meteo_pesca, '_inflight', {})
+    monkeypatch.setattr(meteo_pesca, '_warmed', {})
+    yield session
+    store.flush()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condizione non raggiunta"
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_share_one_download(session):
+    session.gate = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(meteo_pesca.fetch_forecast(LAT, LON)))
+               for _ in range(5)]
+    threads[0].start()
+    wait_for(lambda: len(session.calls) == 1)
+    # Chi arriva durante il download aspetta lo stesso future invece di ripartire
+    future = meteo_pesca._inflight[meteo_pesca.forecast_key(LAT, LON)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    assert all(thread.is_alive() for thread in threads)
+    session.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(session.calls) == 1
+    assert len(results) == 5 and all(data is results[0] for data in results)
+    assert future.result() is results[0]
+    assert meteo_pesca._inflight == {}
+    # La seconda richiesta arriva dalla cache oraria
+    assert meteo_pesca.fetch_forecast(LAT, LON) is results[0]
+    assert len(session.calls) == 1
+
+
+def test_prefetch_joins_download_in_progress(session):
+    session.gate = threading.Event()
+    zones = {'Zona': {'lat': LAT, 'lon': LON}}
+    first = meteo_pesca.prefetch_zones(zones)
+    second = meteo_pesca.prefetch_zones(zones)
+    assert second['Zona'] is first['Zona']
+    session.gate.set()
+    assert first['Zona'].result(5)['latitude'] == LAT
+    assert len(session.calls) == 1
+    # Con la cache valida il prefetch non scarica nulla
+    assert meteo_pesca.prefetch_zones(zones) == {}
+
+
+def test_error_status_caches_nothing(session):
+    session.status_code = 500
+    assert meteo_pesca.fetch_forecast(LAT, LON) is None
+    assert meteo_pesca._inflight == {}
+    assert meteo_pesca.last_good_forecast(LAT, LON) == (None, None)
+    # La richiesta successiva riprova
+    session.status_code = 200
+    assert meteo_pesca.fetch_forecast(LAT, LON)['latitude'] == LAT
+    assert len(session.calls) == 2
+
+
+def test_timeout_propagates_and_clears_inflight(session):
+    session.error = requests.Timeout("lento")
+    with pytest.raises(requests.Timeout):
+        meteo_pesca.fetch_forecast(LAT, LON)
+    assert meteo_pesca._inflight == {}
+
+
+def test_stale_served_while_refreshing(session):
+    key = meteo_pesca.forecast_key(LAT, LON)
+    old = payload(LAT, LON)
+    meteo_pesca.last_good_cache.put(key, old, stored_at=time.time() - 7200)
+    session.gate = threading.Event()
+
+    # Cache oraria scaduta: l'ultima previsione valida torna subito e il download parte in un worker
+    data, fetched_at, stale = meteo_pesca.fetch_forecast_stale(LAT, LON)
+    assert (data, stale) == (old, True)
+    assert time.time() - fetched_at >= 7200
+    wait_for(lambda: len(session.calls) == 1)
+    session.gate.set()
+    wait_for(lambda: meteo_pesca.forecast_cache.contains(key))
+
+    data, _, stale = meteo_pesca.fetch_forecast_stale(LAT, LON)
+    assert data is not old and not stale
+    assert len(session.calls) == 1
+
+
+def test_failed_refresh_falls_back_to_last_good(session):
+    key = meteo_pesca.forecast_key(LAT, LON)
+    old = payload(LAT, LON)
+    meteo_pesca.last_good_cache.put(key, old, stored_at=time.time() - 60)
+    session.error = requests.Timeout("lento")
+
+    data, _, stale = meteo_pesca.fetch_forecast_stale(LAT, LON, force_refresh=True)
+    assert (data, stale) == (old, True)
+    # Senza nessuna previsione reale: (None, None, False)
+    assert meteo_pesca.fetch_forecast_stale(LAT + 1, LON) == (None, None, False)
+
+
+def test_warmed_is_bounded(session, monkeypatch):
+    monkeypatch.setattr(meteo_pesca, 'WARMED_MAX_ENTRIES', 8)
+    for i in range(50):
+        meteo_pesca._warm_from_disk(meteo_pesca.forecast_key(LAT + i / 10, LON))
+        assert len(meteo_pesca._warmed) <= 8
+    # Restano le zone lette più di recente
+    assert meteo_pesca.forecast_key(LAT + 4.9, LON) in meteo_pesca._warmed
+
+    # Una lettura ancora in corso non viene dimenticata
+    pending = threading.Event()
+    meteo_pesca._warmed['in corso'] = pending
+    for i in range(20):
+        meteo_pesca._warm_from_disk(meteo_pesca.forecast_key(LAT - i / 10, LON))
+    assert meteo_pesca._warmed['in corso'] is pending
+
+
+ZONES = {f'Zona {i}': {'lat': LAT + i / 10, 'lon': LON - i / 10} for i in range(6)}
+
+
+def test_prefetch_batches_all_zones_in_one_call(session):
+    futures = meteo_pesca.prefetch_zones(ZONES)
+    results = {name: future.result(5) for name, future in futures.items()}
+    assert len(session.calls) == 1
+    assert session.calls[0]['latitude'] == ','.join(str(coords['lat']) for coords in ZONES.values())
+    for name, coords in ZONES.items():
+        assert results[name]['latitude'] == coords['lat']
+        assert meteo_pesca.forecast_cache.get(meteo_pesca.forecast_key(coords['lat'], coords['lon'])) is results[name]
+    assert meteo_pesca._inflight == {}
+
+
+def test_prefetch_batches_only_missing_zones(session):
+    first = dict(list(ZONES.items())[:2])
+    for future in meteo_pesca.prefetch_zones(first).values():
+        future.result(5)
+    futures = meteo_pesca.prefetch_zones(ZONES)
+    for future in futures.values():
+        future.result(5)
+    assert sorted(futures) == sorted(ZONES.keys() - first.keys())
+    assert len(session.calls) == 2
+    assert session.calls[1]['latitude'].count(',') == len(futures) - 1
+
+
+def test_failed_batch_retries_each_zone(session, monkeypatch):
+    single = session.get
+
+    def batch_fails(url, params=None, timeout=None):
+        if ',' in str(params['latitude']):
+            with session._lock:
+                session.calls.append(params)
+            return Response(None, 500)
+        return single(url, params, timeout)
+
+    monkeypatch.setattr(session, 'get', batch_fails)
+    futures = meteo_pesca.prefetch_zones(ZONES)
+    # Le zone ripartono una per una con il proprio timeout: nessun future resta in sospeso
+    results = {name: future.result(5) for name, future in futures.items()}
+    assert len(session.calls) == 1 + len(ZONES)
+    assert all(results[name]['latitude'] == coords['lat'] for name, coords in ZONES.items())
+    assert meteo_pesca._inflight == {}
+
+
+def test_stale_zones_served_without_waiting(session):
+    old = {}
+    for name, coords in ZONES.items():
+        old[name] = payload(coords['lat'], coords['lon'])
+        meteo_pesca.last_good_cache.put(meteo_pesca.forecast_key(coords['lat'], coords['lon']), old[name],
+                                        stored_at=time.time() - 7200)
+    session.gate = threading.Event()
+
+    # Il download resta bloccato: le zone rispondono comunque subito con l'ultima previsione valida
+    start = time.perf_counter()
+    forecasts = meteo_pesca.fetch_forecasts_stale(ZONES)
+    assert time.perf_counter() - start < 1
+    assert all(forecasts[name][0] is old[name] and forecasts[name][2] for name in ZONES)
+    wait_for(lambda: len(session.calls) == 1)
+    session.gate.set()
+    wait_for(lambda: meteo_pesca._inflight == {})
+
+    forecasts = meteo_pesca.fetch_forecasts_stale(ZONES)
+    assert not any(stale for _, _, stale in forecasts.values())
+    assert len(session.calls) == 1
+
+
+def test_missing_zones_waited_unless_told_not_to(session):
+    session.gate = threading.Event()
+    forecasts = meteo_pesca.fetch_forecasts_stale(ZONES, wait_missing=False)
+    assert set(forecasts.values()) == {(None, None, False)}
+    session.gate.set()
+    wait_for(lambda: meteo_pesca._inflight == {})
+
+    # Zona mai vista: si aspetta il suo download
+    other = {'Nuova': {'lat': LAT - 1, 'lon': LON}}
+    data, fetched_at, stale = meteo_pesca.fetch_forecasts_stale(other)['Nuova']
+    assert data['latitude'] == LAT - 1 and not stale
+    assert len(session.calls) == 2
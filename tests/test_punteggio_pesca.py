@@ -0,0 +1,234 @@
+import itertools
+import json
+import warnings
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+import punteggio_pesca
+from cache_pesca import TTLCache
+from database_pesca import DATA_FILE, FISH_SPECIES, ZONE_COORDINATES, database
+from effemeridi_pesca import MOON_PHASES, SEASONS
+from punteggio_pesca import (WEATHER_MAINS, ScoringEngine, calculate_fish_activity, moon_index,
+                             ranking_fingerprint, season_index, weather_index, zone_ranking)
+from registro_pesca import RegistryWarning
+
+ZONES = list(ZONE_COORDINATES)
+MOONS = list(MOON_PHASES) + ['Fase sconosciuta']
+SEASONS_ALL = list(SEASONS) + ['Stagione sconosciuta']
+WEATHERS = list(WEATHER_MAINS) + ['Snow']
+
+
+def boundary_temperatures():
+    """Estremi degli intervalli, centro ± margine e valori appena fuori, per tutte le specie"""
+    temps = {-5.0, 0.0, 40.0}
+    for fish in FISH_SPECIES.values():
+        low, high = fish['temp_min'], fish['temp_max']
+        mid = (low + high) / 2
+        for value in (low, high, mid, mid - 3, mid + 3):
+            temps.update((value - 0.01, value, value + 0.01))
+    return sorted(temps)
+
+
+def boundary_pressures():
+    pressures = {950.0, 1013.0, 1060.0}
+    for fish in FISH_SPECIES.values():
+        for value in (fish['pressure_low'], fish['pressure_high']):
+            pressures.update((value - 0.1, value, value + 0.1))
+    return sorted(pressures)
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return ScoringEngine(FISH_SPECIES, ZONE_COORDINATES)
+
+
+def assert_matches_scalar(engine, conditions):
+    """Punteggi del motore (specie, zone, condizioni) contro calculate_fish_activity per ogni cella"""
+    temps, pressures, moons, seasons, weathers = (list(column) for column in zip(*conditions))
+    scores = engine.score(
+        np.array(temps)[None, :], np.array(pressures)[None, :],
+        moon_index(moons)[None, :], season_index(seasons)[None, :], weather_index(weathers)[None, :]
+    )
+    assert scores.shape == (len(FISH_SPECIES), len(ZONES), len(conditions))
+    for s, name in enumerate(engine.species_names):
+        for z, zone in enumerate(engine.zone_names):
+            expected = [
+                calculate_fish_activity(FISH_SPECIES[name], {'water_temperature': t, 'pressure': p, 'weather_main': w},
+                                        m, season, zone)
+                for t, p, m, season, w in conditions
+            ]
+            assert scores[s, z].tolist() == expected, (name, zone)
+
+
+def test_temperature_and_pressure_boundaries(engine):
+    # Fase, stagione e meteo ruotano tra le combinazioni per coprirle tutte lungo la griglia
+    labels = list(itertools.product(MOONS, SEASONS_ALL, WEATHERS))
+    conditions = [
+        (t, p, *labels[i % len(labels)])
+        for i, (t, p) in enumerate(itertools.product(boundary_temperatures(), boundary_pressures()))
+    ]
+    assert_matches_scalar(engine, conditions)
+
+
+def test_moon_season_and_weather_labels(engine):
+    temps = [boundary_temperatures()[0], 14.0, 22.0]
+    conditions = [
+        (t, 1013.0, m, season, w)
+        for t, m, season, w in itertools.product(temps, MOONS, SEASONS_ALL, WEATHERS)
+    ]
+    assert_matches_scalar(engine, conditions)
+
+
+def test_score_zone_matches_scalar_for_open_species(engine):
+    weather = {'water_temperature': 15.0, 'pressure': 1012.0, 'weather_main': 'Rain'}
+    day = date(2024, 7, 1)
+    for zone in ZONES:
+        scores = engine.score_zone(weather, MOON_PHASES[3], 'Estate', zone, day=day)
+        expected = {
+            name: calculate_fish_activity(fish, weather, MOON_PHASES[3], 'Estate', zone)
+            for name, fish in FISH_SPECIES.items()
+            if zone in fish['habitat'] and engine.regulations.is_open(name, zone, day)
+        }
+        assert scores == expected
+
+
+def test_score_clipped_to_range():
+    species = {'Test': {
+        'temp_min': 10, 'temp_max': 12, 'pressure_low': 1000, 'pressure_high': 1010,
+        'moon_best': [], 'season_best': [], 'habitat': ['Z'], 'zone_preferite': []
+    }}
+    zones = {'Z': {'lat': 45.0, 'lon': 9.0}}
+    low = ScoringEngine(species, zones, weights={'base': -40})
+    high = ScoringEngine(species, zones, weights={'base': 140})
+    args = (30.0, 1030.0, moon_index(MOONS[0]), season_index(SEASONS[0]), weather_index('Clear'))
+    assert low.score(*args).item() == 0
+    assert high.score(*args).item() == 100
+
+
+WEATHER = {'water_temperature': 15.0, 'pressure': 1012.0, 'weather_main': 'Rain'}
+
+
+@pytest.fixture
+def rankings(monkeypatch):
+    """Cache delle classifiche vuota per il test"""
+    cache = TTLCache(ttl=punteggio_pesca.FORECAST_TTL)
+    monkeypatch.setattr(punteggio_pesca, 'ranking_cache', cache)
+    return cache
+
+
+def days_with_different_open_species(zone):
+    """Due giorni dello stesso anno con specie aperte diverse nella zona"""
+    regulations = punteggio_pesca.get_engine().regulations
+    first = date(2024, 1, 1)
+    for offset in range(1, 366):
+        day = first + timedelta(days=offset)
+        if regulations.open_key(zone, day) != regulations.open_key(zone, first):
+            return first, day
+    pytest.skip(f"{zone}: stesse specie aperte tutto l'anno")
+
+
+def test_fingerprint_follows_inputs():
+    key = ranking_fingerprint(WEATHER, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01')
+    assert key == ranking_fingerprint(dict(WEATHER), MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01')
+    changed = [
+        ranking_fingerprint({**WEATHER, 'water_temperature': 15.1}, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01'),
+        ranking_fingerprint({**WEATHER, 'pressure': 1013.0}, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01'),
+        ranking_fingerprint({**WEATHER, 'weather_main': 'Clear'}, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01'),
+        ranking_fingerprint(WEATHER, MOON_PHASES[1], 'Estate', 'Oleggio', b'\x01'),
+        ranking_fingerprint(WEATHER, MOON_PHASES[0], 'Inverno', 'Oleggio', b'\x01'),
+        ranking_fingerprint(WEATHER, MOON_PHASES[0], 'Estate', 'Panperduto', b'\x01'),
+        ranking_fingerprint(WEATHER, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x03'),
+    ]
+    assert len({key, *changed}) == len(changed) + 1
+    # Solo gli input del punteggio: gli altri campi della previsione non contano
+    assert key == ranking_fingerprint({**WEATHER, 'wind_speed': 30}, MOON_PHASES[0], 'Estate', 'Oleggio', b'\x01')
+
+
+def test_zone_ranking_is_cached_per_fingerprint(rankings):
+    day = date(2024, 7, 1)
+    ranking = zone_ranking(WEATHER, MOON_PHASES[3], 'Estate', 'Oleggio', day)
+    assert zone_ranking(dict(WEATHER), MOON_PHASES[3], 'Estate', 'Oleggio', day) is ranking
+    assert rankings.stats()['entries'] == 1
+
+    scores = punteggio_pesca.get_engine().score_zone(WEATHER, MOON_PHASES[3], 'Estate', 'Oleggio', day)
+    assert dict(ranking) == scores
+    assert [score for _, score in ranking] == sorted(scores.values(), reverse=True)
+
+    # Una nuova previsione con acqua diversa: nuova voce
+    warmer = zone_ranking({**WEATHER, 'water_temperature': 24.0}, MOON_PHASES[3], 'Estate', 'Oleggio', day)
+    assert warmer != ranking and rankings.stats()['entries'] == 2
+
+
+def test_zone_ranking_follows_open_species(rankings):
+    before, after = days_with_different_open_species('Oleggio')
+    first = zone_ranking(WEATHER, MOON_PHASES[0], 'Primavera', 'Oleggio', before)
+    second = zone_ranking(WEATHER, MOON_PHASES[0], 'Primavera', 'Oleggio', after)
+    assert {name for name, _ in first} != {name for name, _ in second}
+    assert rankings.stats()['entries'] == 2
+
+
+@pytest.fixture
+def data_copy(tmp_path, monkeypatch):
+    """Il database dell'app su una copia del file; alla fine si torna all'originale"""
+    with open(DATA_FILE, encoding='utf-8') as f:
+        raw = json.load(f)
+    path = tmp_path / 'dati.json'
+
+    def write(content):
+        path.write_text(json.dumps(content, ensure_ascii=False), encoding='utf-8')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RegistryWarning)
+            return database.reload()
+
+    monkeypatch.setattr(database, 'path', str(path))
+    write(raw)
+    yield raw, write
+    monkeypatch.undo()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RegistryWarning)
+        database.reload()
+
+
+def cached_zones(cache, day):
+    """Zone la cui classifica per WEATHER del giorno day è ancora in cache"""
+    regulations = punteggio_pesca.get_engine().regulations
+    return {zone for zone in ZONE_COORDINATES if cache.contains(
+        ranking_fingerprint(WEATHER, MOON_PHASES[0], 'Estate', zone, regulations.open_key(zone, day)))}
+
+
+def open_day(species, zone):
+    regulations = punteggio_pesca.get_engine().regulations
+    return next(day for day in (date(2024, 1, 1) + timedelta(days=i) for i in range(366))
+                if regulations.is_open(species, zone, day))
+
+
+def test_reload_invalidates_rankings_of_affected_zones(rankings, data_copy):
+    raw, write = data_copy
+    # Il Persico Reale vive solo nei due laghi: i fiumi restano in cache
+    lakes = set(raw['specie']['Persico Reale']['habitat'])
+    day = open_day('Persico Reale', 'Lago di Varese')
+    before = {zone: zone_ranking(WEATHER, MOON_PHASES[0], 'Estate', zone, day) for zone in ZONE_COORDINATES}
+    engine = punteggio_pesca.get_engine()
+
+    raw['specie']['Persico Reale']['temp_min'] = 16
+    changes = write(raw)
+    assert changes['species'] == {'Persico Reale'}
+    assert punteggio_pesca.get_engine() is not engine
+    assert cached_zones(rankings, day) == set(ZONE_COORDINATES) - lakes
+
+    after = zone_ranking(WEATHER, MOON_PHASES[0], 'Estate', 'Lago di Varese', day)
+    assert dict(after)['Persico Reale'] < dict(before['Lago di Varese'])['Persico Reale']
+    assert zone_ranking(WEATHER, MOON_PHASES[0], 'Estate', 'Oleggio', day) is before['Oleggio']
+
+
+def test_reload_of_a_zone_invalidates_only_that_zone(rankings, data_copy):
+    raw, write = data_copy
+    day = date(2024, 7, 1)
+    for zone in ZONE_COORDINATES:
+        zone_ranking(WEATHER, MOON_PHASES[0], 'Estate', zone, day)
+    assert cached_zones(rankings, day) == set(ZONE_COORDINATES)
+    raw['zone']['Oleggio']['fattore_calore'] = 0.5
+    assert write(raw)['zones'] == {'Oleggio'}
+    assert cached_zones(rankings, day) == set(ZONE_COORDINATES) - {'Oleggio'}
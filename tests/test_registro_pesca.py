@@ -0,0 +1,154 @@
+import copy
+import os
+import pickle
+import subprocess
+import sys
+import warnings
+from datetime import date
+
+import numpy as np
+import pytest
+
+from benchmarks.bench_pesca import synthetic_tables
+from database_pesca import FISH_SPECIES, FISHING_CALENDAR, ZONE_COORDINATES
+from registro_pesca import RegistryWarning, SpeciesRegistry, species_registry, validate
+
+
+@pytest.fixture
+def data():
+    return copy.deepcopy(FISH_SPECIES), copy.deepcopy(ZONE_COORDINATES), copy.deepcopy(FISHING_CALENDAR)
+
+
+# Il regolamento non ammette la Carpa a Panperduto, dove vive: è l'unico avviso dei dati distribuiti
+SHIPPED_NOTICE = "Carpa: zone dell'habitat assenti dal calendario ['Panperduto'] (specie sempre chiusa)"
+
+
+def test_shipped_data_is_consistent():
+    assert validate(FISH_SPECIES, ZONE_COORDINATES, FISHING_CALENDAR) == ([], [SHIPPED_NOTICE])
+    assert species_registry.issues == (SHIPPED_NOTICE,)
+
+
+def test_import_emits_only_the_shipped_notice():
+    code = "import warnings\nwith warnings.catch_warnings(record=True) as caught:\n" \
+           "    warnings.simplefilter('always')\n    import registro_pesca\n" \
+           "print('\\n'.join(f'{w.category.__name__}: {w.message}' for w in caught))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=root)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == [f"RegistryWarning: {SHIPPED_NOTICE}"]
+
+
+@pytest.mark.parametrize('field, value, message', [
+    ('temp_min', 99, 'temp_min maggiore di temp_max'),
+    ('pressure_low', 1100, 'pressure_low maggiore di pressure_high'),
+    ('moon_best', ['Luna Blu'], "fase lunare sconosciuta 'Luna Blu'"),
+    ('season_best', ['Monsone'], "stagione sconosciuta 'Monsone'"),
+])
+def test_validate_errors(data, field, value, message):
+    species, zones, calendar = data
+    species['Carpa'][field] = value
+    errors, _ = validate(species, zones, calendar)
+    assert errors == [f"Carpa: {message}"]
+    with pytest.raises(ValueError, match=message):
+        SpeciesRegistry(species, zones, calendar)
+
+
+def test_validate_notices(data):
+    species, zones, calendar = data
+    species['Carpa']['habitat'].append('Lago di Como')
+    species['Carpa']['zone_preferite'] += ['Lago di Garda', 'Lago Maggiore - Lombardia']
+    calendar['Barbo']['zone'] = calendar['Barbo']['zone'][:1]
+    del calendar['Siluro']
+    calendar['Trota Iridea'] = calendar['Luccio']
+    calendar['Persico Reale']['zone'] = calendar['Persico Reale']['zone'] + ['Lago di Lugano']
+    calendar['Luccio']['divieti'] = ({'dal': (3, 15), 'al': (5, 31), 'zone': ('Lago di Como',), 'nota': ''},)
+
+    errors, notices = validate(species, zones, calendar)
+    assert errors == []
+    expected = [
+        "Carpa: l'habitat 'Lago di Como' non corrisponde a nessuna zona",
+        "Carpa: zona preferita sconosciuta 'Lago di Garda'",
+        "Carpa: zona preferita 'Lago Maggiore - Lombardia' fuori dall'habitat",
+        "Siluro: assente dal calendario",
+        "Trota Iridea: nel calendario ma non nella tabella specie",
+        "Persico Reale: zone del calendario sconosciute ['Lago di Lugano']",
+        "Luccio: zone del divieto sconosciute ['Lago di Como']",
+        "Barbo: zone dell'habitat assenti dal calendario",
+    ]
+    for message in expected:
+        assert any(notice.startswith(message) for notice in notices), message
+
+
+def test_calendar_habitat_mismatch_warns(data):
+    species, zones, calendar = data
+    calendar['Persico Reale']['zone'] = ['Lago di Varese']
+    with pytest.warns(RegistryWarning, match=r"Persico Reale: zone dell'habitat assenti dal calendario \['Lago Maggiore"):
+        registry = SpeciesRegistry(species, zones, calendar)
+    # Fuori dalle zone del calendario la specie resta chiusa anche dove vive
+    assert not registry.regulations.is_open('Persico Reale', 'Lago Maggiore - Lombardia', date(2024, 7, 1))
+
+
+def test_calendar_may_list_zones_outside_habitat(data):
+    species, zones, calendar = data
+    calendar['Carpa']['zone'] = list(zones)
+    assert validate(species, zones, calendar) == ([], [])
+
+
+def test_non_strict_keeps_invalid_data(data):
+    species, zones, calendar = data
+    species['Carpa']['temp_min'] = 99
+    with pytest.warns(RegistryWarning) as caught:
+        registry = SpeciesRegistry(species, zones, calendar, strict=False)
+    # Gli errori non diventano avvisi: si mostrano solo le note sui dati
+    assert [str(w.message) for w in caught] == [SHIPPED_NOTICE]
+    assert registry.issues == ("Carpa: temp_min maggiore di temp_max", SHIPPED_NOTICE)
+
+
+def test_lookups_match_tables():
+    registry = species_registry
+    for zone in ZONE_COORDINATES:
+        present = tuple(name for name, fish in FISH_SPECIES.items() if any(h in zone for h in fish['habitat']))
+        assert registry.species_in_zone(zone) == present
+        for name, fish in FISH_SPECIES.items():
+            assert registry.in_zone(name, zone) == (name in present)
+            assert registry.is_preferred(name, zone) == (zone in fish['zone_preferite'])
+    assert registry.species_in_zone('Lago di Como') == ()
+    assert 'Carpa' in registry.species_in_zone('Panperduto')
+
+
+def test_profile_is_read_only():
+    profile = species_registry.profile('Carpa')
+    assert profile['temp_min'] == FISH_SPECIES['Carpa']['temp_min']
+    with pytest.raises(TypeError):
+        profile['temp_min'] = 0
+    with pytest.raises(AttributeError):
+        species_registry.species_names = ()
+    with pytest.raises(ValueError):
+        species_registry.temp_min[0] = 0
+
+
+def test_pickle_round_trip(data):
+    species, zones, calendar = data
+    calendar['Carpa']['zone'] = ['Lago di Varese', 'Oleggio']
+    with pytest.warns(RegistryWarning):
+        registry = SpeciesRegistry(species, zones, calendar)
+
+    # Il registro si ricompila nel processo che lo riceve, senza ripetere gli avvisi
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        copy_ = pickle.loads(pickle.dumps(registry))
+    assert copy_.species_names == registry.species_names
+    assert copy_.zone_names == registry.zone_names
+    assert copy_.issues == registry.issues
+    for field in ('temp_min', 'temp_max', 'pressure_low', 'pressure_high', 'moon_mask', 'season_mask',
+                  'habitat', 'zone_preferred', 'calendar_zones'):
+        assert np.array_equal(getattr(copy_, field), getattr(registry, field)), field
+    assert copy_.habitat_mask == registry.habitat_mask
+    assert dict(copy_.species_by_zone) == dict(registry.species_by_zone)
+    assert np.array_equal(copy_.regulations.open, registry.regulations.open)
+
+
+@pytest.mark.parametrize('size', [10, 100])
+def test_synthetic_tables_validate_cleanly(size):
+    zones, species = synthetic_tables(size, size)
+    assert validate(species, zones) == ([], [])
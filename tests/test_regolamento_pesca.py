@@ -0,0 +1,137 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from database_pesca import FISH_SPECIES, FISHING_CALENDAR, ZONE_COORDINATES
+from effemeridi_pesca import MOON_PHASES
+from punteggio_pesca import ScoringEngine, zone_ranking
+from registro_pesca import species_registry
+from regolamento_pesca import RegulationCalendar, day_slot, day_slots, occurrence
+
+ZONES = list(ZONE_COORDINATES)
+# Un anno bisestile e uno no, con i passaggi d'anno
+DAYS = [date(2023, 12, 1) + timedelta(days=i) for i in range(31 + 366 + 365 + 31)]
+CALENDAR = {
+    **FISHING_CALENDAR,
+    # Stagione a cavallo dell'anno e divieto limitato a una zona, assenti dai dati distribuiti
+    'Bottatrice': {'apertura': (10, 1), 'chiusura': (2, 28), 'zone': ('Oleggio', 'Panperduto'),
+                   'divieti': ({'dal': (12, 20), 'al': (1, 10), 'zone': ('Oleggio',), 'nota': ''},)},
+}
+
+
+def in_period(day, start, end):
+    """Confronto diretto di (mese, giorno) con il periodo, come lo leggerebbe una persona"""
+    key = (day.month, day.day)
+    return start <= key <= end if start <= end else key >= start or key <= end
+
+
+def brute_open(entry, zone, day):
+    if entry is None:
+        return True
+    if zone not in entry['zone'] or not in_period(day, entry['apertura'], entry['chiusura']):
+        return False
+    return not any(
+        (period['zone'] is None or zone in period['zone']) and in_period(day, period['dal'], period['al'])
+        for period in entry.get('divieti', ())
+    )
+
+
+@pytest.fixture(scope='module')
+def regulations():
+    return RegulationCalendar(CALENDAR, FISH_SPECIES, ZONES)
+
+
+def test_day_slots_match_scalar():
+    assert day_slots(DAYS).tolist() == [day_slot(day) for day in DAYS]
+    # Lo stesso giorno del calendario ha la stessa posizione in ogni anno
+    assert day_slot(date(2023, 3, 1)) == day_slot(date(2024, 3, 1)) == day_slot(date(2024, 2, 29)) + 1
+
+
+def test_open_matches_brute_force(regulations):
+    for name in regulations.species_names:
+        entry = CALENDAR.get(name)
+        for zone in ZONES:
+            expected = [brute_open(entry, zone, day) for day in DAYS]
+            assert [regulations.is_open(name, zone, day) for day in DAYS] == expected, (name, zone)
+            legal = regulations.legal_matrix(zone, DAYS)[regulations.species_ids[name]]
+            assert legal.tolist() == expected, (name, zone)
+
+
+def test_next_opening_and_last_open_day_match_brute_force(regulations):
+    for name in ('Trota Fario', 'Luccio', 'Bottatrice'):
+        entry = CALENDAR[name]
+        for zone in ('Oleggio', 'Lago di Varese'):
+            for day in DAYS[::7]:
+                following = (day + timedelta(days=i) for i in range(400))
+                opening = next((d for d in following if brute_open(entry, zone, d)), None)
+                assert regulations.next_opening(name, zone, day) == opening, (name, zone, day)
+                if brute_open(entry, zone, day):
+                    last = day
+                    while brute_open(entry, zone, last + timedelta(days=1)):
+                        last += timedelta(days=1)
+                    assert regulations.last_open_day(name, zone, day) == last, (name, zone, day)
+                else:
+                    assert regulations.last_open_day(name, zone, day) is None
+
+
+def test_next_openings_vectorised(regulations):
+    found = regulations.next_openings('Luccio', 'Oleggio', DAYS)
+    assert [d.astype(date) for d in found] == [regulations.next_opening('Luccio', 'Oleggio', d) for d in DAYS]
+    # Sempre aperta: nessuna chiusura; fuori dalle zone del calendario: nessuna apertura
+    assert np.isnat(regulations.next_closings('Carpa', 'Oleggio', DAYS)).all()
+    assert regulations.next_opening('Trota Fario', 'Lago di Varese', date(2024, 6, 1)) is None
+
+
+def test_luccio_divieto(regulations):
+    for zone in CALENDAR['Luccio']['zone']:
+        assert regulations.is_open('Luccio', zone, date(2024, 3, 14))
+        assert not regulations.is_open('Luccio', zone, date(2024, 3, 15))
+        assert not regulations.is_open('Luccio', zone, date(2024, 5, 31))
+        assert regulations.next_opening('Luccio', zone, date(2024, 4, 1)) == date(2024, 6, 1)
+        assert regulations.last_open_day('Luccio', zone, date(2024, 1, 10)) == date(2024, 3, 14)
+    assert 'Luccio' not in regulations.legal_species('Oleggio', date(2024, 4, 1))
+    assert 'Oleggio' not in regulations.open_zones('Luccio', date(2024, 4, 1))
+
+
+def test_periods_span_year_end(regulations):
+    assert regulations.periods[('Bottatrice', 'Panperduto')] == (
+        (day_slot(date(2024, 10, 1)), day_slot(date(2024, 2, 28))),
+    )
+    # Il divieto di Oleggio spezza la stagione in due periodi
+    assert len(regulations.periods[('Bottatrice', 'Oleggio')]) == 2
+    assert ('Bottatrice', 'Lago di Varese') not in regulations.periods
+
+
+@pytest.mark.parametrize('day, expected', [
+    (date(2024, 12, 25), (date(2024, 12, 20), date(2025, 1, 10))),
+    (date(2025, 1, 5), (date(2024, 12, 20), date(2025, 1, 10))),
+    (date(2025, 1, 11), (date(2025, 12, 20), date(2026, 1, 10))),
+    (date(2025, 6, 1), (date(2025, 12, 20), date(2026, 1, 10))),
+])
+def test_occurrence_across_year_end(day, expected):
+    assert occurrence((12, 20), (1, 10), day) == expected
+
+
+def test_occurrence_within_year():
+    assert occurrence((3, 15), (5, 31), date(2024, 4, 1)) == (date(2024, 3, 15), date(2024, 5, 31))
+    assert occurrence((3, 15), (5, 31), date(2024, 6, 1)) == (date(2025, 3, 15), date(2025, 5, 31))
+    assert occurrence((3, 15), (5, 31), date(2024, 1, 1)) == (date(2024, 3, 15), date(2024, 5, 31))
+
+
+def test_carpa_follows_the_calendar_not_the_habitat():
+    # Il regolamento ammette la Carpa a Lago di Varese, Oleggio e Lago Maggiore, non a Panperduto dove vive
+    regulations = species_registry.regulations
+    day = date(2024, 7, 1)
+    assert regulations.open_zones('Carpa', day) == tuple(
+        zone for zone in species_registry.zone_names if zone in FISHING_CALENDAR['Carpa']['zone']
+    )
+    assert not regulations.is_open('Carpa', 'Panperduto', day)
+    assert regulations.is_open('Carpa', 'Lago Maggiore - Lombardia', day)
+
+    weather = {'water_temperature': 20.0, 'pressure': 1012.0, 'weather_main': 'Clouds'}
+    engine = ScoringEngine(registry=species_registry)
+    for zone, ranked in (('Panperduto', False), ('Oleggio', True), ('Lago Maggiore - Lombardia', False)):
+        # Punteggiata solo dove vive e il calendario la ammette
+        assert ('Carpa' in engine.score_zone(weather, MOON_PHASES[0], 'Estate', zone, day=day)) == ranked, zone
+        assert ('Carpa' in dict(zone_ranking(weather, MOON_PHASES[0], 'Estate', zone, day=day))) == ranked, zone
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from spaziale_pesca import KM_PER_DEGREE, SpatialIndex, haversine_km
+
+
+def brute_force(names, lats, lons, lat, lon):
+    distance = haversine_km(lat, lon, np.asarray(lats), np.asarray(lons))
+    order = np.argsort(distance, kind='stable')
+    return [(names[i], float(distance[i])) for i in order]
+
+
+def brute_within(points, lat, lon, radius_km):
+    return [(name, km) for name, km in brute_force(*points, lat, lon) if km <= radius_km]
+
+
+def assert_same(found, expected):
+    assert [name for name, _ in found] == [name for name, _ in expected]
+    assert [km for _, km in found] == pytest.approx([km for _, km in expected])
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(7)
+    lats = rng.uniform(44.5, 46.5, 3000)
+    lons = rng.uniform(8.0, 10.5, 3000)
+    # Punti esattamente sui bordi dei secchi e a cavallo di essi
+    edges = np.round(np.arange(45.0, 46.01, 0.1), 10)
+    grid_lats, grid_lons = np.meshgrid(edges, np.round(np.arange(8.5, 9.51, 0.1), 10))
+    offsets = np.array([-1e-9, 0.0, 1e-9])
+    lats = np.concatenate([lats, grid_lats.ravel(), 45.5 + offsets, np.full(3, 45.5)])
+    lons = np.concatenate([lons, grid_lons.ravel(), np.full(3, 9.0), 9.0 + offsets])
+    names = [f'p{i}' for i in range(len(lats))]
+    return names, lats, lons
+
+
+@pytest.fixture(scope='module')
+def index(points):
+    return SpatialIndex(*points)
+
+
+QUERIES = [(45.5, 9.0), (45.45, 8.95), (45.0, 8.5), (46.0, 9.5), (44.9999999, 9.0000001), (45.8167, 8.7333)]
+
+
+@pytest.mark.parametrize('lat, lon', QUERIES)
+@pytest.mark.parametrize('radius_km', [0.5, 5, 11.1, 20, 60])
+def test_within_matches_brute_force(index, points, lat, lon, radius_km):
+    assert_same(index.within(lat, lon, radius_km), brute_within(points, lat, lon, radius_km))
+
+
+@pytest.mark.parametrize('lat, lon', QUERIES + [(47.5, 11.0), (40.0, 5.0)])
+@pytest.mark.parametrize('k', [1, 3, 50])
+def test_nearest_matches_brute_force(index, points, lat, lon, k):
+    assert_same(index.nearest(lat, lon, k), brute_force(*points, lat, lon)[:k])
+
+
+def test_radius_doubling_reaches_far_points():
+    # Pochi punti lontani: il raggio parte da un secchio (~11 km) e raddoppia molte volte
+    names = ['Milano', 'Roma', 'Oslo', 'Città del Capo', 'Sydney']
+    lats = [45.46, 41.90, 59.91, -33.92, -33.87]
+    lons = [9.19, 12.50, 10.75, 18.42, 151.21]
+    index = SpatialIndex(names, lats, lons)
+    points = (names, lats, lons)
+    for lat, lon in [(45.8, 8.7), (70.0, 25.0), (-40.0, 20.0), (0.0, 0.0), (-60.0, 140.0)]:
+        for k in range(1, 6):
+            assert_same(index.nearest(lat, lon, k), brute_force(*points, lat, lon)[:k])
+
+
+@pytest.mark.parametrize('center_lat', [0.0, 45.0, 60.0, 80.0])
+def test_large_radius_includes_the_wide_part_of_the_circle(center_lat):
+    # A grandi raggi il cerchio è più largo in longitudine verso il polo che al centro
+    radius_km = 2000.0
+    lats = np.linspace(max(center_lat - 17.9, -89.9), min(center_lat + 17.9, 89.9), 200)
+    candidates = []
+    for lat in lats:
+        for lon in np.linspace(-60, 60, 241):
+            candidates.append((lat, lon))
+    lats, lons = (np.array(column) for column in zip(*candidates))
+    names = list(range(len(lats)))
+    index = SpatialIndex(names, lats, lons, cell_deg=0.5)
+    assert_same(index.within(center_lat, 0.0, radius_km), brute_within((names, lats, lons), center_lat, 0.0, radius_km))
+
+
+def test_max_km_and_empty_index(index, points):
+    assert index.nearest(45.5, 9.0, k=5, max_km=0.0001) == [
+        (name, km) for name, km in brute_force(*points, 45.5, 9.0)[:5] if km <= 0.0001
+    ]
+    empty = SpatialIndex([], [], [])
+    assert len(empty) == 0
+    assert empty.nearest(45.5, 9.0, k=3) == []
+    assert empty.within(45.5, 9.0, 50) == []
+    assert index.nearest(45.5, 9.0, k=0) == []
+
+
+def test_one_cell_is_about_eleven_km():
+    assert 0.1 * KM_PER_DEGREE == pytest.approx(11.12, abs=0.01)